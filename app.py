@@ -1,17 +1,22 @@
 import streamlit as st
 import pandas as pd
-import plotly.graph_objects as go
-from reagent_optimizer import ReagentOptimizer
-import sqlite3
+from reagent_optimizer import get_optimizer, get_reagent_color, serialize_configuration
+import audit_log
+import lims_db
+import profiling
+from lims_db import create_connection
+from job_queue import JobQueue
+import hashlib
+import os
+import shared_cache
+import uuid
+from scan_ingest import ScanIngestor
+from session_store import SessionStore
 from datetime import datetime
-from io import BytesIO
-import xlsxwriter
 
-if 'tray_state' not in st.session_state:
-    st.session_state.tray_state = {
-        'config': None,  # Initialize with default values
-        'selected_experiments': []  # Example default for selected experiments
-    }
+# plotly, reports (xlsxwriter, pyarrow), wo_import and production_analytics
+# are imported inside the sections that use them; only the selected section
+# is rendered (see main), so a cold start only pays for the Dashboard.
 
 
 # Page config
@@ -65,6 +70,8 @@ st.markdown("""
    
 
 def search_and_reports():
+   from reports import REPORT_TYPES
+
    st.header("Search & Reports")
    
    search_type = st.radio("Search By", 
@@ -110,165 +117,91 @@ def search_and_reports():
    # Report generation 
    st.subheader("Generate Reports")
    report_type = st.selectbox("Report Type",
-       ["Work Order Summary", "Production Statistics", 
-        "Shipping Log", "Inventory Status"],
+       list(REPORT_TYPES),
        key="report_type_select"
    )
 
+   queue = get_job_queue()
    if st.button("Generate Report", key="generate_report_button"):
-       if report_type == "Work Order Summary":
-           generate_wo_summary(c)
-       elif report_type == "Production Statistics":
-           generate_production_stats(c)  
-       elif report_type == "Shipping Log":
-           generate_shipping_log(c)
-       else:
-           generate_inventory_report(c)
+       st.session_state.report_job = queue.submit("report", {"report_type": report_type})
+
+   report_job = st.session_state.get("report_job")
+   if report_job:
+       job = track_job(report_job, "report_job", "Generating report...")
+       if job and job["status"] == "Complete":
+           report = queue.result(report_job)
+           st.markdown(f"#### {report.title}")
+           st.dataframe(report.frame, use_container_width=True)
+           st.download_button("Download Report", report.xlsx, file_name=report.filename,
+                              mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                              key="download_report_button")
            
    conn.close()
 
-def create_connection():
-    return sqlite3.connect('reagent_lims.db')
-
-def setup_database():
-    conn = create_connection()
-    c = conn.cursor()
-    
-    # Create tables with updated schema
-    c.execute('''CREATE TABLE IF NOT EXISTS work_orders
-                 (id TEXT PRIMARY KEY,
-                  customer TEXT,
-                  requester TEXT,
-                  date TEXT,
-                  status TEXT)''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS trays
-                 (id INTEGER PRIMARY KEY,
-                  wo_id TEXT,
-                  customer TEXT,
-                  requester TEXT,
-                  date TEXT,
-                  configuration TEXT,
-                  FOREIGN KEY(wo_id) REFERENCES work_orders(id))''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS production
-                 (id INTEGER PRIMARY KEY,
-                  tray_id INTEGER,
-                  wo_id TEXT,
-                  start_date TEXT,
-                  end_date TEXT,
-                  status TEXT,
-                  FOREIGN KEY(tray_id) REFERENCES trays(id),
-                  FOREIGN KEY(wo_id) REFERENCES work_orders(id))''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS shipping
-                 (id INTEGER PRIMARY KEY,
-                  tray_id INTEGER,
-                  wo_id TEXT,
-                  customer TEXT,
-                  requester TEXT,
-                  tracking_number TEXT,
-                  ship_date TEXT,
-                  FOREIGN KEY(tray_id) REFERENCES trays(id),
-                  FOREIGN KEY(wo_id) REFERENCES work_orders(id))''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS inventory
-                 (id INTEGER PRIMARY KEY,
-                  wo_id TEXT,
-                  reagent TEXT,
-                  batch TEXT,
-                  quantity INTEGER,
-                  date TEXT,
-                  status TEXT,
-                  FOREIGN KEY(wo_id) REFERENCES work_orders(id))''')
-    
-    conn.commit()
-    conn.close()
+   st.divider()
+   display_catalog_simulator()
+
+def display_catalog_simulator():
+    st.subheader("Catalog What-If")
+    st.caption("Change reagent volumes per test and see how tray life would change for every tray built so far.")
+
+    catalog = {}
+    for exp in get_optimizer().experiment_data.values():
+        for reagent in exp["reagents"]:
+            catalog.setdefault(reagent["code"], reagent["vol"])
+    volumes = pd.DataFrame({"Reagent": list(catalog), "Volume (uL)": list(catalog.values())})
+    edited = st.data_editor(volumes, disabled=["Reagent"], hide_index=True,
+                            use_container_width=True, key="catalog_volumes_editor")
+
+    # A cleared cell comes back as NaN; blank and non-positive volumes are left out
+    new_volumes = pd.to_numeric(edited["Volume (uL)"], errors="coerce")
+    invalid = new_volumes.isna() | (new_volumes <= 0)
+    if invalid.any():
+        st.warning(f"Ignoring blank or non-positive volumes for: {', '.join(edited.loc[invalid, 'Reagent'])}")
+    changed = ~invalid & (new_volumes != volumes["Volume (uL)"])
+    edits = dict(zip(edited.loc[changed, "Reagent"], new_volumes[changed].astype(int)))
+
+    queue = get_job_queue()
+    if st.button("Run Simulation", key="run_simulation_button", disabled=not edits):
+        st.session_state.simulation_job = queue.submit("simulate_catalog", {"edits": edits})
+
+    simulation_job = st.session_state.get("simulation_job")
+    if simulation_job:
+        job = track_job(simulation_job, "simulation_job", "Re-optimizing stored trays...")
+        if job and job["status"] == "Complete":
+            import plotly.graph_objects as go
+
+            result = queue.result(simulation_job)
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Trays Affected", f"{result.affected_trays} / {result.total_trays}")
+            col2.metric("Median Change (tests)", f"{result.distribution['50%']:+.0f}")
+            col3.metric("Worst Change (tests)", f"{result.distribution['min']:+.0f}")
+
+            fig = go.Figure(go.Bar(x=result.histogram.index, y=result.histogram.values))
+            fig.update_layout(height=350, title="Tray Life Change", xaxis_title="Change in tests",
+                              yaxis_title="Trays")
+            st.plotly_chart(fig, use_container_width=True)
+            st.dataframe(result.per_set.rename(columns={
+                "experiments": "Experiments", "life_before": "Tests Before", "life_after": "Tests After",
+                "trays": "Trays", "delta": "Change", "delta_pct": "Change %",
+            }), use_container_width=True, hide_index=True)
 
 def save_configuration_to_inventory(wo_id, config):
-    """Saves the tray configuration to the inventory table."""
+    """Saves the tray configuration as the work order's tray."""
+    if not wo_id:
+        st.warning("No work order selected; configuration was not saved.")
+        return
     conn = create_connection()
-    c = conn.cursor()
     try:
-        # Save the configuration as a string in the inventory table
-        c.execute("""
-            UPDATE inventory 
-            SET configuration = ? 
-            WHERE wo_id = ?
-        """, (str(config), wo_id))
-        conn.commit()
+        lims_db.save_tray_configuration(conn, wo_id, config)
     except Exception as e:
         st.error(f"Error saving configuration to inventory: {e}")
     finally:
         conn.close()
 
-def generate_wo_number():
-    conn = create_connection()
-    c = conn.cursor()
-    
-    now = datetime.now()
-    year = now.strftime('%y')
-    month = now.strftime('%m')
-    
-    pattern = f'WO-{year}-{month}-%'
-    c.execute("SELECT id FROM work_orders WHERE id LIKE ? ORDER BY id DESC LIMIT 1", (pattern,))
-    last_wo = c.fetchone()
-    
-    if last_wo:
-        last_num = int(last_wo[0].split('-')[-1])
-        new_num = str(last_num + 1).zfill(4)
-    else:
-        new_num = '0001'
-    
-    conn.close()
-    return f"WO-{year}-{month}-{new_num}"
-
-def get_next_step(wo_id):
-    conn = create_connection()
-    c = conn.cursor()
-    
-    c.execute("SELECT status FROM work_orders WHERE id=?", (wo_id,))
-    status = c.fetchone()[0]
-    
-    if status == 'Open':
-        c.execute("SELECT id FROM trays WHERE wo_id=?", (wo_id,))
-        if not c.fetchone():
-            conn.close()
-            return "Configure Tray", 2
-        
-        c.execute("SELECT status FROM production WHERE wo_id=?", (wo_id,))
-        prod_status = c.fetchone()
-        if not prod_status or prod_status[0] != 'Complete':
-            conn.close()
-            return "Complete Production", 4
-        
-        c.execute("SELECT id FROM shipping WHERE wo_id=?", (wo_id,))
-        if not c.fetchone():
-            conn.close()
-            return "Ship Tray", 5
-    
-    conn.close()
-    return "Work Order Complete", None
-
-def get_reagent_color(reagent_code):
-    color_map = {
-        'gray': ['KR1E', 'KR1S', 'KR2S', 'KR3E', 'KR3S', 'KR4E', 'KR4S', 'KR5E', 'KR5S', 'KR6E1', 'KR6E2', 'KR6E3', 'KR13E1', 'KR13S', 'KR14E', 'KR14S', 'KR15E', 'KR15S'],
-        'violet': ['KR7E1', 'KR7E2', 'KR8E1', 'KR8E2', 'KR19E1', 'KR19E2', 'KR19E3', 'KR20E', 'KR36E1', 'KR36E2', 'KR40E1', 'KR40E2'],
-        'green': ['KR9E1', 'KR9E2', 'KR17E1', 'KR17E2', 'KR17E3', 'KR28E1', 'KR28E2', 'KR28E3'],
-        'orange': ['KR10E1', 'KR10E2', 'KR10E3', 'KR12E1', 'KR12E2', 'KR12E3', 'KR18E1', 'KR18E2', 'KR22E1', 'KR27E1', 'KR27E2', 'KR42E1', 'KR42E2'],
-        'white': ['KR11E', 'KR21E1'],
-        'blue': ['KR16E1', 'KR16E2', 'KR16E3', 'KR16E4', 'KR30E1', 'KR30E2', 'KR30E3', 'KR31E1', 'KR31E2', 'KR34E1', 'KR34E2'],
-        'red': ['KR29E1', 'KR29E2', 'KR29E3'],
-        'yellow': ['KR35E1', 'KR35E2']
-    }
-    for color, reagents in color_map.items():
-        if any(reagent_code.startswith(r) for r in reagents):
-            return color
-    return 'lightgray'
-
-
-
 def create_tray_visualization(config):
+    import plotly.graph_objects as go
+
     locations = config.get("tray_locations", [])  # Default to an empty list if missing
     fig = go.Figure()
 
@@ -330,6 +263,18 @@ def create_tray_visualization(config):
 
 
 
+def get_tray_figure(config):
+    """Tray figure for a configuration, rendered once and shared across worker processes."""
+    import plotly.io as pio
+
+    key = hashlib.sha1(serialize_configuration(config).encode("utf-8")).hexdigest()
+    fig_json = shared_cache.get_or_compute(
+        shared_cache.TRAY_FIGURES, key, lambda: create_tray_visualization(config).to_json()
+    )
+    return pio.from_json(fig_json)
+
+
+
 def display_results(config, selected_experiments):
     # Left-align the tray configuration section with visual separation
     st.markdown("### Tray Configuration and Results")
@@ -415,26 +360,15 @@ def manage_work_orders():
         
         submitted = cols[2].form_submit_button("Create Work Order")
         if submitted and customer and requester:
-            wo_id = generate_wo_number()
             conn = create_connection()
-            c = conn.cursor()
             
             try:
-                c.execute("""INSERT INTO work_orders 
-                            (id, customer, requester, date, status) 
-                            VALUES (?, ?, ?, ?, ?)""",
-                         (wo_id, customer, requester, date.strftime('%Y-%m-%d'), 'Open'))
-                
-                c.execute("""INSERT INTO inventory 
-                            (wo_id, date, status) 
-                            VALUES (?, ?, ?)""",
-                         (wo_id, date.strftime('%Y-%m-%d'), 'Created'))
-                conn.commit()
+                wo_id = lims_db.create_work_order(conn, customer, requester, date)
                 
-                st.session_state.current_wo = wo_id
+                set_current_wo(wo_id)
                 st.session_state.wo_created = True
                 
-                next_step, tab_index = get_next_step(wo_id)
+                next_step, tab_index = lims_db.get_next_step(conn, wo_id)
                 st.session_state.next_tab = tab_index
                 st.success(f"Work Order {wo_id} created. Next step: {next_step}")
                 
@@ -443,6 +377,31 @@ def manage_work_orders():
             finally:
                 conn.close()
 
+    with st.expander("Bulk Import Work Orders"):
+        st.caption("CSV or Excel with columns: customer, requester, date (optional), "
+                   "experiments (optional, e.g. 1;5;12)")
+        upload = st.file_uploader("Work order file", type=["csv", "xlsx"], key="wo_import_file")
+        optimize_imported = st.checkbox("Queue tray optimization for rows with experiments",
+                                        key="wo_import_optimize")
+        if upload and st.button("Import Work Orders", key="wo_import_button"):
+            conn = create_connection()
+            try:
+                import wo_import
+
+                frame = wo_import.read_orders(upload, upload.name)
+                result = wo_import.import_work_orders(
+                    conn, frame, optimize=optimize_imported, job_queue=get_job_queue()
+                )
+                st.success(f"Created {len(result.created)} work orders "
+                           f"({len(result.errors)} rows rejected, {len(result.job_ids)} optimizations queued).")
+                if len(result.errors):
+                    st.dataframe(result.errors.rename(columns={"row": "Row", "error": "Error"}),
+                                 use_container_width=True)
+            except Exception as e:
+                st.error(f"Error importing work orders: {e}")
+            finally:
+                conn.close()
+
     # Display work orders
     conn = create_connection()
     c = conn.cursor()
@@ -476,26 +435,82 @@ def manage_work_orders():
         if st.button("Configure Selected Work Order"):
             selected_wo = st.session_state.get('selected_wo')
             if selected_wo:
-                st.session_state.current_wo = selected_wo
+                set_current_wo(selected_wo)
                 st.session_state.current_tab = 2  # Switch to Tray Configuration tab
 
 
 
 
 
+@st.cache_resource
+def get_job_queue():
+    """Background job queue shared by every session in this server process."""
+    return JobQueue()
+
+
+# Streamlit 1.33+ can rerun just the progress box on a timer; older versions
+# get a Refresh button instead, so a pending job never blocks the script run
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+
+
+def _job_progress(job_id, state_key, pending_message):
+    queue = get_job_queue()
+    job = queue.poll(job_id)
+    if job is None or job["status"] not in ("Queued", "Running"):
+        # Finished while polling: rerun the whole page to show the result
+        st.rerun()
+
+    cols = st.columns([4, 1])
+    cols[0].info(f"{pending_message} ({job['status']})")
+    if cols[1].button("Cancel", key=f"cancel_{state_key}"):
+        queue.cancel(job_id)
+        st.session_state[state_key] = None
+        get_session_store().delete(state_key)
+        st.rerun()
+    if _fragment is None:
+        cols[1].button("Refresh", key=f"refresh_{state_key}")
+
+
+if _fragment is not None:
+    _job_progress = _fragment(run_every=1)(_job_progress)
+
+
+def track_job(job_id, state_key, pending_message):
+    """Shows a job's progress without blocking the rest of the page.
+
+    Returns the job record (callers act once its status is Complete);
+    clears `state_key` if the job disappeared, was cancelled or failed.
+    """
+    queue = get_job_queue()
+    job = queue.poll(job_id)
+    if job is None or job["status"] == "Cancelled":
+        st.session_state[state_key] = None
+        get_session_store().delete(state_key)
+        if job:
+            st.info("Job cancelled.")
+        return None
+
+    if job["status"] in ("Queued", "Running"):
+        _job_progress(job_id, state_key, pending_message)
+
+    if job["status"] == "Failed":
+        st.error(f"Job failed: {job['error'].splitlines()[0]}")
+        st.session_state[state_key] = None
+        get_session_store().delete(state_key)
+    return job
+
+
 def configure_tray():
     st.header("Tray Configuration")
 
-    # Ensure session state is initialized for tray configuration
-    if "tray_configuration" not in st.session_state:
-        st.session_state.tray_configuration = None
+    store = get_session_store()
 
     # Show work order information (adjust according to your app logic)
     if "current_wo" in st.session_state:
         st.info(f"Configuring Work Order: {st.session_state.current_wo}")
 
     # Dropdown or multiselect to choose experiments
-    optimizer = ReagentOptimizer()
+    optimizer = get_optimizer()
     experiments = optimizer.get_available_experiments()
     experiment_options = [f"{exp['id']}: {exp['name']}" for exp in experiments]
 
@@ -503,6 +518,7 @@ def configure_tray():
         "Select Experiments for Tray Configuration:",
         options=experiment_options,
         key="selected_experiments",
+        on_change=lambda: store.set("selected_experiments", st.session_state.selected_experiments),
     )
 
     # Extract selected experiment IDs
@@ -513,31 +529,63 @@ def configure_tray():
     # Optimize Configuration Button
     if st.button("Optimize Configuration"):
         if selected_experiment_ids:
-            try:
-                with st.spinner("Optimizing tray configuration..."):
-                    # Run the optimizer with the selected experiments
-                    config = optimizer.optimize_tray_configuration(selected_experiment_ids)
-
-                    # Save the tray configuration in session state
-                    st.session_state.tray_configuration = config
-
-                    # Optionally, save the configuration to the inventory (database)
-                    save_configuration_to_inventory(
-                        st.session_state.current_wo, config
-                    )
-
-                st.success("Configuration saved. Results are displayed below.")
-            except Exception as e:
-                st.error(f"Error optimizing configuration: {e}")
+            st.session_state.optimize_job = get_job_queue().submit(
+                "optimize_tray", {"experiments": selected_experiment_ids}
+            )
+            # Persist the job id so a refresh picks the running job back up
+            store.set("optimize_job", st.session_state.optimize_job)
         else:
             st.warning("Please select at least one experiment.")
 
+    # Poll the background optimization until it finishes
+    optimize_job = st.session_state.get("optimize_job")
+    if optimize_job:
+        job = track_job(optimize_job, "optimize_job", "Optimizing tray configuration...")
+        if job and job["status"] == "Complete":
+            config = get_job_queue().result(optimize_job)
+            st.session_state.optimize_job = None
+            store.delete("optimize_job")
+
+            # Keep the draft server-side rather than in this tab's session state
+            store.set_config("tray_configuration", config)
+
+            # Optionally, save the configuration to the inventory (database)
+            save_configuration_to_inventory(
+                st.session_state.current_wo, config
+            )
+            st.success("Configuration saved. Results are displayed below.")
+
     # Vertical Separator
     st.markdown("<hr style='border: 1px solid #ddd;'>", unsafe_allow_html=True)
 
     # Display results if a configuration exists
-    if st.session_state.tray_configuration:
-        display_results(st.session_state.tray_configuration)
+    config = store.get_config("tray_configuration")
+    if config:
+        display_stock_matches(config)
+        display_results(config)
+
+
+def display_stock_matches(config):
+    """Produced, unshipped trays that already match (or nearly match) the configuration."""
+    from config_index import MAX_DIFFERENCES, get_stock_index
+
+    k = st.slider("Stock matches within (location differences)", 0, MAX_DIFFERENCES, 1,
+                  key="stock_match_differences")
+    matches = get_stock_index().similar(config, k, exclude_wo=st.session_state.get("current_wo"))
+    if not matches:
+        return
+    st.info(f"{len(matches)} tray(s) in stock match this configuration within {k} difference(s); "
+            "consider reusing one instead of building a new tray.")
+    st.dataframe(pd.DataFrame([
+        {
+            "Tray ID": tray.tray_id,
+            "Work Order ID": tray.wo_id,
+            "Customer": tray.customer,
+            "Experiments": tray.experiments,
+            "Differences": diff,
+        }
+        for diff, tray in matches
+    ]), use_container_width=True, hide_index=True)
 
 
 def display_results(config):
@@ -545,7 +593,7 @@ def display_results(config):
 
     # Tray Configuration Chart
     st.markdown("#### Tray Configuration")
-    fig = create_tray_visualization(config)
+    fig = get_tray_figure(config)
     fig.update_layout(
         autosize=True,
         height=600,
@@ -632,10 +680,13 @@ def manage_inventory():
         ])
         st.dataframe(df, use_container_width=True)
 
-        # Tray reagent usage for selected work order
-        if 'current_wo' in st.session_state and 'config' in st.session_state.tray_state:
+        # Tray reagent usage for selected work order, from its saved tray
+        # (the operator's draft may belong to another work order)
+        if st.session_state.get('current_wo'):
             st.subheader("Reagent Usage")
-            config = st.session_state.tray_state['config']
+            c.execute("SELECT configuration FROM trays WHERE wo_id = ?", (st.session_state.current_wo,))
+            row = c.fetchone()
+            config = lims_db.load_tray_configuration(row[0]) if row else None
             if config:
                 reagents_df = pd.DataFrame([
                     {
@@ -669,6 +720,7 @@ def manage_shipping():
 
     if not ready_trays:
         st.info("No trays ready for shipping")
+        display_label_sheets()
         return
 
     with st.form("shipping_form"):
@@ -684,103 +736,112 @@ def manage_shipping():
             st.success("Shipment processed")
             st.rerun()
 
+    display_label_sheets()
+
+def display_label_sheets():
+    """Tray maps and bottle labels for one day's production, as a zip of PNG and PDF sheets."""
+    st.subheader("Tray Maps & Bottle Labels")
+    day = st.date_input("Production Date", key="label_date").strftime('%Y-%m-%d')
+
+    queue = get_job_queue()
+    if st.button("Render Labels", key="render_labels_button"):
+        st.session_state.label_job = queue.submit("render_labels", {"date": day})
+
+    label_job = st.session_state.get("label_job")
+    if label_job:
+        job = track_job(label_job, "label_job", "Rendering tray sheets...")
+        if job and job["status"] == "Complete":
+            path, count = queue.result(label_job)
+            if not count:
+                st.info("No trays were produced on that day.")
+                return
+            with open(path, "rb") as f:
+                st.download_button(f"Download {count} Tray Sheets", f, file_name=os.path.basename(path),
+                                   mime="application/zip", key="download_labels_button")
+
 def complete_production(tray):
     conn = create_connection()
-    c = conn.cursor()
-    now = datetime.now().strftime('%Y-%m-%d')
-    
-    c.execute("""
-        INSERT INTO production (tray_id, wo_id, start_date, end_date, status)
-        VALUES (?, ?, ?, ?, ?)
-    """, (tray[0], tray[1], now, now, 'Complete'))
-    
-    c.execute("UPDATE inventory SET status = 'Production Complete' WHERE wo_id = ?", 
-             (tray[1],))
-    conn.commit()
-    conn.close()
+    try:
+        lims_db.complete_production(conn, tray[0])
+    finally:
+        conn.close()
 
 def process_shipment(tray, tracking, ship_date):
     conn = create_connection()
-    c = conn.cursor()
-    
-    c.execute("""
-        INSERT INTO shipping (tray_id, wo_id, customer, requester, tracking_number, ship_date)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (tray[0], tray[1], tray[2], tray[3], tracking, ship_date.strftime('%Y-%m-%d')))
-    
-    c.execute("UPDATE work_orders SET status = 'Complete' WHERE id = ?", (tray[1],))
-    c.execute("UPDATE inventory SET status = 'Shipped' WHERE wo_id = ?", (tray[1],))
-    
-    conn.commit()
-    conn.close()
+    try:
+        lims_db.process_shipment(conn, tray[0], tracking, ship_date)
+    finally:
+        conn.close()
 
 def show_dashboard():
     st.header("Dashboard")
     
-    conn = create_connection()
-    c = conn.cursor()
+    # Rollups are shared by every worker process and dropped on any write
+    today = datetime.now().strftime('%Y-%m-%d')
+    rollup = shared_cache.get_or_compute(
+        shared_cache.DASHBOARD, today, lambda: compute_dashboard_rollup(today), ttl=60
+    )
     
     # Metrics
     col1, col2, col3, col4 = st.columns(4)
-    today = datetime.now().strftime('%Y-%m-%d')
-    
-    metrics = {
-        "Open Work Orders": "SELECT COUNT(*) FROM work_orders WHERE status='Open'",
-        "Today's Trays": "SELECT COUNT(*) FROM trays WHERE date=?",
-        "Production Complete": "SELECT COUNT(*) FROM production WHERE end_date=?",
-        "Shipped Today": "SELECT COUNT(*) FROM shipping WHERE ship_date=?"
-    }
-    
-    for col, (label, query) in zip([col1, col2, col3, col4], metrics.items()):
-        c.execute(query, (today,) if '?' in query else ())
-        col.metric(label, c.fetchone()[0])
+    for col, (label, value) in zip([col1, col2, col3, col4], rollup["metrics"].items()):
+        col.metric(label, value)
 
     # Activity charts
-    display_activity_charts(c)
-    display_recent_activity(c)
-    conn.close()
+    display_activity_charts(rollup["activity"])
+    display_recent_activity(rollup["recent"])
+    display_production_analytics()
+
+def compute_dashboard_rollup(today):
+    conn = create_connection()
+    try:
+        return lims_db.dashboard_rollup(conn, today)
+    finally:
+        conn.close()
+
+def display_activity_charts(activity):
+    import plotly.graph_objects as go
 
-def display_activity_charts(c):
     st.subheader("30-Day Activity")
     
-    queries = {
-        'Work Orders': "SELECT date, COUNT(*) FROM work_orders WHERE date >= date('now', '-30 days') GROUP BY date",
-        'Production': "SELECT end_date, COUNT(*) FROM production WHERE end_date >= date('now', '-30 days') GROUP BY end_date"
-    }
-    
     fig = go.Figure()
-    for name, query in queries.items():
-        c.execute(query)
-        data = pd.DataFrame(c.fetchall(), columns=['date', 'count'])
+    for name, rows in activity.items():
+        data = pd.DataFrame(rows, columns=['date', 'count'])
         fig.add_trace(go.Scatter(x=data['date'], y=data['count'], 
                                name=name, mode='lines+markers'))
     
     fig.update_layout(height=400)
     st.plotly_chart(fig, use_container_width=True)
 
-def display_recent_activity(c):
-    st.subheader("Recent Activity")
+def display_production_analytics():
+    import plotly.graph_objects as go
+    import production_analytics
+
+    st.subheader("Production Analytics")
     
-    c.execute("""
-        SELECT 
-            wo.id,
-            wo.customer,
-            wo.requester,
-            CASE 
-                WHEN s.ship_date IS NOT NULL THEN 'Shipped'
-                WHEN p.end_date IS NOT NULL THEN 'Production Complete'
-                WHEN t.date IS NOT NULL THEN 'Configured'
-                ELSE 'Created'
-            END as status,
-            COALESCE(s.ship_date, p.end_date, t.date, wo.date) as date
-        FROM work_orders wo
-        LEFT JOIN trays t ON wo.id = t.wo_id
-        LEFT JOIN production p ON wo.id = p.wo_id
-        LEFT JOIN shipping s ON wo.id = s.wo_id
-        ORDER BY date DESC LIMIT 10
-    """)
+    conn = create_connection()
+    try:
+        analytics = production_analytics.compute_analytics(conn)
+    finally:
+        conn.close()
     
-    df = pd.DataFrame(c.fetchall(), 
+    col1, col2 = st.columns(2)
+    col1.markdown("**Cycle Times (days)**")
+    col1.dataframe(analytics.cycle_summary.round(1), use_container_width=True)
+    col2.markdown("**Work in Progress by Age**")
+    col2.dataframe(analytics.wip_aging, use_container_width=True)
+    
+    weekly = analytics.weekly_throughput
+    fig = go.Figure()
+    for stage in weekly.columns:
+        fig.add_trace(go.Bar(x=weekly.index, y=weekly[stage], name=stage))
+    fig.update_layout(height=400, barmode='group', title="Weekly Throughput")
+    st.plotly_chart(fig, use_container_width=True)
+
+def display_recent_activity(rows):
+    st.subheader("Recent Activity")
+    
+    df = pd.DataFrame(rows, 
                      columns=['Work Order', 'Customer', 'Requester', 'Status', 'Date'])
     st.dataframe(df, use_container_width=True)
 
@@ -806,12 +867,20 @@ def manage_production():
     """)
     pending_trays = c.fetchall()
 
+    display_make_to_stock(conn)
+
     if not pending_trays:
         st.info("No trays pending production.")
         return
 
+    display_prep_plan(conn)
+
     # Show pending trays
     st.markdown("### Pending Trays for Production")
+    sequencing = st.radio("Sequence", ["Date order", "Minimize changeovers"], horizontal=True,
+                          key="production_sequence")
+    if sequencing == "Minimize changeovers":
+        pending_trays = sequence_pending_trays(conn, pending_trays)
     tray_df = pd.DataFrame(pending_trays, columns=[
         "Tray ID", "Work Order ID", "Customer", "Date", "Production Status"
     ])
@@ -836,14 +905,29 @@ def manage_production():
             "QC Check",
         ]
 
-        # Manage progress through steps
+        loading_verified = display_bottle_scanning(tray_id)
+
+        # Manage progress through steps; ticks go to the audit log so the
+        # checklist survives reruns and restarts
+        events = get_event_buffer()
+        saved_steps = audit_log.checklist_state(conn, tray_id)
         step_progress = {}
         for step in production_steps:
-            step_progress[step] = st.checkbox(step, key=f"{tray_id}_{step}")
+            step_progress[step] = st.checkbox(
+                step,
+                value=saved_steps.get(step, step == "Reagent Loading" and loading_verified),
+                key=f"{tray_id}_{step}",
+                on_change=record_checklist_tick,
+                args=(selected_tray[1], tray_id, step),
+            )
+        events.flush_if_due(conn)
+        get_scan_ingestor().flush_if_due(conn)
 
         # Complete Production Button
         if st.button("Complete Production"):
             if all(step_progress.values()):
+                events.flush(conn)
+                get_scan_ingestor().flush(conn)
                 mark_production_complete(tray_id)
                 st.success(f"Tray {tray_id} marked as Production Complete!")
                 st.experimental_rerun()
@@ -853,16 +937,110 @@ def manage_production():
     conn.close()
 
 
+@st.cache_resource
+def get_prep_planner():
+    """Reagent totals over the pending queue, kept up to date incrementally."""
+    from prep_planner import PrepPlanner
+
+    return PrepPlanner()
+
+
+def display_prep_plan(conn):
+    from prep_planner import prep_sheet
+
+    planner = get_prep_planner()
+    planner.refresh(conn)
+    plan = planner.plan()
+    with st.expander(f"Reagent Prep ({len(planner.tray_ids)} trays pending)"):
+        st.dataframe(plan, use_container_width=True, hide_index=True)
+        today = datetime.now().strftime('%Y-%m-%d')
+        st.download_button("Download Prep Sheet", prep_sheet(plan, planner.tray_ids, today),
+                           file_name=f"reagent_prep_{today}.xlsx",
+                           mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                           key="download_prep_sheet_button")
+
+
+def sequence_pending_trays(conn, pending_trays):
+    """Reorders the pending list so consecutive trays share as many reagents as possible."""
+    import production_scheduler
+
+    schedule = production_scheduler.schedule(production_scheduler.load_pending(conn))
+    position = {tray.tray_id: i for i, tray in enumerate(schedule.trays)}
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Changeovers (date order)", schedule.changeovers_before)
+    col2.metric("Changeovers (sequenced)", schedule.changeovers_after,
+                delta=schedule.changeovers_after - schedule.changeovers_before, delta_color="inverse")
+    col3.metric("Solve Time", f"{schedule.seconds:.2f} s")
+    st.caption(f"No tray is moved more than {production_scheduler.DEFAULT_WINDOW} places behind its "
+               f"due date (work order date + {production_scheduler.DEFAULT_LEAD_DAYS} days).")
+    return sorted(pending_trays, key=lambda row: position.get(row[0], len(position)))
+
+
+def display_make_to_stock(conn):
+    """Pre-build proposals for popular experiment sets, sized to the line's idle capacity."""
+    import make_to_stock
+
+    stock_plan = make_to_stock.plan_stock(conn)
+    proposed = int(stock_plan.plan["Pre-build"].sum()) if not stock_plan.plan.empty else 0
+    with st.expander(f"Make to Stock ({proposed} pre-builds proposed)"):
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Line Capacity (trays/week)", stock_plan.capacity)
+        col2.metric("Open Orders", stock_plan.committed)
+        col3.metric("Idle Capacity", stock_plan.idle)
+        st.caption(f"Demand per experiment set over the last {stock_plan.weeks} complete weeks; "
+                   "sets ordered at least "
+                   f"{make_to_stock.MIN_TRAYS} times are candidates for building ahead.")
+        st.dataframe(stock_plan.plan, use_container_width=True, hide_index=True)
+        if st.button("Create Pre-build Orders", key="create_prebuilds_button", disabled=not proposed):
+            result = make_to_stock.create_prebuilds(conn, stock_plan.plan, get_job_queue())
+            st.success(f"Created {len(result.created)} stock work orders; configurations are being optimized.")
+
+
+@st.cache_resource
+def get_event_buffer():
+    """Checklist ticks from every session, written to the audit log in batches."""
+    return audit_log.EventBuffer()
+
+
+@st.cache_resource
+def get_scan_ingestor():
+    """Bottle scans from every session, checked in memory and logged in batches."""
+    return ScanIngestor()
+
+
+def display_bottle_scanning(tray_id):
+    """Scan form for reagent loading; returns True once every location is verified."""
+    ingestor = get_scan_ingestor()
+    with st.form(f"scan_form_{tray_id}", clear_on_submit=True):
+        col1, col2 = st.columns([1, 3])
+        location = col1.selectbox("Location", [f"LOC-{i + 1}" for i in range(16)], key=f"scan_location_{tray_id}")
+        barcode = col2.text_input("Bottle Barcode", key=f"scan_barcode_{tray_id}")
+        submitted = st.form_submit_button("Scan")
+    if submitted and barcode:
+        result = ingestor.scan(tray_id, location, barcode, source="streamlit")
+        (st.success if result["ok"] else st.error)(result["message"])
+
+    progress = ingestor.progress(tray_id)
+    if progress is None:
+        return False
+    if progress["complete"]:
+        st.success("All bottles verified against the stored placement.")
+    else:
+        st.caption(f"{len(progress['verified'])} verified, {len(progress['remaining'])} remaining")
+        st.dataframe(pd.DataFrame(progress["remaining"]).rename(
+            columns={"location": "Location", "reagent_code": "Reagent"}), hide_index=True)
+    return progress["complete"]
+
+
+def record_checklist_tick(wo_id, tray_id, step):
+    checked = st.session_state[f"{tray_id}_{step}"]
+    get_event_buffer().add(audit_log.CHECKLIST, wo_id, tray_id, {"step": step, "checked": checked})
+
+
 def mark_production_complete(tray_id):
     conn = create_connection()
-    c = conn.cursor()
     try:
-        now = datetime.now().strftime('%Y-%m-%d')
-        c.execute("""
-            INSERT INTO production (tray_id, start_date, end_date, status)
-            VALUES (?, ?, ?, ?)
-        """, (tray_id, now, now, 'Complete'))
-        conn.commit()
+        lims_db.complete_production(conn, tray_id)
     except Exception as e:
         st.error(f"Error updating production status: {e}")
     finally:
@@ -878,14 +1056,17 @@ def render_status_bar(wo_id):
         "Packing": "lightgreen",
         "Shipped": "green",
         "WO Rejected": "red",
-        "Open": "blue"  # Add 'Open' as a default example status
+        "Open": "blue",  # Add 'Open' as a default example status
+        "Created": "blue",
+        "Configured": "turquoise",
+        "Production Complete": "lightgreen",
     }
 
     conn = create_connection()
     c = conn.cursor()
     try:
         # Fetch the current status of the work order
-        c.execute("SELECT status FROM work_orders WHERE id = ?", (wo_id,))
+        c.execute("SELECT lifecycle_state FROM work_orders WHERE id = ?", (wo_id,))
         result = c.fetchone()
         status = result[0] if result else "Unknown"
     except Exception as e:
@@ -919,9 +1100,46 @@ def render_status_bar(wo_id):
     )
 
 
+def get_session_store():
+    """Server-side draft store for the current operator."""
+    return SessionStore(st.session_state.operator)
+
+
+def set_current_wo(wo_id):
+    st.session_state.current_wo = wo_id
+    get_session_store().set("current_wo", wo_id)
+
+
+def select_operator():
+    """Identifies the operator and restores their drafts on a new browser session.
+
+    The name is mirrored into the URL so a refresh keeps it; without a name
+    the tab gets an anonymous id in the URL instead.
+    """
+    operator = st.sidebar.text_input(
+        "Operator", value=st.query_params.get("operator", ""), key="operator_input"
+    ).strip()
+    if operator:
+        if st.query_params.get("operator") != operator:
+            st.query_params["operator"] = operator
+    else:
+        if "sid" not in st.query_params:
+            st.query_params["sid"] = uuid.uuid4().hex[:12]
+        operator = f"session-{st.query_params['sid']}"
+
+    if st.session_state.get("operator") != operator:
+        st.session_state.operator = operator
+        store = get_session_store()
+        st.session_state.current_wo = store.get("current_wo")
+        st.session_state.selected_experiments = store.get("selected_experiments", [])
+        st.session_state.optimize_job = store.get("optimize_job")
+
+
 def main():
     st.title("🧪 KCF LIMS")
 
+    select_operator()
+
     # Initialize session state for the current work order if not already set
     if "current_wo" not in st.session_state:
         st.session_state.current_wo = None  # Default to no work order selected
@@ -947,33 +1165,29 @@ def main():
             unsafe_allow_html=True,
         )
 
-    # Define tabs for navigation
-    tabs = st.tabs([
-        "Dashboard",
-        "Work Orders",
-        "Tray Configuration",
-        "Inventory",
-        "Production",
-        "Shipping",
-        "Search & Reports",
-    ])
-
-    tab_functions = [
-        show_dashboard,
-        manage_work_orders,
-        configure_tray,
-        manage_inventory,
-        manage_production,
-        manage_shipping,
-        search_and_reports,
-    ]
+    # Navigation renders only the selected section. st.tabs would run every
+    # tab body on every script run, so each rerun (and the cold start) would
+    # pay for all sections and import everything they use.
+    sections = {
+        "Dashboard": show_dashboard,
+        "Work Orders": manage_work_orders,
+        "Tray Configuration": configure_tray,
+        "Inventory": manage_inventory,
+        "Production": manage_production,
+        "Shipping": manage_shipping,
+        "Search & Reports": search_and_reports,
+    }
+    section = st.radio("Section", list(sections), horizontal=True, key="section",
+                       label_visibility="collapsed")
 
-    # Render the appropriate tab function
-    for i, tab_function in enumerate(tab_functions):
-        with tabs[i]:
-            tab_function()
+    # Render the selected section; ?profile=sample (or KLIMS_PROFILE)
+    # records each render under profiles/
+    section_function = sections[section]
+    with profiling.request_mode(st.query_params.get("profile")):
+        with profiling.profiled(f"tab.{section_function.__name__}"):
+            section_function()
 
 
 if __name__ == "__main__":
-    setup_database()
+    lims_db.ensure_database()
     main()
@@ -0,0 +1,198 @@
+"""Append-only audit log of work-order transitions, production checklist ticks and bottle scans.
+
+Events are never updated or deleted (triggers reject it). Lifecycle
+transitions are recorded inside the write path's own transaction by
+wo_lifecycle.transition; checklist ticks and scans are buffered in memory
+and written in batches by EventBuffer.
+
+Every SNAPSHOT_INTERVAL events a snapshot of the folded state (lifecycle
+state per work order, checklist per tray, cumulative event counts) is
+stored, checked by maybe_snapshot after each write path and buffer flush.
+"State at time T" and throughput queries then replay only the events
+after the nearest snapshot instead of the full history.
+"""
+import json
+import threading
+import time
+
+SNAPSHOT_INTERVAL = 1000
+
+TRANSITION = "transition"
+CHECKLIST = "checklist"
+SCAN = "scan"
+
+
+def setup_audit_tables(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS events
+                 (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                  ts TEXT,
+                  kind TEXT,
+                  wo_id TEXT,
+                  tray_id INTEGER,
+                  payload TEXT)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_events_ts ON events(ts)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_events_tray ON events(tray_id, kind)")
+    c.execute('''CREATE TRIGGER IF NOT EXISTS events_no_update BEFORE UPDATE ON events
+                 BEGIN SELECT RAISE(ABORT, 'events are append-only'); END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS events_no_delete BEFORE DELETE ON events
+                 BEGIN SELECT RAISE(ABORT, 'events are append-only'); END''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS event_snapshots
+                 (upto_seq INTEGER PRIMARY KEY,
+                  ts TEXT,
+                  state TEXT)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_event_snapshots_ts ON event_snapshots(ts)")
+
+
+def _now():
+    return time.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def record_event(c, kind, wo_id=None, tray_id=None, payload=None):
+    """Appends one event using the caller's cursor (and transaction)."""
+    c.execute("INSERT INTO events (ts, kind, wo_id, tray_id, payload) VALUES (?, ?, ?, ?, ?)",
+              (_now(), kind, wo_id, tray_id, json.dumps(payload or {})))
+
+
+def record_events(c, rows):
+    """Appends many (kind, wo_id, tray_id, payload) events with one executemany."""
+    now = _now()
+    c.executemany("INSERT INTO events (ts, kind, wo_id, tray_id, payload) VALUES (?, ?, ?, ?, ?)",
+                  [(now, kind, wo_id, tray_id, json.dumps(payload or {}))
+                   for kind, wo_id, tray_id, payload in rows])
+
+
+class EventBuffer:
+    """Collects high-frequency events (checklist ticks) and writes them in batches."""
+
+    def __init__(self, max_events=50, max_age=5.0):
+        self.max_events = max_events
+        self.max_age = max_age
+        self._events = []
+        self._oldest = None
+        self._lock = threading.Lock()
+
+    def add(self, kind, wo_id=None, tray_id=None, payload=None):
+        with self._lock:
+            if not self._events:
+                self._oldest = time.monotonic()
+            # Keep the wall-clock time of the tick, not of the flush
+            self._events.append((_now(), kind, wo_id, tray_id, json.dumps(payload or {})))
+
+    def due(self):
+        with self._lock:
+            return bool(self._events) and (
+                len(self._events) >= self.max_events or time.monotonic() - self._oldest >= self.max_age
+            )
+
+    def flush(self, conn):
+        """Writes all buffered events in one transaction; returns how many were written."""
+        with self._lock:
+            events, self._events = self._events, []
+        if not events:
+            return 0
+        try:
+            conn.executemany("INSERT INTO events (ts, kind, wo_id, tray_id, payload) VALUES (?, ?, ?, ?, ?)",
+                             events)
+            conn.commit()
+        except Exception:
+            with self._lock:
+                self._events = events + self._events
+            raise
+        maybe_snapshot(conn)
+        return len(events)
+
+    def flush_if_due(self, conn):
+        return self.flush(conn) if self.due() else 0
+
+
+def empty_state():
+    return {"orders": {}, "checklists": {}, "counts": {}}
+
+
+def apply_event(state, kind, wo_id, tray_id, payload):
+    """Folds one event into a state dict."""
+    if kind == TRANSITION:
+        state["orders"][wo_id] = payload["to"]
+        state["counts"][payload["to"]] = state["counts"].get(payload["to"], 0) + 1
+    elif kind == CHECKLIST:
+        steps = state["checklists"].setdefault(str(tray_id), {})
+        steps[payload["step"]] = payload["checked"]
+        state["counts"][CHECKLIST] = state["counts"].get(CHECKLIST, 0) + 1
+    elif kind == SCAN:
+        state["counts"][SCAN] = state["counts"].get(SCAN, 0) + 1
+    return state
+
+
+def _load_snapshot(c, ts=None):
+    if ts is None:
+        c.execute("SELECT upto_seq, state FROM event_snapshots ORDER BY upto_seq DESC LIMIT 1")
+    else:
+        c.execute("""SELECT upto_seq, state FROM event_snapshots
+                     WHERE ts <= ? ORDER BY upto_seq DESC LIMIT 1""", (ts,))
+    row = c.fetchone()
+    if row is None:
+        return 0, empty_state()
+    return row[0], json.loads(row[1])
+
+
+def _replay(c, state, after_seq, ts=None):
+    sql = "SELECT seq, ts, kind, wo_id, tray_id, payload FROM events WHERE seq > ?"
+    params = [after_seq]
+    if ts is not None:
+        sql += " AND ts <= ?"
+        params.append(ts)
+    c.execute(sql + " ORDER BY seq", params)
+    last_seq, last_ts = after_seq, None
+    for seq, event_ts, kind, wo_id, tray_id, payload in c.fetchall():
+        apply_event(state, kind, wo_id, tray_id, json.loads(payload))
+        # Buffered ticks keep their own time, so ts is not strictly ordered by seq
+        last_seq, last_ts = seq, max(last_ts or event_ts, event_ts)
+    return state, last_seq, last_ts
+
+
+def maybe_snapshot(conn, interval=SNAPSHOT_INTERVAL):
+    """Stores a new snapshot once `interval` events have accumulated since the last one."""
+    c = conn.cursor()
+    c.execute("SELECT COALESCE(MAX(upto_seq), 0) FROM event_snapshots")
+    last = c.fetchone()[0]
+    c.execute("SELECT COALESCE(MAX(seq), 0) FROM events")
+    if c.fetchone()[0] - last < interval:
+        return False
+    upto_seq, state = _load_snapshot(c)
+    state, last_seq, last_ts = _replay(c, state, upto_seq)
+    c.execute("INSERT OR IGNORE INTO event_snapshots (upto_seq, ts, state) VALUES (?, ?, ?)",
+              (last_seq, last_ts, json.dumps(state, separators=(",", ":"))))
+    conn.commit()
+    return True
+
+
+def state_at(conn, ts=None):
+    """Folded state as of `ts` ('YYYY-MM-DD HH:MM:SS'; None for now).
+
+    Starts from the newest snapshot taken at or before `ts` and replays the
+    events after it.
+    """
+    c = conn.cursor()
+    upto_seq, state = _load_snapshot(c, ts)
+    state, _, _ = _replay(c, state, upto_seq, ts)
+    return state
+
+
+def throughput(conn, start, end, kind="Production Complete"):
+    """Number of `kind` transitions (or checklist ticks) between two timestamps."""
+    before = state_at(conn, start)["counts"].get(kind, 0)
+    after = state_at(conn, end)["counts"].get(kind, 0)
+    return after - before
+
+
+def checklist_state(conn, tray_id):
+    """Latest checked/unchecked value of each production step for a tray."""
+    c = conn.cursor()
+    c.execute("""SELECT payload FROM events WHERE tray_id = ? AND kind = ?
+                 ORDER BY seq""", (tray_id, CHECKLIST))
+    steps = {}
+    for (payload,) in c.fetchall():
+        data = json.loads(payload)
+        steps[data["step"]] = data["checked"]
+    return steps
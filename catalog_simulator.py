@@ -0,0 +1,168 @@
+"""What-if simulator for reagent volume changes.
+
+Given proposed edits to the catalog's volumes per test ({reagent code: new
+vol in uL}), re-optimizes every experiment combination that has ever been
+configured and reports how tray life changes across all historical trays
+(live and archived).
+
+Trays are grouped by canonical experiment key, so the work is one baseline
+and one edited solve per distinct combination, not per tray. A reverse index
+from reagent code to the combinations that use it limits the solves to the
+combinations an edit can affect; all others keep a delta of zero.
+
+Tray life is the number of tests the tray supports before its first
+experiment runs out (the smallest total_tests on the tray).
+"""
+import copy
+import multiprocessing
+from collections import defaultdict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+import shared_cache
+from order_archive import load_table
+from production_analytics import data_version
+from reagent_optimizer import EXPERIMENT_DATA, ReagentOptimizer
+
+SIMULATOR = "catalog_simulator"
+
+# Below this many combinations a process pool costs more than it saves
+PARALLEL_THRESHOLD = 500
+
+SimulationResult = namedtuple("SimulationResult", ["per_set", "distribution", "histogram",
+                                                   "affected_trays", "total_trays"])
+
+
+def _experiments_of(key):
+    return [int(exp) for exp in key.split(",") if exp]
+
+
+class ReagentIndex:
+    """Tray counts per experiment combination, indexed by reagent code."""
+
+    def __init__(self, set_counts, experiment_data):
+        self.set_counts = set_counts
+        self.by_reagent = defaultdict(set)
+        for key in set_counts:
+            for exp in _experiments_of(key):
+                for reagent in experiment_data.get(exp, {}).get("reagents", []):
+                    self.by_reagent[reagent["code"]].add(key)
+
+    def affected(self, reagent_codes):
+        keys = set()
+        for code in reagent_codes:
+            keys |= self.by_reagent.get(code, set())
+        return keys
+
+    @property
+    def total_trays(self):
+        return sum(self.set_counts.values())
+
+
+def _set_counts(conn):
+    trays = load_table(conn, "trays", ["id", "experiments"])
+    counts = trays["experiments"].dropna()
+    counts = counts[counts != ""].value_counts()
+    return {key: int(n) for key, n in counts.items()}
+
+
+def get_reagent_index(conn, experiment_data=None):
+    """Reverse index over all stored trays, rebuilt only when the data changes."""
+    if experiment_data is None:
+        experiment_data = EXPERIMENT_DATA
+    set_counts = shared_cache.get_or_compute(SIMULATOR, f"sets:{data_version(conn)}",
+                                             lambda: _set_counts(conn), ttl=3600)
+    return ReagentIndex(set_counts, experiment_data)
+
+
+def _positive(vol):
+    # NaN compares False, so it fails the check along with zero and negatives
+    try:
+        return float(vol) > 0
+    except (TypeError, ValueError):
+        return False
+
+
+def apply_edits(experiment_data, edits):
+    """Copy of the catalog with the volumes of the given reagent codes replaced."""
+    edited = copy.deepcopy(experiment_data)
+    known = set()
+    for exp in edited.values():
+        for reagent in exp["reagents"]:
+            if reagent["code"] in edits:
+                reagent["vol"] = edits[reagent["code"]]
+                known.add(reagent["code"])
+    unknown = set(edits) - known
+    if unknown:
+        raise ValueError(f"Unknown reagent codes: {', '.join(sorted(unknown))}")
+    bad = [code for code, vol in edits.items() if not _positive(vol)]
+    if bad:
+        raise ValueError(f"Volumes must be positive: {', '.join(sorted(bad))}")
+    return edited
+
+
+def tray_life(config):
+    return min(result["total_tests"] for result in config["results"].values())
+
+
+_baseline = None
+_edited = None
+
+
+def _init_worker(baseline_data, edited_data):
+    global _baseline, _edited
+    _baseline = ReagentOptimizer(baseline_data)
+    _edited = ReagentOptimizer(edited_data)
+
+
+def _simulate(key):
+    exps = _experiments_of(key)
+    try:
+        before = tray_life(_baseline.optimize_tray_configuration(exps))
+        after = tray_life(_edited.optimize_tray_configuration(exps))
+    except ValueError:
+        # Combinations from an older catalog that no longer solve
+        return key, None, None
+    return key, before, after
+
+
+def _solve_all(keys, baseline_data, edited_data, workers):
+    if len(keys) < PARALLEL_THRESHOLD or workers == 1:
+        _init_worker(baseline_data, edited_data)
+        return [_simulate(key) for key in keys]
+    # Runs inside a job queue worker thread; forking a threaded server can copy
+    # held locks into the children, so the workers start fresh interpreters
+    with multiprocessing.get_context("spawn").Pool(processes=workers, initializer=_init_worker,
+                                                   initargs=(baseline_data, edited_data)) as pool:
+        return pool.map(_simulate, keys, chunksize=64)
+
+
+def simulate(conn, edits, workers=None):
+    """Re-optimizes every affected stored combination under `edits` and summarizes the tray-life deltas."""
+    baseline_data = EXPERIMENT_DATA
+    edited_data = apply_edits(baseline_data, edits)
+    index = get_reagent_index(conn, baseline_data)
+
+    keys = sorted(index.affected(edits))
+    rows = _solve_all(keys, baseline_data, edited_data, workers)
+    per_set = pd.DataFrame(rows, columns=["experiments", "life_before", "life_after"]).dropna()
+    per_set = per_set.astype({"life_before": int, "life_after": int})
+    per_set["trays"] = per_set["experiments"].map(index.set_counts)
+    per_set["delta"] = per_set["life_after"] - per_set["life_before"]
+    per_set["delta_pct"] = (100 * per_set["delta"] / per_set["life_before"]).round(1)
+    per_set = per_set.sort_values(["delta", "trays"], ascending=[True, False]).reset_index(drop=True)
+
+    # Every tray counts once; trays whose combination is unaffected have a delta of zero
+    affected_trays = int(per_set["trays"].sum())
+    unaffected = index.total_trays - affected_trays
+    deltas = np.concatenate([np.repeat(per_set["delta"].to_numpy(), per_set["trays"].to_numpy()),
+                             np.zeros(unaffected, dtype=int)])
+    distribution = pd.Series(deltas, name="delta", dtype=float).describe(percentiles=[0.05, 0.25, 0.5, 0.75, 0.95])
+
+    histogram = per_set.groupby("delta")["trays"].sum()
+    if unaffected:
+        histogram.loc[0] = histogram.get(0, 0) + unaffected
+    histogram = histogram.sort_index()
+
+    return SimulationResult(per_set, distribution, histogram, affected_trays, index.total_trays)
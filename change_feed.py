@@ -0,0 +1,150 @@
+"""Change-data-capture feed over the LIMS tables.
+
+Triggers on work_orders, trays, production, shipping and inventory append
+one row to `change_log` per inserted, updated or deleted row, inside the
+writer's own transaction:
+
+    seq     monotonically increasing sequence number
+    table   source table
+    op      INSERT, UPDATE or DELETE
+    row_id  primary key of the changed row
+    wo_id   work order the row belongs to
+
+Derived structures read the feed through a Consumer instead of rescanning
+the tables:
+
+    consumer = Consumer("prep_planner", durable=False)
+    consumer.reset(conn)                  # position at the head after a full load
+    for batch in consumer.batches(conn):  # lists of Change, oldest first
+        ...
+
+Durable consumers keep their offset in `change_consumers`, so a restarted
+worker resumes where it stopped; in-memory structures use durable=False and
+start from the head after loading their state. Old entries are removed by
+prune(); a consumer whose offset falls behind the pruned range gets
+ChangeFeedGap and must rebuild from the tables.
+"""
+import time
+from collections import namedtuple
+
+TRACKED_TABLES = {
+    # table: (primary key, work order column)
+    "work_orders": ("id", "id"),
+    "trays": ("id", "wo_id"),
+    "production": ("id", "wo_id"),
+    "shipping": ("id", "wo_id"),
+    "inventory": ("id", "wo_id"),
+}
+OPERATIONS = ("INSERT", "UPDATE", "DELETE")
+
+DEFAULT_BATCH_SIZE = 500
+RETENTION_DAYS = 7
+
+Change = namedtuple("Change", ["seq", "table", "op", "row_id", "wo_id"])
+
+
+class ChangeFeedGap(Exception):
+    """The consumer's offset is older than the oldest change still in the log."""
+
+
+def setup_change_log(c):
+    # row_id has no declared type so integer and text keys keep their type
+    c.execute('''CREATE TABLE IF NOT EXISTS change_log
+                 (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                  ts TEXT DEFAULT (datetime('now', 'localtime')),
+                  table_name TEXT,
+                  op TEXT,
+                  row_id,
+                  wo_id TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS change_consumers
+                 (name TEXT PRIMARY KEY,
+                  last_seq INTEGER,
+                  updated TEXT)''')
+    for table, (pk, wo_column) in TRACKED_TABLES.items():
+        for op in OPERATIONS:
+            row = "OLD" if op == "DELETE" else "NEW"
+            c.execute(f'''CREATE TRIGGER IF NOT EXISTS change_log_{table}_{op.lower()}
+                          AFTER {op} ON {table}
+                          BEGIN
+                              INSERT INTO change_log (table_name, op, row_id, wo_id)
+                              VALUES ('{table}', '{op}', {row}.{pk}, {row}.{wo_column});
+                          END''')
+
+
+def head(conn):
+    """Sequence number of the newest change (0 if none were ever logged)."""
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    return row[0] if row else 0
+
+
+def prune(conn, retention_days=RETENTION_DAYS):
+    """Deletes changes older than the retention period that every durable consumer has read."""
+    c = conn.cursor()
+    c.execute("SELECT MIN(last_seq) FROM change_consumers")
+    slowest = c.fetchone()[0]
+    sql = "DELETE FROM change_log WHERE ts < datetime('now', 'localtime', ?)"
+    params = [f"-{int(retention_days)} days"]
+    if slowest is not None:
+        sql += " AND seq <= ?"
+        params.append(slowest)
+    c.execute(sql, params)
+    conn.commit()
+    return c.rowcount
+
+
+class Consumer:
+    """Reads the change log from its own offset, in batches."""
+
+    def __init__(self, name, durable=True, batch_size=DEFAULT_BATCH_SIZE, tables=None):
+        self.name = name
+        self.durable = durable
+        self.batch_size = batch_size
+        self.tables = tuple(tables) if tables else None
+        self.offset = None
+
+    def _load_offset(self, conn):
+        if self.offset is None and self.durable:
+            row = conn.execute("SELECT last_seq FROM change_consumers WHERE name = ?", (self.name,)).fetchone()
+            self.offset = row[0] if row else 0
+        return self.offset or 0
+
+    def reset(self, conn, offset=None):
+        """Moves the offset to `offset` (default: the current head), e.g. after a full rebuild."""
+        self.commit(conn, head(conn) if offset is None else offset)
+
+    def commit(self, conn, offset):
+        self.offset = offset
+        if self.durable:
+            conn.execute("""INSERT INTO change_consumers (name, last_seq, updated) VALUES (?, ?, ?)
+                            ON CONFLICT (name) DO UPDATE
+                            SET last_seq = excluded.last_seq, updated = excluded.updated""",
+                         (self.name, offset, time.strftime('%Y-%m-%d %H:%M:%S')))
+            conn.commit()
+
+    def poll(self, conn, limit=None):
+        """The next batch of changes after the offset (not yet committed)."""
+        offset = self._load_offset(conn)
+        sql = "SELECT seq, table_name, op, row_id, wo_id FROM change_log WHERE seq > ?"
+        params = [offset]
+        if self.tables:
+            sql += f" AND table_name IN ({','.join('?' * len(self.tables))})"
+            params.extend(self.tables)
+        rows = conn.execute(sql + " ORDER BY seq LIMIT ?", params + [limit or self.batch_size]).fetchall()
+
+        # Sequence numbers are contiguous, so a missing offset + 1 means it was pruned
+        if offset and (not rows or rows[0][0] != offset + 1):
+            oldest = conn.execute("SELECT MIN(seq) FROM change_log").fetchone()[0]
+            if (oldest is None and head(conn) > offset) or (oldest is not None and oldest > offset + 1):
+                raise ChangeFeedGap(f"Consumer {self.name} is at {offset}, oldest change is {oldest}")
+        return [Change(*row) for row in rows]
+
+    def batches(self, conn):
+        """Yields batches until the consumer is caught up, committing each after it is processed."""
+        while True:
+            batch = self.poll(conn)
+            if not batch:
+                return
+            yield batch
+            self.commit(conn, batch[-1].seq)
+            if len(batch) < self.batch_size:
+                return
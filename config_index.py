@@ -0,0 +1,200 @@
+"""Similarity index over trays in stock (produced but not yet shipped).
+
+A tray is compared by its layout: the reagent code at each of its 16
+locations. Two trays differ by the number of locations whose reagent is
+not the same, so "within k differences" means at most k locations would
+have to be re-filled for the stock tray to match the order.
+
+    index = get_stock_index()
+    index.exact(config)              # identical layout
+    index.similar(config, k=2)       # [(differences, StockTray), ...]
+
+Exact matches use a hash of the layout. Near matches use the pigeonhole
+principle: the locations are split into MAX_DIFFERENCES + 1 bands, and two
+layouts that differ in at most MAX_DIFFERENCES locations agree exactly on
+at least one band. Each band is a dictionary from its reagent codes to
+trays, so a query looks up a few buckets and compares only the trays found
+there; recall is exact, unlike sampled MinHash signatures.
+
+The index follows the change feed (change_feed), checked at most once a
+second: trays of work orders that changed are dropped and re-read if they
+are still in stock, so keeping up costs O(changes), not a table scan.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+import change_feed
+import lims_db
+import wo_lifecycle
+
+MAX_LOCATIONS = 16
+MAX_DIFFERENCES = 3
+REFRESH_INTERVAL = 1.0
+
+StockTray = namedtuple("StockTray", ["tray_id", "wo_id", "customer", "experiments", "layout"])
+
+
+def layout_of(config, max_locations=MAX_LOCATIONS):
+    """Reagent code per location (None where empty) of an optimizer result."""
+    locations = list(config["tray_locations"]) if config else []
+    locations += [None] * (max_locations - len(locations))
+    return tuple(loc["reagent_code"] if loc else None for loc in locations[:max_locations])
+
+
+def layout_hash(layout):
+    return hashlib.sha1("|".join(code or "" for code in layout).encode("utf-8")).hexdigest()
+
+
+def differences(a, b):
+    return sum(x != y for x, y in zip(a, b))
+
+
+def _bands(max_locations=MAX_LOCATIONS, max_differences=MAX_DIFFERENCES):
+    """Splits the locations into max_differences + 1 contiguous bands."""
+    count = max_differences + 1
+    size, extra = divmod(max_locations, count)
+    bands, start = [], 0
+    for band in range(count):
+        end = start + size + (band < extra)
+        bands.append((start, end))
+        start = end
+    return bands
+
+
+class StockIndex:
+    """Process-wide index of stock tray layouts."""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or lims_db.DB_PATH
+        self.bands = _bands()
+        self._trays = {}
+        self._trays_of = defaultdict(set)
+        self._by_hash = defaultdict(set)
+        self._by_band = [defaultdict(set) for _ in self.bands]
+        self._lock = threading.Lock()
+        self._feed = change_feed.Consumer("stock_index", durable=False, tables=("work_orders", "trays"))
+        self._checked = 0.0
+
+    def _add(self, tray):
+        self._trays[tray.tray_id] = tray
+        self._trays_of[tray.wo_id].add(tray.tray_id)
+        self._by_hash[layout_hash(tray.layout)].add(tray.tray_id)
+        for band, (start, end) in enumerate(self.bands):
+            self._by_band[band][tray.layout[start:end]].add(tray.tray_id)
+
+    def _remove(self, tray_id):
+        tray = self._trays.pop(tray_id)
+        self._trays_of[tray.wo_id].discard(tray_id)
+        if not self._trays_of[tray.wo_id]:
+            del self._trays_of[tray.wo_id]
+        self._by_hash[layout_hash(tray.layout)].discard(tray_id)
+        for band, (start, end) in enumerate(self.bands):
+            self._by_band[band][tray.layout[start:end]].discard(tray_id)
+
+    def _load(self, c, wo_ids=None):
+        """Adds the stock trays (of `wo_ids`, or all); returns how many were read."""
+        sql = """SELECT t.id, t.wo_id, wo.customer, t.experiments, t.configuration
+                 FROM trays t JOIN work_orders wo ON wo.id = t.wo_id
+                 WHERE wo.lifecycle_state = ?"""
+        if wo_ids is None:
+            batches = [()]
+        else:
+            wo_ids = list(wo_ids)
+            batches = [wo_ids[start:start + 500] for start in range(0, len(wo_ids), 500)]
+        count = 0
+        for batch in batches:
+            params = [wo_lifecycle.PRODUCTION_COMPLETE]
+            batch_sql = sql
+            if wo_ids is not None:
+                batch_sql += f" AND t.wo_id IN ({','.join('?' * len(batch))})"
+                params.extend(batch)
+            c.execute(batch_sql, params)
+            for tray_id, wo_id, customer, experiments, configuration in c.fetchall():
+                layout = layout_of(lims_db.load_tray_configuration(configuration))
+                self._add(StockTray(tray_id, wo_id, customer, experiments, layout))
+                count += 1
+        return count
+
+    def _rebuild(self, conn):
+        self._trays = {}
+        self._trays_of = defaultdict(set)
+        self._by_hash = defaultdict(set)
+        self._by_band = [defaultdict(set) for _ in self.bands]
+        offset = change_feed.head(conn)
+        count = self._load(conn.cursor())
+        self._feed.reset(conn, offset)
+        return count
+
+    def refresh(self, force=False):
+        """Applies the changes since the last refresh; returns the number of trays read."""
+        now = time.monotonic()
+        if not force and now - self._checked < REFRESH_INTERVAL:
+            return 0
+        self._checked = now
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            if self._feed.offset is None:
+                return self._rebuild(conn)
+            count = 0
+            try:
+                for batch in self._feed.batches(conn):
+                    wo_ids = {change.wo_id for change in batch}
+                    stale = {change.row_id for change in batch
+                             if change.table == "trays" and change.row_id in self._trays}
+                    for wo_id in wo_ids:
+                        stale.update(self._trays_of.get(wo_id, ()))
+                    for tray_id in stale:
+                        self._remove(tray_id)
+                    count += self._load(conn.cursor(), wo_ids)
+            except change_feed.ChangeFeedGap:
+                count = self._rebuild(conn)
+            return count
+        finally:
+            conn.close()
+
+    def __len__(self):
+        return len(self._trays)
+
+    def exact(self, config):
+        """Stock trays with exactly the same layout as `config`."""
+        with self._lock:
+            self.refresh()
+            ids = self._by_hash.get(layout_hash(layout_of(config)), ())
+            return sorted((self._trays[tray_id] for tray_id in ids), key=lambda tray: tray.tray_id)
+
+    def similar(self, config, k=1, exclude_wo=None):
+        """Stock trays within k location differences of `config`, closest first."""
+        if not 0 <= k <= MAX_DIFFERENCES:
+            raise ValueError(f"k must be between 0 and {MAX_DIFFERENCES}")
+        layout = layout_of(config)
+        with self._lock:
+            self.refresh()
+            candidates = set()
+            for band, (start, end) in enumerate(self.bands):
+                candidates |= self._by_band[band].get(layout[start:end], set())
+            matches = []
+            for tray_id in candidates:
+                tray = self._trays[tray_id]
+                if tray.wo_id == exclude_wo:
+                    continue
+                diff = differences(layout, tray.layout)
+                if diff <= k:
+                    matches.append((diff, tray))
+        matches.sort(key=lambda match: (match[0], match[1].tray_id))
+        return matches
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_stock_index():
+    """The process-wide StockIndex for the configured database."""
+    global _index
+    with _index_lock:
+        if _index is None or _index.db_path != lims_db.DB_PATH:
+            _index = StockIndex()
+        return _index
@@ -0,0 +1,293 @@
+"""Local background job queue backed by a SQLite job table.
+
+Long operations (tray optimization, reports, catalog simulations, label
+sheets) are submitted here instead of running inside the Streamlit script
+thread.
+Workers run in a thread or process pool; every state change is written to
+the `jobs` table so any session (or process) can poll, cancel and fetch
+results by job id.
+
+Job states: Queued -> Running -> Complete | Failed | Cancelled
+
+Several server processes can share one job table: each job records the
+process that owns it, and any process can poll or cancel it.
+"""
+import os
+import pickle
+import socket
+import sqlite3
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+import profiling
+from lims_db import DB_PATH
+
+JOB_HANDLERS = {}
+
+
+def job_handler(kind):
+    """Registers a function as the handler for a job kind."""
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+
+@job_handler("optimize_tray")
+def run_optimize_tray(params):
+    from reagent_optimizer import get_optimizer
+    from tray_precompute import optimize_experiments
+
+    return optimize_experiments(get_optimizer(), params["experiments"])
+
+
+@job_handler("configure_work_order")
+def run_configure_work_order(params):
+    from lims_db import create_connection, save_tray_configuration
+
+    config = run_optimize_tray(params)
+    conn = create_connection()
+    try:
+        return save_tray_configuration(conn, params["wo_id"], config)
+    finally:
+        conn.close()
+
+
+@job_handler("report")
+def run_report(params):
+    from lims_db import create_connection
+    from reports import REPORT_TYPES
+
+    conn = create_connection()
+    try:
+        return REPORT_TYPES[params["report_type"]](conn)
+    finally:
+        conn.close()
+
+
+@job_handler("simulate_catalog")
+def run_simulate_catalog(params):
+    from catalog_simulator import simulate
+    from lims_db import create_connection
+
+    conn = create_connection()
+    try:
+        return simulate(conn, params["edits"])
+    finally:
+        conn.close()
+
+
+@job_handler("render_labels")
+def run_render_labels(params):
+    from lims_db import create_connection
+    from tray_labels import render_day
+
+    conn = create_connection()
+    try:
+        return render_day(conn, params["date"])
+    finally:
+        conn.close()
+
+
+def _process_start(pid):
+    """Start time of a process in clock ticks since boot, or None where /proc is unavailable."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rpartition(")")[2].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+# Distinguishes this process from an earlier one that had the same PID, e.g.
+# PID 1 in a restarted container
+_BOOT = _process_start(os.getpid()) or uuid.uuid4().hex
+
+
+def _owner():
+    """Identifies the process whose pool runs a job."""
+    return f"{socket.gethostname()}:{os.getpid()}:{_BOOT}"
+
+
+def _owner_alive(owner):
+    # Older rows are "host:pid" without the boot token
+    host, pid, boot = ((owner or "").split(":") + ["", ""])[:3]
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    if int(pid) == os.getpid():
+        # This process is only now starting its queue, so nothing it owns is running
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    # A live PID may belong to an unrelated process that reused it
+    started = _process_start(pid)
+    return not (boot and started is not None and started != boot)
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _connect(db_path):
+    return sqlite3.connect(db_path, timeout=30)
+
+
+def setup_job_table(db_path=DB_PATH):
+    conn = _connect(db_path)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS jobs
+                 (id TEXT PRIMARY KEY,
+                  kind TEXT,
+                  params BLOB,
+                  status TEXT,
+                  result BLOB,
+                  error TEXT,
+                  created_at TEXT,
+                  started_at TEXT,
+                  finished_at TEXT,
+                  owner TEXT)''')
+    c.execute("PRAGMA table_info(jobs)")
+    if "owner" not in {row[1] for row in c.fetchall()}:
+        c.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+    conn.commit()
+    conn.close()
+
+
+def _run_job(db_path, job_id, kind, params, profile=None):
+    """Worker entry point. Module-level so it can be shipped to a process pool.
+
+    `profile` is the submitting thread's profiling mode, so a session opened
+    with ?profile= also profiles the work it hands to the queue.
+    """
+    conn = _connect(db_path)
+    c = conn.cursor()
+    try:
+        # Claim the job; a cancel that landed first leaves nothing to do
+        c.execute("UPDATE jobs SET status = 'Running', started_at = ? WHERE id = ? AND status = 'Queued'",
+                  (_now(), job_id))
+        conn.commit()
+        if c.rowcount == 0:
+            return
+
+        try:
+            with profiling.request_mode(profile):
+                result = JOB_HANDLERS[kind](params)
+        except Exception as e:
+            c.execute("""UPDATE jobs SET status = 'Failed', error = ?, finished_at = ?
+                         WHERE id = ? AND status = 'Running'""",
+                      (f"{e}\n{traceback.format_exc()}", _now(), job_id))
+        else:
+            # A job cancelled while running keeps its 'Cancelled' state and drops the result
+            c.execute("""UPDATE jobs SET status = 'Complete', result = ?, finished_at = ?
+                         WHERE id = ? AND status = 'Running'""",
+                      (pickle.dumps(result), _now(), job_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class JobQueue:
+    def __init__(self, db_path=DB_PATH, max_workers=2, use_processes=False):
+        self.db_path = db_path
+        setup_job_table(db_path)
+        self._recover_interrupted()
+        # Stored results can be large, so old ones go whenever a server process starts
+        self.purge()
+        executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self.executor = executor_cls(max_workers=max_workers)
+        self._futures = {}
+
+    def _recover_interrupted(self):
+        # Jobs whose owning process has exited (or is this process, before its
+        # pool exists) will never finish. Jobs owned by other live worker
+        # processes sharing this database are left alone.
+        conn = _connect(self.db_path)
+        pending = conn.execute("SELECT id, owner FROM jobs WHERE status IN ('Queued', 'Running')").fetchall()
+        dead = [(_now(), job_id) for job_id, owner in pending if not _owner_alive(owner)]
+        conn.executemany("""UPDATE jobs SET status = 'Failed', error = 'Interrupted by server restart',
+                            finished_at = ? WHERE id = ? AND status IN ('Queued', 'Running')""", dead)
+        conn.commit()
+        conn.close()
+
+    def submit(self, kind, params):
+        """Queues a job and returns its id."""
+        if kind not in JOB_HANDLERS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        conn = _connect(self.db_path)
+        conn.execute("""INSERT INTO jobs (id, kind, params, status, created_at, owner)
+                        VALUES (?, ?, ?, 'Queued', ?, ?)""",
+                     (job_id, kind, pickle.dumps(params), _now(), _owner()))
+        conn.commit()
+        conn.close()
+
+        future = self.executor.submit(_run_job, self.db_path, job_id, kind, params, profiling.current_mode())
+        self._futures[job_id] = future
+        future.add_done_callback(lambda _: self._futures.pop(job_id, None))
+        return job_id
+
+    def poll(self, job_id):
+        """Returns the job's status record (without its result), or None if unknown."""
+        conn = _connect(self.db_path)
+        row = conn.execute("""SELECT id, kind, status, error, created_at, started_at, finished_at
+                              FROM jobs WHERE id = ?""", (job_id,)).fetchone()
+        conn.close()
+        if row is None:
+            return None
+        return dict(zip(["id", "kind", "status", "error", "created_at", "started_at", "finished_at"], row))
+
+    def cancel(self, job_id):
+        """Cancels a queued or running job. Running jobs finish but their result is discarded."""
+        future = self._futures.get(job_id)
+        if future is not None:
+            future.cancel()
+        conn = _connect(self.db_path)
+        c = conn.cursor()
+        c.execute("""UPDATE jobs SET status = 'Cancelled', finished_at = ?
+                     WHERE id = ? AND status IN ('Queued', 'Running')""", (_now(), job_id))
+        conn.commit()
+        conn.close()
+        return c.rowcount > 0
+
+    def result(self, job_id):
+        """Returns the result of a completed job; raises if it failed or is not finished."""
+        conn = _connect(self.db_path)
+        row = conn.execute("SELECT status, result, error FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        conn.close()
+        if row is None:
+            raise KeyError(job_id)
+        status, result, error = row
+        if status == 'Complete':
+            return pickle.loads(result)
+        if status == 'Failed':
+            raise RuntimeError(error)
+        raise RuntimeError(f"Job {job_id} is {status}")
+
+    def list_jobs(self, limit=50):
+        conn = _connect(self.db_path)
+        rows = conn.execute("""SELECT id, kind, status, created_at, finished_at
+                               FROM jobs ORDER BY created_at DESC LIMIT ?""", (limit,)).fetchall()
+        conn.close()
+        return rows
+
+    def purge(self, older_than_days=7):
+        return purge_jobs(self.db_path, older_than_days)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+def purge_jobs(db_path=DB_PATH, older_than_days=7):
+    """Deletes finished jobs (and their stored results) older than the given age."""
+    conn = _connect(db_path)
+    c = conn.execute("""DELETE FROM jobs WHERE status NOT IN ('Queued', 'Running')
+                        AND finished_at < datetime('now', 'localtime', ?)""", (f"-{older_than_days} days",))
+    conn.commit()
+    conn.close()
+    return c.rowcount
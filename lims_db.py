@@ -0,0 +1,351 @@
+"""SQLite access shared by the Streamlit app and background workers."""
+import re
+import sqlite3
+import threading
+from datetime import datetime
+
+import audit_log
+import change_feed
+import session_store
+import shared_cache
+import wo_lifecycle
+from reagent_optimizer import canonical_key, deserialize_configuration, serialize_configuration
+
+DB_PATH = 'reagent_lims.db'
+
+
+def create_connection():
+    # Several worker processes may share the file; wait for locks instead of failing
+    return sqlite3.connect(DB_PATH, timeout=30)
+
+
+def setup_database():
+    conn = create_connection()
+    c = conn.cursor()
+    # WAL lets readers in other processes proceed while one process writes
+    c.execute("PRAGMA journal_mode=WAL")
+    
+    # Create tables with updated schema
+    c.execute('''CREATE TABLE IF NOT EXISTS work_orders
+                 (id TEXT PRIMARY KEY,
+                  customer TEXT,
+                  requester TEXT,
+                  date TEXT,
+                  status TEXT,
+                  lifecycle_state TEXT,
+                  state_changed TEXT)''')
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS trays
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  wo_id TEXT,
+                  customer TEXT,
+                  requester TEXT,
+                  date TEXT,
+                  configuration TEXT,
+                  experiments TEXT,
+                  FOREIGN KEY(wo_id) REFERENCES work_orders(id))''')
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS production
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  tray_id INTEGER,
+                  wo_id TEXT,
+                  start_date TEXT,
+                  end_date TEXT,
+                  status TEXT,
+                  FOREIGN KEY(tray_id) REFERENCES trays(id),
+                  FOREIGN KEY(wo_id) REFERENCES work_orders(id))''')
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS shipping
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  tray_id INTEGER,
+                  wo_id TEXT,
+                  customer TEXT,
+                  requester TEXT,
+                  tracking_number TEXT,
+                  ship_date TEXT,
+                  FOREIGN KEY(tray_id) REFERENCES trays(id),
+                  FOREIGN KEY(wo_id) REFERENCES work_orders(id))''')
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS inventory
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  wo_id TEXT,
+                  reagent TEXT,
+                  batch TEXT,
+                  quantity INTEGER,
+                  date TEXT,
+                  status TEXT,
+                  FOREIGN KEY(wo_id) REFERENCES work_orders(id))''')
+    
+    migrate_trays(c)
+    migrate_autoincrement(c)
+    # Per-order lookups (incremental analytics, work order detail)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_production_wo ON production(wo_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_shipping_wo ON shipping(wo_id)")
+    wo_lifecycle.migrate(c)
+    audit_log.setup_audit_tables(c)
+    change_feed.setup_change_log(c)
+    session_store.setup_session_table(c)
+    conn.commit()
+    conn.close()
+
+
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+
+def ensure_database():
+    """Runs setup_database once per process and database file; later calls are free."""
+    if DB_PATH in _schema_ready:
+        return
+    with _schema_lock:
+        if DB_PATH not in _schema_ready:
+            setup_database()
+            _schema_ready.add(DB_PATH)
+
+
+def migrate_trays(c):
+    """Adds trays.experiments (canonical experiment key) to older databases and backfills it."""
+    c.execute("PRAGMA table_info(trays)")
+    if "experiments" not in {row[1] for row in c.fetchall()}:
+        c.execute("ALTER TABLE trays ADD COLUMN experiments TEXT")
+        c.execute("SELECT id, configuration FROM trays WHERE configuration IS NOT NULL")
+        updates = []
+        for tray_id, configuration in c.fetchall():
+            try:
+                updates.append((canonical_key(deserialize_configuration(configuration)["results"]), tray_id))
+            except ValueError:
+                # Rows saved before configurations were stored as JSON
+                continue
+        c.executemany("UPDATE trays SET experiments = ? WHERE id = ?", updates)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_trays_wo ON trays(wo_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_trays_experiments ON trays(experiments)")
+
+
+# Tables whose rows can be moved to the archive (order_archive). Their ids
+# must never be handed out again, or archived rows would collide with new ones.
+ARCHIVED_ID_TABLES = ("trays", "production", "shipping", "inventory")
+
+
+def migrate_autoincrement(c):
+    """Rebuilds older tables with AUTOINCREMENT ids, seeded past every archived id.
+
+    Plain INTEGER PRIMARY KEY reuses the highest ids once those rows are
+    deleted, which is exactly what archiving does.
+    """
+    for table in ARCHIVED_ID_TABLES:
+        c.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        sql = c.fetchone()[0]
+        if "AUTOINCREMENT" in sql.upper():
+            continue
+        c.execute("SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') "
+                  "AND sql IS NOT NULL", (table,))
+        dependents = [row[0] for row in c.fetchall()]
+        rebuilt = f"{table}_rebuild"
+        create = re.sub(rf'^CREATE TABLE\s+"?{table}"?', f"CREATE TABLE {rebuilt}", sql, count=1)
+        create = re.sub(r"\bid INTEGER PRIMARY KEY\b", "id INTEGER PRIMARY KEY AUTOINCREMENT", create, count=1)
+        c.execute(create)
+        c.execute(f"INSERT INTO {rebuilt} SELECT * FROM {table}")
+        c.execute(f"DROP TABLE {table}")
+        c.execute(f"ALTER TABLE {rebuilt} RENAME TO {table}")
+        for dependent in dependents:
+            c.execute(dependent)
+
+        # Rows archived before this migration are no longer in the table
+        from order_archive import archived_max_id
+        reserve_ids(c, table, archived_max_id(table))
+
+
+def reserve_ids(c, table, max_id):
+    """Makes sure `table` never hands out an id at or below `max_id`."""
+    if not max_id:
+        return
+    c.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (max_id, table))
+    if c.rowcount == 0:
+        c.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, max_id))
+
+
+def generate_wo_number(c):
+    return reserve_wo_numbers(c, 1)[0]
+
+
+def reserve_wo_numbers(c, count):
+    """Allocates `count` consecutive WO numbers for the current month.
+
+    Call inside a write transaction so the numbers stay reserved until the
+    work orders are inserted.
+    """
+    now = datetime.now()
+    year = now.strftime('%y')
+    month = now.strftime('%m')
+    
+    pattern = f'WO-{year}-{month}-%'
+    # Numbers past 9999 are longer, so order numerically rather than by string
+    c.execute("""SELECT MAX(CAST(substr(id, 10) AS INTEGER)) FROM work_orders
+                 WHERE id LIKE ?""", (pattern,))
+    last_num = c.fetchone()[0] or 0
+    
+    return [f"WO-{year}-{month}-{str(last_num + i).zfill(4)}" for i in range(1, count + 1)]
+
+
+def get_next_step(conn, wo_id):
+    state = wo_lifecycle.get_state(conn.cursor(), wo_id)
+    return wo_lifecycle.next_step(state)
+
+
+def dashboard_rollup(conn, today):
+    """Metrics, 30-day activity and recent work orders shown on the dashboard."""
+    c = conn.cursor()
+
+    metrics = {
+        "Open Work Orders": "SELECT COUNT(*) FROM work_orders WHERE status='Open'",
+        "Today's Trays": "SELECT COUNT(*) FROM trays WHERE date=?",
+        "Production Complete": "SELECT COUNT(*) FROM production WHERE end_date=?",
+        "Shipped Today": "SELECT COUNT(*) FROM shipping WHERE ship_date=?"
+    }
+    rollup = {"metrics": {}, "activity": {}}
+    for label, query in metrics.items():
+        c.execute(query, (today,) if '?' in query else ())
+        rollup["metrics"][label] = c.fetchone()[0]
+
+    queries = {
+        'Work Orders': "SELECT date, COUNT(*) FROM work_orders WHERE date >= date('now', '-30 days') GROUP BY date",
+        'Production': "SELECT end_date, COUNT(*) FROM production WHERE end_date >= date('now', '-30 days') GROUP BY end_date"
+    }
+    for name, query in queries.items():
+        c.execute(query)
+        rollup["activity"][name] = c.fetchall()
+
+    c.execute("""
+        SELECT id, customer, requester, lifecycle_state, state_changed
+        FROM work_orders
+        ORDER BY state_changed DESC LIMIT 10
+    """)
+    rollup["recent"] = c.fetchall()
+    return rollup
+
+
+# Write paths. Each runs as a single transaction on the caller's connection so
+# the Streamlit app, background jobs and the REST service share one implementation.
+# After committing they snapshot the audit log when it is due and invalidate
+# the shared dashboard cache for every process.
+
+def create_work_order(conn, customer, requester, date):
+    """Creates a work order and its inventory record; returns the new WO number."""
+    date = date if isinstance(date, str) else date.strftime('%Y-%m-%d')
+    c = conn.cursor()
+    # IMMEDIATE takes the write lock before reading the last number, so two
+    # concurrent creates cannot hand out the same WO number
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        wo_id = generate_wo_number(c)
+        c.execute("""INSERT INTO work_orders 
+                    (id, customer, requester, date, status, lifecycle_state, state_changed) 
+                    VALUES (?, ?, ?, ?, ?, ?, datetime('now', 'localtime'))""",
+                 (wo_id, customer, requester, date, 'Open', wo_lifecycle.CREATED))
+        
+        c.execute("""INSERT INTO inventory 
+                    (wo_id, date, status) 
+                    VALUES (?, ?, ?)""",
+                 (wo_id, date, 'Created'))
+        audit_log.record_event(c, audit_log.TRANSITION, wo_id,
+                               payload={"from": None, "to": wo_lifecycle.CREATED})
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    audit_log.maybe_snapshot(conn)
+    shared_cache.invalidate(shared_cache.DASHBOARD)
+    return wo_id
+
+
+def save_tray_configuration(conn, wo_id, config):
+    """Stores the optimized configuration as the work order's tray; returns the tray id."""
+    c = conn.cursor()
+    c.execute("SELECT customer, requester FROM work_orders WHERE id = ?", (wo_id,))
+    wo = c.fetchone()
+    if wo is None:
+        raise ValueError(f"Unknown work order: {wo_id}")
+
+    now = datetime.now().strftime('%Y-%m-%d')
+    configuration = serialize_configuration(config)
+    experiments = canonical_key(config["results"])
+    try:
+        c.execute("SELECT id FROM trays WHERE wo_id = ?", (wo_id,))
+        existing = c.fetchone()
+        if existing:
+            tray_id = existing[0]
+            c.execute("UPDATE trays SET configuration = ?, experiments = ?, date = ? WHERE id = ?",
+                      (configuration, experiments, now, tray_id))
+        else:
+            c.execute("""INSERT INTO trays (wo_id, customer, requester, date, configuration, experiments)
+                         VALUES (?, ?, ?, ?, ?, ?)""",
+                      (wo_id, wo[0], wo[1], now, configuration, experiments))
+            tray_id = c.lastrowid
+        c.execute("UPDATE inventory SET status = 'Configured' WHERE wo_id = ?", (wo_id,))
+        wo_lifecycle.transition(c, wo_id, wo_lifecycle.CONFIGURED)
+        conn.commit()
+    except Exception:
+        # A rejected transition must not leave its rows for the next commit on this connection
+        conn.rollback()
+        raise
+    audit_log.maybe_snapshot(conn)
+    shared_cache.invalidate(shared_cache.DASHBOARD)
+    return tray_id
+
+
+def load_tray_configuration(text):
+    """Parses a trays.configuration value back into an optimizer result."""
+    return deserialize_configuration(text) if text else None
+
+
+def complete_production(conn, tray_id):
+    c = conn.cursor()
+    c.execute("SELECT wo_id FROM trays WHERE id = ?", (tray_id,))
+    tray = c.fetchone()
+    if tray is None:
+        raise ValueError(f"Unknown tray: {tray_id}")
+    now = datetime.now().strftime('%Y-%m-%d')
+    
+    try:
+        c.execute("""
+            INSERT INTO production (tray_id, wo_id, start_date, end_date, status)
+            VALUES (?, ?, ?, ?, ?)
+        """, (tray_id, tray[0], now, now, 'Complete'))
+
+        c.execute("UPDATE inventory SET status = 'Production Complete' WHERE wo_id = ?",
+                 (tray[0],))
+        wo_lifecycle.transition(c, tray[0], wo_lifecycle.PRODUCTION_COMPLETE)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    audit_log.maybe_snapshot(conn)
+    shared_cache.invalidate(shared_cache.DASHBOARD)
+
+
+def process_shipment(conn, tray_id, tracking, ship_date):
+    ship_date = ship_date if isinstance(ship_date, str) else ship_date.strftime('%Y-%m-%d')
+    c = conn.cursor()
+    c.execute("""SELECT t.wo_id, wo.customer, wo.requester
+                 FROM trays t JOIN work_orders wo ON t.wo_id = wo.id
+                 WHERE t.id = ?""", (tray_id,))
+    tray = c.fetchone()
+    if tray is None:
+        raise ValueError(f"Unknown tray: {tray_id}")
+    wo_id, customer, requester = tray
+    
+    try:
+        c.execute("""
+            INSERT INTO shipping (tray_id, wo_id, customer, requester, tracking_number, ship_date)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (tray_id, wo_id, customer, requester, tracking, ship_date))
+
+        c.execute("UPDATE work_orders SET status = 'Complete' WHERE id = ?", (wo_id,))
+        c.execute("UPDATE inventory SET status = 'Shipped' WHERE wo_id = ?", (wo_id,))
+        wo_lifecycle.transition(c, wo_id, wo_lifecycle.SHIPPED)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    audit_log.maybe_snapshot(conn)
+    shared_cache.invalidate(shared_cache.DASHBOARD)
@@ -0,0 +1,436 @@
+"""Headless JSON service exposing the optimizer and LIMS write paths.
+
+A plain ASGI application (no framework) so it runs under any ASGI server:
+
+    uvicorn lims_service:app --workers 4 --port 8000
+
+Routes
+    GET  /health
+    GET  /api/experiments
+    POST /api/optimize                  {"experiments": [1, 5, 12]}
+    POST /api/optimize/batch            {"requests": [{"experiments": [...]}, ...]}
+    GET  /api/work-orders               ?status=Open&limit=100
+    GET  /api/work-orders/{wo_id}
+    POST /api/work-orders               {"customer", "requester", "date"}
+    POST /api/work-orders/batch         {"work_orders": [{...}, ...]}
+    POST /api/work-orders/{wo_id}/tray  {"experiments": [...]}
+    POST /api/trays/{tray_id}/production
+    POST /api/trays/{tray_id}/shipment  {"tracking_number", "ship_date"}
+    POST /api/shipments/batch           {"shipments": [{"tray_id", "tracking_number", "ship_date"}, ...]}
+    POST /api/scans                     {"scans": [{"tray_id", "location", "barcode", "source"}, ...]}
+    GET  /api/trays/{tray_id}/scans
+    POST /api/jobs                      {"kind", "params"}
+    GET  /api/jobs/{job_id}
+
+SQLite calls are blocking, so handlers hand them to a thread pool and draw
+connections from a shared pool instead of opening one per request.
+"""
+import asyncio
+import functools
+import json
+import queue
+import re
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import parse_qsl
+
+import lims_db
+import wo_lifecycle
+from job_queue import JobQueue
+from reagent_optimizer import (
+    canonical_key,
+    deserialize_configuration,
+    get_optimizer,
+    serialize_configuration,
+)
+from scan_ingest import ScanIngestor
+from tray_precompute import optimize_experiments
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ConnectionPool:
+    """Fixed-size pool of SQLite connections shared across handler threads."""
+
+    def __init__(self, db_path=None, size=8):
+        self._pool = queue.Queue(maxsize=size)
+        for _ in range(size):
+            conn = sqlite3.connect(db_path or lims_db.DB_PATH, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._pool.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._pool.put(conn)
+
+
+optimizer = get_optimizer()
+pool = None
+jobs = None
+scans = None
+
+
+@functools.lru_cache(maxsize=4096)
+def _optimize_cached(key):
+    """Serialized optimizer response for a canonical experiment key; hits skip solve and encode.
+
+    Misses go to the cache shared with the other worker processes.
+    """
+    experiments = [int(exp) for exp in key.split(",")]
+    return serialize_configuration(optimize_experiments(optimizer, experiments))
+
+
+def optimize_json(experiments):
+    if not experiments:
+        raise HTTPError(400, "At least one experiment is required")
+    try:
+        return _optimize_cached(canonical_key(int(exp) for exp in experiments))
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+
+
+async def run_db(func, *args):
+    """Runs a blocking lims_db call on a pooled connection off the event loop."""
+    def call():
+        with pool.connection() as conn:
+            return func(conn, *args)
+    return await asyncio.get_running_loop().run_in_executor(None, call)
+
+
+def _require(body, *fields):
+    missing = [f for f in fields if not body.get(f)]
+    if missing:
+        raise HTTPError(400, f"Missing field(s): {', '.join(missing)}")
+
+
+def _positive_int(value, name):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"{name} must be an integer")
+    if number < 1:
+        raise HTTPError(400, f"{name} must be positive")
+    return number
+
+
+def _batch_item(item):
+    if not isinstance(item, dict):
+        raise HTTPError(400, "Each batch item must be an object")
+    return item
+
+
+# Handlers. Each returns a JSON-serializable object or pre-encoded JSON text.
+
+async def health(request):
+    return {"status": "ok"}
+
+
+async def list_experiments(request):
+    return optimizer.get_available_experiments()
+
+
+async def optimize(request):
+    body = await request.json()
+    return RawJSON(optimize_json(body.get("experiments") or []))
+
+
+async def optimize_batch(request):
+    body = await request.json()
+    parts = []
+    for item in body.get("requests", []):
+        try:
+            parts.append('{"configuration":' + optimize_json(item.get("experiments") or []) + "}")
+        except HTTPError as e:
+            parts.append(json.dumps({"error": e.message}))
+    return RawJSON('{"results":[' + ",".join(parts) + "]}")
+
+
+def _query_work_orders(conn, status, limit):
+    c = conn.cursor()
+    sql = "SELECT id, customer, requester, date, status FROM work_orders"
+    params = []
+    if status:
+        sql += " WHERE status = ?"
+        params.append(status)
+    sql += " ORDER BY date DESC LIMIT ?"
+    params.append(limit)
+    c.execute(sql, params)
+    return [dict(zip(["id", "customer", "requester", "date", "status"], row)) for row in c.fetchall()]
+
+
+async def list_work_orders(request):
+    # SQLite reads a negative LIMIT as no limit at all
+    limit = min(_positive_int(request.query.get("limit", 100), "limit"), 1000)
+    return await run_db(_query_work_orders, request.query.get("status"), limit)
+
+
+def _get_work_order(conn, wo_id):
+    c = conn.cursor()
+    c.execute("""SELECT id, customer, requester, date, status, lifecycle_state, state_changed
+                 FROM work_orders WHERE id = ?""", (wo_id,))
+    row = c.fetchone()
+    if row is None:
+        raise HTTPError(404, f"Unknown work order: {wo_id}")
+    wo = dict(zip(["id", "customer", "requester", "date", "status", "lifecycle_state", "state_changed"], row))
+    c.execute("SELECT id FROM trays WHERE wo_id = ?", (wo_id,))
+    tray = c.fetchone()
+    wo["tray_id"] = tray[0] if tray else None
+    wo["next_step"] = wo_lifecycle.next_step(wo["lifecycle_state"])[0]
+    return wo
+
+
+async def get_work_order(request):
+    return await run_db(_get_work_order, request.params["wo_id"])
+
+
+def _create_work_order(conn, body):
+    _require(body, "customer", "requester")
+    date = body.get("date") or datetime.now().strftime('%Y-%m-%d')
+    return {"id": lims_db.create_work_order(conn, body["customer"], body["requester"], date)}
+
+
+async def create_work_order(request):
+    return await run_db(_create_work_order, await request.json())
+
+
+def _create_work_orders(conn, items):
+    results = []
+    for item in items:
+        try:
+            results.append(_create_work_order(conn, _batch_item(item)))
+        except HTTPError as e:
+            results.append({"error": e.message})
+    return {"results": results}
+
+
+async def create_work_orders_batch(request):
+    body = await request.json()
+    return await run_db(_create_work_orders, body.get("work_orders", []))
+
+
+async def configure_work_order_tray(request):
+    body = await request.json()
+    config = deserialize_configuration(optimize_json(body.get("experiments") or []))
+
+    def save(conn, wo_id):
+        try:
+            return lims_db.save_tray_configuration(conn, wo_id, config)
+        except wo_lifecycle.InvalidTransition as e:
+            raise HTTPError(409, str(e))
+        except ValueError as e:
+            raise HTTPError(404, str(e))
+    tray_id = await run_db(save, request.params["wo_id"])
+    return {"tray_id": tray_id, "wo_id": request.params["wo_id"]}
+
+
+def _complete_production(conn, tray_id):
+    try:
+        lims_db.complete_production(conn, tray_id)
+    except wo_lifecycle.InvalidTransition as e:
+        raise HTTPError(409, str(e))
+    except ValueError as e:
+        raise HTTPError(404, str(e))
+    return {"tray_id": tray_id, "status": "Complete"}
+
+
+async def complete_production(request):
+    return await run_db(_complete_production, int(request.params["tray_id"]))
+
+
+def _process_shipment(conn, tray_id, body):
+    _require(body, "tracking_number")
+    ship_date = body.get("ship_date") or datetime.now().strftime('%Y-%m-%d')
+    try:
+        lims_db.process_shipment(conn, tray_id, body["tracking_number"], ship_date)
+    except wo_lifecycle.InvalidTransition as e:
+        raise HTTPError(409, str(e))
+    except ValueError as e:
+        raise HTTPError(404, str(e))
+    return {"tray_id": tray_id, "tracking_number": body["tracking_number"], "ship_date": ship_date}
+
+
+async def process_shipment(request):
+    return await run_db(_process_shipment, int(request.params["tray_id"]), await request.json())
+
+
+def _process_shipments(conn, items):
+    results = []
+    for item in items:
+        try:
+            # Bad input fails its own item; earlier shipments are already committed
+            item = _batch_item(item)
+            results.append(_process_shipment(conn, _positive_int(item.get("tray_id"), "tray_id"), item))
+        except HTTPError as e:
+            results.append({"error": e.message})
+    return {"results": results}
+
+
+async def process_shipments_batch(request):
+    body = await request.json()
+    return await run_db(_process_shipments, body.get("shipments", []))
+
+
+async def ingest_scans(request):
+    body = await request.json()
+    items = body["scans"] if "scans" in body else [body]
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(None, scans.scan_many, items)
+    # Scans are answered from memory; the event log is written in batches
+    await run_db(scans.flush_if_due)
+    return {"results": results}
+
+
+async def get_scan_progress(request):
+    progress = await asyncio.get_running_loop().run_in_executor(
+        None, scans.progress, int(request.params["tray_id"]))
+    if progress is None:
+        raise HTTPError(404, "Unknown tray")
+    return progress
+
+
+async def submit_job(request):
+    body = await request.json()
+    try:
+        return {"id": jobs.submit(body.get("kind"), body.get("params") or {})}
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+
+
+async def get_job(request):
+    job = await asyncio.get_running_loop().run_in_executor(None, jobs.poll, request.params["job_id"])
+    if job is None:
+        raise HTTPError(404, "Unknown job")
+    return job
+
+
+ROUTES = [
+    ("GET", r"/health", health),
+    ("GET", r"/api/experiments", list_experiments),
+    ("POST", r"/api/optimize", optimize),
+    ("POST", r"/api/optimize/batch", optimize_batch),
+    ("GET", r"/api/work-orders", list_work_orders),
+    ("POST", r"/api/work-orders", create_work_order),
+    ("POST", r"/api/work-orders/batch", create_work_orders_batch),
+    ("GET", r"/api/work-orders/(?P<wo_id>[^/]+)", get_work_order),
+    ("POST", r"/api/work-orders/(?P<wo_id>[^/]+)/tray", configure_work_order_tray),
+    ("POST", r"/api/trays/(?P<tray_id>\d+)/production", complete_production),
+    ("POST", r"/api/trays/(?P<tray_id>\d+)/shipment", process_shipment),
+    ("POST", r"/api/shipments/batch", process_shipments_batch),
+    ("POST", r"/api/scans", ingest_scans),
+    ("GET", r"/api/trays/(?P<tray_id>\d+)/scans", get_scan_progress),
+    ("POST", r"/api/jobs", submit_job),
+    ("GET", r"/api/jobs/(?P<job_id>[^/]+)", get_job),
+]
+_COMPILED_ROUTES = [(method, re.compile(pattern + r"/?$"), handler) for method, pattern, handler in ROUTES]
+
+
+class RawJSON(str):
+    """Marks a handler result that is already encoded JSON."""
+
+
+class Request:
+    def __init__(self, scope, receive, params):
+        self.scope = scope
+        self._receive = receive
+        self.params = params
+        self.query = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+
+    async def body(self):
+        chunks = []
+        more = True
+        while more:
+            message = await self._receive()
+            chunks.append(message.get("body", b""))
+            more = message.get("more_body", False)
+        return b"".join(chunks)
+
+    async def json(self):
+        raw = await self.body()
+        if not raw:
+            return {}
+        try:
+            return json.loads(raw)
+        except ValueError:
+            raise HTTPError(400, "Request body is not valid JSON")
+
+
+async def _send_json(send, status, payload):
+    body = (payload if isinstance(payload, RawJSON) else json.dumps(payload)).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def startup():
+    global pool, jobs, scans
+    if pool is None:
+        lims_db.ensure_database()
+        pool = ConnectionPool()
+        jobs = JobQueue()
+        scans = ScanIngestor()
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            startup()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if jobs:
+                jobs.shutdown(wait=False)
+            if scans:
+                with pool.connection() as conn:
+                    scans.flush(conn)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    # Servers without lifespan support start us on the first request
+    startup()
+
+    path = scope["path"]
+    allowed = False
+    for method, pattern, handler in _COMPILED_ROUTES:
+        match = pattern.match(path)
+        if not match:
+            continue
+        allowed = True
+        if method != scope["method"]:
+            continue
+        try:
+            result = await handler(Request(scope, receive, match.groupdict()))
+            await _send_json(send, 200, result)
+        except HTTPError as e:
+            await _send_json(send, e.status, {"message": e.message})
+        except sqlite3.IntegrityError as e:
+            await _send_json(send, 409, {"message": str(e)})
+        except Exception as e:
+            await _send_json(send, 500, {"message": str(e)})
+        return
+
+    if allowed:
+        await _send_json(send, 405, {"message": "Method not allowed"})
+    else:
+        await _send_json(send, 404, {"message": "Not found"})
@@ -0,0 +1,296 @@
+"""Load generator simulating concurrent LIMS operators against a seeded database.
+
+    python load_test.py --orders 20000 --workers 16 --mode process --duration 30
+
+Seeds a fresh SQLite database (never reagent_lims.db) with work orders in
+every lifecycle state, then runs N worker threads or processes. Each worker
+repeatedly performs an operation drawn from the mix, through the same
+lims_db write paths the app and the service use:
+
+    create      create_work_order (WO number allocation + insert)
+    configure   optimize a tray and save_tray_configuration
+    produce     complete_production
+    ship        process_shipment
+    dashboard   the dashboard rollup queries
+
+and reports throughput, latency percentiles, "database is locked" errors,
+WO-number collisions and lifecycle conflicts (two operators picking the
+same order) per operation.
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import lims_db
+import wo_lifecycle
+from reagent_optimizer import get_optimizer, serialize_configuration
+
+DEFAULT_MIX = {"create": 2, "configure": 2, "produce": 2, "ship": 2, "dashboard": 2}
+
+CUSTOMERS = [f"Customer {i}" for i in range(40)]
+REQUESTERS = [f"Requester {i}" for i in range(15)]
+COMBINATIONS = [[1], [1, 5], [3, 4], [1, 5, 12], [7, 9], [10], [2, 13, 14], [6, 8], [22, 27, 31], [29, 15]]
+
+# Seeded lifecycle mix: mostly history, with open work in every state
+SEED_STATES = [(wo_lifecycle.SHIPPED, 0.6), (wo_lifecycle.PRODUCTION_COMPLETE, 0.1),
+               (wo_lifecycle.CONFIGURED, 0.15), (wo_lifecycle.CREATED, 0.15)]
+
+# Outcomes
+OK = "ok"
+LOCKED = "locked"
+COLLISION = "collision"
+CONFLICT = "conflict"
+SKIPPED = "skipped"
+ERROR = "error"
+
+
+def seed_database(db_path, orders, rng):
+    """Creates the schema and `orders` work orders spread over the last 12 months."""
+    lims_db.DB_PATH = db_path
+    lims_db.setup_database()
+    optimizer = get_optimizer()
+    configurations = [serialize_configuration(optimizer.optimize_tray_configuration(combo)) for combo in COMBINATIONS]
+    keys = [",".join(str(exp) for exp in sorted(combo)) for combo in COMBINATIONS]
+
+    today = datetime.now()
+    counters = defaultdict(int)
+    work_orders, trays, production, shipping = [], [], [], []
+    states = [state for state, _ in SEED_STATES]
+    weights = [weight for _, weight in SEED_STATES]
+    for _ in range(orders):
+        created = today - timedelta(days=rng.randint(1, 365))
+        # Previous months only, so live creates in this month start numbering at 1
+        if created.month == today.month and created.year == today.year:
+            created -= timedelta(days=31)
+        prefix = created.strftime("WO-%y-%m")
+        counters[prefix] += 1
+        wo_id = f"{prefix}-{counters[prefix]:04d}"
+        state = rng.choices(states, weights)[0]
+        date = created.strftime("%Y-%m-%d")
+        customer, requester = rng.choice(CUSTOMERS), rng.choice(REQUESTERS)
+        work_orders.append((wo_id, customer, requester, date, "Open", state, date))
+        if state == wo_lifecycle.CREATED:
+            continue
+        tray_id = len(trays) + 1
+        choice = rng.randrange(len(configurations))
+        trays.append((tray_id, wo_id, customer, requester, date, configurations[choice], keys[choice]))
+        if state in (wo_lifecycle.PRODUCTION_COMPLETE, wo_lifecycle.SHIPPED):
+            production.append((tray_id, wo_id, date, date, "Complete"))
+        if state == wo_lifecycle.SHIPPED:
+            shipping.append((tray_id, wo_id, customer, requester, f"TRK{tray_id:08d}", date))
+
+    conn = sqlite3.connect(db_path)
+    conn.executemany("""INSERT INTO work_orders (id, customer, requester, date, status, lifecycle_state, state_changed)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)""", work_orders)
+    conn.executemany("""INSERT INTO trays (id, wo_id, customer, requester, date, configuration, experiments)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)""", trays)
+    conn.executemany("""INSERT INTO production (tray_id, wo_id, start_date, end_date, status)
+                        VALUES (?, ?, ?, ?, ?)""", production)
+    conn.executemany("""INSERT INTO shipping (tray_id, wo_id, customer, requester, tracking_number, ship_date)
+                        VALUES (?, ?, ?, ?, ?, ?)""", shipping)
+    conn.commit()
+    conn.close()
+
+
+def _pick(conn, rng, query, state):
+    # Operators work from the head of each queue, which is where they collide
+    rows = conn.execute(query + " LIMIT 20", (state,)).fetchall()
+    return rng.choice(rows)[0] if rows else None
+
+
+def op_create(conn, rng, today):
+    lims_db.create_work_order(conn, rng.choice(CUSTOMERS), rng.choice(REQUESTERS), today)
+    return OK
+
+
+def op_configure(conn, rng, today):
+    from tray_precompute import optimize_experiments
+
+    wo_id = _pick(conn, rng, "SELECT id FROM work_orders WHERE lifecycle_state = ?", wo_lifecycle.CREATED)
+    if wo_id is None:
+        return SKIPPED
+    config = optimize_experiments(get_optimizer(), rng.choice(COMBINATIONS))
+    lims_db.save_tray_configuration(conn, wo_id, config)
+    return OK
+
+
+def op_produce(conn, rng, today):
+    tray_id = _pick(conn, rng, """SELECT t.id FROM trays t JOIN work_orders wo ON wo.id = t.wo_id
+                                  WHERE wo.lifecycle_state = ?""", wo_lifecycle.CONFIGURED)
+    if tray_id is None:
+        return SKIPPED
+    lims_db.complete_production(conn, tray_id)
+    return OK
+
+
+def op_ship(conn, rng, today):
+    tray_id = _pick(conn, rng, """SELECT t.id FROM trays t JOIN work_orders wo ON wo.id = t.wo_id
+                                  WHERE wo.lifecycle_state = ?""", wo_lifecycle.PRODUCTION_COMPLETE)
+    if tray_id is None:
+        return SKIPPED
+    lims_db.process_shipment(conn, tray_id, f"LT{rng.getrandbits(40):012d}", today)
+    return OK
+
+
+def op_dashboard(conn, rng, today):
+    lims_db.dashboard_rollup(conn, today)
+    return OK
+
+
+OPERATIONS = {
+    "create": op_create,
+    "configure": op_configure,
+    "produce": op_produce,
+    "ship": op_ship,
+    "dashboard": op_dashboard,
+}
+
+
+def classify(error):
+    message = str(error).lower()
+    if isinstance(error, sqlite3.OperationalError) and ("locked" in message or "busy" in message):
+        return LOCKED
+    if isinstance(error, sqlite3.IntegrityError) and "work_orders.id" in message:
+        return COLLISION
+    if isinstance(error, wo_lifecycle.InvalidTransition):
+        return CONFLICT
+    return ERROR
+
+
+def run_worker(db_path, worker_id, mix, duration, max_ops, seed):
+    """Runs operations until the time or operation limit; returns (op, outcome, seconds) records."""
+    lims_db.DB_PATH = db_path
+    rng = random.Random(seed * 1000 + worker_id)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    today = datetime.now().strftime("%Y-%m-%d")
+    conn = lims_db.create_connection()
+    records = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline and (not max_ops or len(records) < max_ops):
+        name = rng.choices(names, weights)[0]
+        started = time.perf_counter()
+        try:
+            outcome = OPERATIONS[name](conn, rng, today)
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            outcome = classify(e)
+        records.append((name, outcome, time.perf_counter() - started))
+    conn.close()
+    return records
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return round(sorted_values[index] * 1000, 2)
+
+
+def summarize(records, elapsed):
+    by_op = defaultdict(list)
+    for name, outcome, seconds in records:
+        by_op[name].append((outcome, seconds))
+    by_op["all"] = [(outcome, seconds) for _, outcome, seconds in records]
+
+    summary = {}
+    for name, rows in by_op.items():
+        outcomes = defaultdict(int)
+        for outcome, _ in rows:
+            outcomes[outcome] += 1
+        latencies = sorted(seconds for outcome, seconds in rows if outcome == OK)
+        summary[name] = {
+            "ops": len(rows),
+            "ok": outcomes[OK],
+            "throughput": round(outcomes[OK] / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": _percentile(latencies, 50),
+            "p95_ms": _percentile(latencies, 95),
+            "p99_ms": _percentile(latencies, 99),
+            "max_ms": _percentile(latencies, 100),
+            "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else None,
+            LOCKED: outcomes[LOCKED],
+            COLLISION: outcomes[COLLISION],
+            CONFLICT: outcomes[CONFLICT],
+            SKIPPED: outcomes[SKIPPED],
+            ERROR: outcomes[ERROR],
+        }
+    return summary
+
+
+def run_load_test(db_path, workers=8, mode="thread", duration=30.0, max_ops=0, mix=None, seed=0):
+    mix = mix or DEFAULT_MIX
+    executor_class = ProcessPoolExecutor if mode == "process" else ThreadPoolExecutor
+    started = time.perf_counter()
+    with executor_class(max_workers=workers) as executor:
+        futures = [executor.submit(run_worker, db_path, i, mix, duration, max_ops, seed) for i in range(workers)]
+        records = [record for future in futures for record in future.result()]
+    return summarize(records, time.perf_counter() - started)
+
+
+def print_summary(summary):
+    columns = ["ops", "ok", "throughput", "p50_ms", "p95_ms", "p99_ms", "max_ms",
+               LOCKED, COLLISION, CONFLICT, SKIPPED, ERROR]
+    print(f"{'operation':<10}" + "".join(f"{col:>11}" for col in columns))
+    for name in list(OPERATIONS) + ["all"]:
+        if name in summary:
+            row = summary[name]
+            print(f"{name:<10}" + "".join(f"{'-' if row[col] is None else row[col]:>11}" for col in columns))
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent LIMS operators.")
+    parser.add_argument("--db", help="Database file to create (default: a temporary file)")
+    parser.add_argument("--orders", type=int, default=5000, help="Work orders to seed")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--mode", choices=["thread", "process"], default="thread")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run")
+    parser.add_argument("--ops-per-worker", type=int, default=0, help="Stop each worker after N operations")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="Operation weights, e.g. create=3,configure=2,produce=2,ship=1,dashboard=4")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the summary to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="klims-load-")
+    db_path = args.db or os.path.join(workdir, "load_test.db")
+    if os.path.abspath(db_path) == os.path.abspath(lims_db.DB_PATH):
+        parser.error("Refusing to load-test the live database")
+    if os.path.exists(db_path):
+        parser.error(f"{db_path} already exists")
+    # Keep cache invalidations away from a running app's cache file
+    os.environ.setdefault("KLIMS_CACHE", f"sqlite:{os.path.join(workdir, 'cache.db')}")
+
+    seeding = time.perf_counter()
+    seed_database(db_path, args.orders, random.Random(args.seed))
+    print(f"Seeded {args.orders} work orders into {db_path} in {time.perf_counter() - seeding:.1f}s")
+    print(f"Running {args.workers} {args.mode} workers for {args.duration:g}s")
+
+    summary = run_load_test(db_path, args.workers, args.mode, args.duration, args.ops_per_worker,
+                            args.mix, args.seed)
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""Make-to-stock planning for the most frequently ordered trays.
+
+The optimizer is deterministic, so every order for the same experiment set
+gets the same tray. The planner looks at customer demand per canonical
+experiment set ("1,5,12") and proposes building the popular ones ahead of
+demand when the line has spare capacity:
+
+    demand     weeks x sets matrix of customer trays ordered per week
+               (the last HISTORY_WEEKS complete weeks)
+    forecast   per set, vectorized over the matrix: rolling mean and
+               standard deviation over WINDOW_WEEKS and an exponentially
+               weighted mean (recent weeks count more) as next week's demand
+    target     forecast * COVER_WEEKS + SERVICE_Z * std, rounded up
+    on hand    pre-built trays not yet shipped, plus pre-builds in progress
+    idle       line capacity (90th percentile of weekly completions) minus
+               the open orders already waiting for it, pre-builds included
+
+Shortfalls are filled from the idle capacity, most-demanded sets first.
+Pre-builds are ordinary work orders for the STOCK_CUSTOMER; they are
+configured by the job queue like imported orders, and once produced they
+show up in the stock similarity index (config_index) for reuse.
+"""
+import math
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import shared_cache
+import wo_lifecycle
+from order_archive import load_table
+from reagent_optimizer import EXPERIMENT_DATA
+
+MAKE_TO_STOCK = "make_to_stock"
+
+STOCK_CUSTOMER = "Stock"
+STOCK_REQUESTER = "Make-to-stock"
+
+HISTORY_WEEKS = 26
+WINDOW_WEEKS = 8
+HALFLIFE_WEEKS = 3
+MIN_TRAYS = 6
+MAX_SETS = 20
+SERVICE_Z = 1.28  # about 90% of weeks covered
+COVER_WEEKS = 1
+CAPACITY_QUANTILE = 0.9
+
+StockPlan = namedtuple("StockPlan", ["plan", "capacity", "committed", "idle", "weeks"])
+
+PLAN_COLUMNS = ["Experiments", "Names", "Orders", "Mean/Week", "Std/Week", "Forecast/Week",
+                "Target", "On Hand", "Shortfall", "Pre-build"]
+
+
+def _week(dates):
+    """Monday of each date's week."""
+    return dates.dt.to_period("W-SUN").dt.start_time
+
+
+def load_frames(conn):
+    orders = load_table(conn, "work_orders", ["id", "customer", "requester", "date", "lifecycle_state"])
+    orders["date"] = pd.to_datetime(orders["date"], errors="coerce")
+    trays = load_table(conn, "trays", ["id", "wo_id", "experiments"])
+    production = load_table(conn, "production", ["id", "end_date", "status"])
+    production = production[production["status"] == "Complete"]
+    production = production.assign(end_date=pd.to_datetime(production["end_date"], errors="coerce"))
+    return orders, trays, production
+
+
+def weekly_demand(orders, trays, today, weeks=HISTORY_WEEKS):
+    """Customer trays ordered per week and experiment set, over the last `weeks` complete weeks."""
+    current = _week(pd.Series([pd.Timestamp(today)])).iloc[0]
+    index = pd.date_range(end=current - pd.Timedelta(weeks=1), periods=weeks, freq="W-MON")
+
+    customer = orders[orders["customer"] != STOCK_CUSTOMER]
+    demand = trays.dropna(subset=["experiments"]).merge(
+        customer[["id", "date"]], left_on="wo_id", right_on="id", suffixes=("", "_wo"))
+    demand = demand.assign(week=_week(demand["date"]))
+    demand = demand[demand["week"].isin(index)]
+    if demand.empty:
+        return pd.DataFrame(index=index, dtype="int64")
+    matrix = pd.crosstab(demand["week"], demand["experiments"].astype(str))
+    matrix = matrix.reindex(index, fill_value=0)
+    matrix.index.name = "week"
+    return matrix
+
+
+def forecast(matrix, window=WINDOW_WEEKS, halflife=HALFLIFE_WEEKS, z=SERVICE_Z, cover=COVER_WEEKS):
+    """Per-set rolling statistics, next-week forecast and stock target (one row per set)."""
+    rolling = matrix.rolling(window, min_periods=1)
+    stats = pd.DataFrame({
+        "orders": matrix.sum(),
+        "mean": rolling.mean().iloc[-1],
+        "std": rolling.std().iloc[-1].fillna(0.0),
+        "forecast": matrix.ewm(halflife=halflife).mean().iloc[-1],
+    })
+    stats["target"] = np.ceil(stats["forecast"] * cover + z * stats["std"]).astype("int64")
+    return stats
+
+
+def on_hand(orders, trays):
+    """Unshipped pre-builds per experiment set (produced or still in progress)."""
+    stock = orders[(orders["customer"] == STOCK_CUSTOMER) & (orders["lifecycle_state"] != wo_lifecycle.SHIPPED)]
+    # Pre-builds record their set in the requester, so ones not yet configured still count
+    requested = stock["requester"].str.removeprefix(f"{STOCK_REQUESTER} ").str.strip()
+    configured = trays.dropna(subset=["experiments"]).drop_duplicates("wo_id").set_index("wo_id")["experiments"]
+    return stock["id"].map(configured).fillna(requested).value_counts()
+
+
+def line_capacity(production, today, weeks=HISTORY_WEEKS, quantile=CAPACITY_QUANTILE):
+    """Trays the line can complete per week, from recent weekly completions."""
+    current = _week(pd.Series([pd.Timestamp(today)])).iloc[0]
+    index = pd.date_range(end=current - pd.Timedelta(weeks=1), periods=weeks, freq="W-MON")
+    weekly = _week(production["end_date"].dropna()).value_counts().reindex(index, fill_value=0)
+    return int(math.floor(weekly.quantile(quantile))) if len(weekly) else 0
+
+
+def committed_load(orders):
+    """Open orders (customer orders and pre-builds already queued) that still need a tray built."""
+    open_states = {wo_lifecycle.CREATED, wo_lifecycle.CONFIGURED}
+    return int(orders["lifecycle_state"].isin(open_states).sum())
+
+
+def allocate(shortfall, idle):
+    """Fills `idle` slots with the shortfalls in order; returns the pre-build per set."""
+    shortfall = shortfall.clip(lower=0)
+    cumulative = shortfall.cumsum()
+    return (np.minimum(cumulative, idle) - np.minimum(cumulative - shortfall, idle)).astype("int64")
+
+
+def _names(key, experiment_data):
+    return ", ".join(experiment_data.get(int(exp), {}).get("name", exp) for exp in key.split(","))
+
+
+def _plan(conn, today, capacity=None, experiment_data=None):
+    experiment_data = EXPERIMENT_DATA if experiment_data is None else experiment_data
+    orders, trays, production = load_frames(conn)
+    matrix = weekly_demand(orders, trays, today)
+
+    capacity = line_capacity(production, today) if capacity is None else capacity
+    committed = committed_load(orders)
+    idle = max(capacity - committed, 0)
+
+    popular = matrix.sum()
+    popular = popular[popular >= MIN_TRAYS].sort_values(ascending=False).head(MAX_SETS)
+    if popular.empty:
+        return StockPlan(pd.DataFrame(columns=PLAN_COLUMNS), capacity, committed, idle, len(matrix))
+
+    stats = forecast(matrix[popular.index])
+    stats["on_hand"] = on_hand(orders, trays).reindex(stats.index, fill_value=0).astype("int64")
+    stats["shortfall"] = (stats["target"] - stats["on_hand"]).clip(lower=0)
+    stats = stats.sort_values(["forecast", "orders"], ascending=False)
+    stats["prebuild"] = allocate(stats["shortfall"], idle)
+
+    plan = pd.DataFrame({
+        "Experiments": stats.index,
+        "Names": [_names(key, experiment_data) for key in stats.index],
+        "Orders": stats["orders"].to_numpy(),
+        "Mean/Week": stats["mean"].round(2).to_numpy(),
+        "Std/Week": stats["std"].round(2).to_numpy(),
+        "Forecast/Week": stats["forecast"].round(2).to_numpy(),
+        "Target": stats["target"].to_numpy(),
+        "On Hand": stats["on_hand"].to_numpy(),
+        "Shortfall": stats["shortfall"].to_numpy(),
+        "Pre-build": stats["prebuild"].to_numpy(),
+    })
+    return StockPlan(plan, capacity, committed, idle, len(matrix))
+
+
+def plan_stock(conn, today=None, capacity=None):
+    """The make-to-stock plan, computed at most once per data version and day."""
+    from production_analytics import data_version
+
+    today = today or datetime.now().strftime("%Y-%m-%d")
+    if capacity is not None:
+        return _plan(conn, today, capacity)
+    key = f"{data_version(conn)}:{today}"
+    return shared_cache.get_or_compute(MAKE_TO_STOCK, key, lambda: _plan(conn, today), ttl=3600)
+
+
+def create_prebuilds(conn, plan, job_queue=None, today=None):
+    """Creates one stock work order per proposed tray and queues their configuration."""
+    from wo_import import import_work_orders
+
+    rows = plan.loc[plan["Pre-build"] > 0, ["Experiments", "Pre-build"]]
+    if rows.empty:
+        return None
+    today = today or datetime.now().strftime("%Y-%m-%d")
+    keys = rows["Experiments"].repeat(rows["Pre-build"]).reset_index(drop=True)
+    frame = pd.DataFrame({
+        "customer": STOCK_CUSTOMER,
+        "requester": STOCK_REQUESTER + " " + keys,
+        "date": today,
+        "experiments": keys.str.replace(",", ";"),
+    })
+    return import_work_orders(conn, frame, optimize=job_queue is not None, job_queue=job_queue)
@@ -0,0 +1,224 @@
+"""Cold archive of shipped work orders in month-partitioned Parquet files.
+
+    python order_archive.py --older-than 90
+
+moves every work order shipped more than N days ago, together with its
+trays, production, shipping and inventory rows, out of reagent_lims.db into
+
+    archive/<table>/month=YYYY-MM/part-<stamp>.parquet
+
+Readers call load_table(), which unions the live SQLite rows with the
+archive (read through memory-mapped Arrow), so reports and analytics see
+the full history while the operational database stays small. The default
+age is longer than the dashboard's 30-day window (and shorter ages are
+refused), so the dashboard's live queries are unaffected.
+
+The command also does the periodic housekeeping: it prunes the change log
+and the shared cache and purges old finished jobs and stale operator drafts.
+
+pyarrow is optional and imported on first use: without it load_table()
+returns the live rows only and archiving is refused.
+"""
+import argparse
+import os
+import shutil
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+ARCHIVE_DIR = "archive"
+
+# The dashboard queries only the live tables over this many days
+DASHBOARD_WINDOW_DAYS = 30
+
+# Primary key and columns of each archived table, in SQLite column order
+TABLES = {
+    "work_orders": ("id", ["id", "customer", "requester", "date", "status", "lifecycle_state", "state_changed"]),
+    "trays": ("id", ["id", "wo_id", "customer", "requester", "date", "configuration", "experiments"]),
+    "production": ("id", ["id", "tray_id", "wo_id", "start_date", "end_date", "status"]),
+    "shipping": ("id", ["id", "tray_id", "wo_id", "customer", "requester", "tracking_number", "ship_date"]),
+    "inventory": ("id", ["id", "wo_id", "reagent", "batch", "quantity", "date", "status"]),
+}
+
+INTEGER_COLUMNS = {"trays.id", "production.id", "production.tray_id", "shipping.id", "shipping.tray_id",
+                   "inventory.id", "inventory.quantity"}
+
+
+def _arrow():
+    """(pyarrow, pyarrow.parquet), or (None, None) if pyarrow is not installed."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        return None, None
+    return pa, pq
+
+
+def available():
+    return _arrow()[0] is not None
+
+
+def _schema(table):
+    # Explicit types, so a partition whose column is all NULL still matches the others
+    pa, _ = _arrow()
+    _, columns = TABLES[table]
+    return pa.schema([
+        (col, pa.int64() if f"{table}.{col}" in INTEGER_COLUMNS else pa.string())
+        for col in columns
+    ])
+
+
+def _table_dir(table, archive_dir):
+    return os.path.join(archive_dir, table)
+
+
+def archive_shipped(conn, older_than_days=90, archive_dir=ARCHIVE_DIR):
+    """Moves work orders shipped before the cutoff into the archive; returns rows moved per table."""
+    from lims_db import ARCHIVED_ID_TABLES, reserve_ids
+
+    pa, pq = _arrow()
+    if pa is None:
+        raise RuntimeError("pyarrow is required to archive work orders")
+    if older_than_days <= DASHBOARD_WINDOW_DAYS:
+        raise ValueError(f"Only orders shipped more than {DASHBOARD_WINDOW_DAYS} days ago can be archived")
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).strftime('%Y-%m-%d')
+
+    shipped = pd.read_sql_query("""
+        SELECT wo_id, substr(MAX(ship_date), 1, 7) AS month
+        FROM shipping GROUP BY wo_id HAVING MAX(ship_date) < ?
+    """, conn, params=(cutoff,))
+    if shipped.empty:
+        return {}
+    month_of = shipped.set_index("wo_id")["month"]
+
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (wo_id TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM archive_batch")
+    conn.executemany("INSERT INTO archive_batch VALUES (?)", ((wo,) for wo in shipped["wo_id"]))
+    # The inserts opened an implicit transaction; end it so BEGIN IMMEDIATE below can start
+    conn.commit()
+
+    stamp = time.strftime("%Y%m%d%H%M%S")
+    written = []
+    moved = {}
+    try:
+        for table, (_, columns) in TABLES.items():
+            key = "id" if table == "work_orders" else "wo_id"
+            frame = pd.read_sql_query(
+                f"SELECT {', '.join(columns)} FROM {table} WHERE {key} IN (SELECT wo_id FROM archive_batch)",
+                conn,
+            )
+            moved[table] = len(frame)
+            if frame.empty:
+                continue
+            months = frame[key].map(month_of)
+            for month, part in frame.groupby(months):
+                part_dir = os.path.join(_table_dir(table, archive_dir), f"month={month}")
+                os.makedirs(part_dir, exist_ok=True)
+                path = os.path.join(part_dir, f"part-{stamp}.parquet")
+                arrow_table = pa.Table.from_pandas(part, schema=_schema(table), preserve_index=False)
+                pq.write_table(arrow_table, path + ".tmp", compression="zstd")
+                os.replace(path + ".tmp", path)
+                written.append(path)
+
+        # Rows leave SQLite only once every file is safely on disk
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        for table in TABLES:
+            key = "id" if table == "work_orders" else "wo_id"
+            if table in ARCHIVED_ID_TABLES:
+                # Archived ids stay taken even if the table has no AUTOINCREMENT yet
+                c.execute(f"SELECT MAX(id) FROM {table} WHERE wo_id IN (SELECT wo_id FROM archive_batch)")
+                reserve_ids(c, table, c.fetchone()[0])
+            c.execute(f"DELETE FROM {table} WHERE {key} IN (SELECT wo_id FROM archive_batch)")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        for path in written:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    return moved
+
+
+def read_archive(table, columns=None, archive_dir=ARCHIVE_DIR):
+    """Archived rows of `table` as a frame (empty if nothing is archived or pyarrow is missing)."""
+    _, all_columns = TABLES[table]
+    columns = columns or all_columns
+    path = _table_dir(table, archive_dir)
+    if not os.path.isdir(path) or not available():
+        return pd.DataFrame(columns=columns)
+    _, pq = _arrow()
+    arrow_table = pq.read_table(path, columns=columns, memory_map=True, partitioning="hive",
+                                schema=_schema(table))
+    return arrow_table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def archived_max_id(table, archive_dir=ARCHIVE_DIR):
+    """Highest archived id of `table` (0 if none), so live ids can be kept above it."""
+    frame = read_archive(table, ["id"], archive_dir)
+    return int(frame["id"].max()) if len(frame) else 0
+
+
+def load_table(conn, table, columns=None, archive_dir=ARCHIVE_DIR):
+    """Live rows of `table` plus its archived rows.
+
+    Ids are never reused (lims_db.migrate_autoincrement), so a key found in
+    both places means a crash left the same row behind in SQLite after it
+    was archived; it is kept once, from the live copy. The work order
+    column is part of the match, so rows that only share an id are kept.
+    """
+    key, all_columns = TABLES[table]
+    columns = columns or all_columns
+    hot = pd.read_sql_query(f"SELECT {', '.join(columns)} FROM {table}", conn)
+    cold = read_archive(table, columns, archive_dir)
+    if cold.empty:
+        return hot
+    if hot.empty:
+        return cold
+    frame = pd.concat([hot, cold], ignore_index=True)
+    if key in columns:
+        subset = [key, "wo_id"] if "wo_id" in columns and key != "wo_id" else [key]
+        frame = frame.drop_duplicates(subset=subset, keep="first")
+    return frame
+
+
+def drop_archive(archive_dir=ARCHIVE_DIR):
+    shutil.rmtree(archive_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive shipped work orders to Parquet.")
+    parser.add_argument("--older-than", type=int, default=90, help="Archive orders shipped more than N days ago")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    args = parser.parse_args()
+
+    import change_feed
+    import shared_cache
+    from job_queue import purge_jobs
+    from lims_db import create_connection, ensure_database
+    from session_store import purge_sessions
+    ensure_database()
+    conn = create_connection()
+    try:
+        moved = archive_shipped(conn, args.older_than, args.archive_dir)
+        pruned = change_feed.prune(conn)
+    finally:
+        conn.close()
+    jobs = purge_jobs()
+    sessions = purge_sessions()
+    shared_cache.get_cache().prune()
+    if not moved:
+        print("Nothing to archive")
+    for table, count in moved.items():
+        print(f"{table}: {count} rows archived")
+    if pruned:
+        print(f"change_log: {pruned} old changes pruned")
+    if jobs:
+        print(f"jobs: {jobs} finished jobs purged")
+    if sessions:
+        print(f"operator_sessions: {sessions} stale drafts purged")
+
+
+if __name__ == "__main__":
+    main()
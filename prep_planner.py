@@ -0,0 +1,195 @@
+"""Daily reagent preparation plan for the trays waiting for production.
+
+Every configured tray that has not been produced yet (the Production tab's
+pending list) needs each of its locations filled to capacity. The planner
+totals the fill volume per reagent code and location class, rounds it up to
+whole stock bottles and renders a prep sheet.
+
+PrepPlanner keeps each pending tray's contribution and refreshes
+incrementally from the change feed (change_feed): only the work orders
+that changed since the last refresh are re-read, and their trays'
+contributions are subtracted from or added to the running totals. The
+queue is recomputed as a whole only on the first refresh, or if the feed
+was pruned past the planner's position.
+"""
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+import change_feed
+import wo_lifecycle
+from lims_db import load_tray_configuration
+
+# Stock bottle sizes in mL; totals are rounded up to whole bottles
+BOTTLE_SIZES_ML = (250, 500, 1000)
+
+LARGE = "Large (270 mL)"
+SMALL = "Small (140 mL)"
+
+GROUP = ["reagent_code", "location_class"]
+PLAN_COLUMNS = ["Reagent", "Location Class", "Positions", "Trays", "Fill Volume (mL)", "Prepare (mL)", "Bottles"]
+
+
+def _placements(tray_id, configuration):
+    """One row per filled location of a tray."""
+    config = load_tray_configuration(configuration)
+    rows = []
+    for loc, placement in enumerate(config["tray_locations"] if config else []):
+        if placement:
+            rows.append((tray_id, placement["reagent_code"], loc, placement["capacity"]))
+    return rows
+
+
+def _contributions(rows):
+    """Per tray, per (reagent, location class): positions and fill volume."""
+    frame = pd.DataFrame(rows, columns=["tray_id", "reagent_code", "location", "capacity"])
+    frame["location_class"] = frame["location"].lt(4).map({True: LARGE, False: SMALL})
+    return frame.groupby(["tray_id"] + GROUP).agg(positions=("location", "size"), volume=("capacity", "sum"))
+
+
+def round_to_bottles(volumes, sizes=BOTTLE_SIZES_ML):
+    """Rounds volumes (mL) up to whole stock bottles; returns (prepare mL, bottle description)."""
+    sizes = sorted(sizes)
+    largest = sizes[-1]
+    volumes = pd.Series(volumes, dtype="int64")
+    full = volumes // largest
+    remainder = volumes - full * largest
+    # Smallest bottle that covers the remainder; a remainder above every size takes another large one
+    top_up = pd.Series(0, index=volumes.index, dtype="int64")
+    for size in reversed(sizes):
+        top_up = top_up.where(remainder > size, size).where(remainder > 0, 0)
+    prepare = full * largest + top_up
+
+    def describe(count, extra):
+        parts = [f"{count} x {largest} mL"] if count else []
+        if extra == largest:
+            parts = [f"{count + 1} x {largest} mL"]
+        elif extra:
+            parts.append(f"1 x {extra} mL")
+        return " + ".join(parts) or "-"
+
+    return prepare, [describe(count, extra) for count, extra in zip(full, top_up)]
+
+
+class PrepPlanner:
+    """Running reagent totals over the pending production queue."""
+
+    def __init__(self):
+        self._per_tray = {}
+        self._wo_of = {}
+        self._trays_of = {}
+        self._totals = None
+        self._feed = change_feed.Consumer("prep_planner", durable=False, tables=("work_orders", "trays"))
+        self._lock = threading.Lock()
+
+    def _apply(self, contributions, sign):
+        """Adds (sign=1) or subtracts (sign=-1) per-tray contributions, all in one frame operation."""
+        if not contributions:
+            return
+        frame = pd.concat(contributions)
+        by_group = frame.groupby(level=GROUP)
+        grouped = by_group.sum().assign(trays=by_group.size()) * sign
+        self._totals = grouped if self._totals is None else self._totals.add(grouped, fill_value=0)
+
+    def _drop(self, tray_ids):
+        removed = []
+        for tray_id in tray_ids:
+            removed.append(self._per_tray.pop(tray_id))
+            wo_id = self._wo_of.pop(tray_id)
+            self._trays_of[wo_id].discard(tray_id)
+            if not self._trays_of[wo_id]:
+                del self._trays_of[wo_id]
+        self._apply(removed, -1)
+
+    def _load(self, c, wo_ids=None):
+        """Adds the pending trays (of `wo_ids`, or all); returns how many were read."""
+        sql = """SELECT t.id, t.wo_id, t.configuration FROM trays t JOIN work_orders wo ON wo.id = t.wo_id
+                 WHERE wo.lifecycle_state = ?"""
+        if wo_ids is None:
+            batches = [()]
+        else:
+            wo_ids = list(wo_ids)
+            batches = [wo_ids[start:start + 500] for start in range(0, len(wo_ids), 500)]
+        rows, wo_of = [], {}
+        for batch in batches:
+            params = [wo_lifecycle.CONFIGURED]
+            batch_sql = sql
+            if wo_ids is not None:
+                batch_sql += f" AND t.wo_id IN ({','.join('?' * len(batch))})"
+                params.extend(batch)
+            c.execute(batch_sql, params)
+            for tray_id, wo_id, configuration in c.fetchall():
+                wo_of[tray_id] = wo_id
+                rows.extend(_placements(tray_id, configuration))
+        if rows:
+            loaded = _contributions(rows)
+            for tray_id, contribution in loaded.groupby(level="tray_id"):
+                self._per_tray[tray_id] = contribution.droplevel("tray_id")
+                self._wo_of[tray_id] = wo_of[tray_id]
+                self._trays_of.setdefault(wo_of[tray_id], set()).add(tray_id)
+            self._apply([loaded.droplevel("tray_id")], 1)
+        return len(wo_of)
+
+    def _rebuild(self, conn):
+        self._per_tray, self._wo_of, self._trays_of, self._totals = {}, {}, {}, None
+        # Take the feed position first; changes racing the load are replayed next time
+        offset = change_feed.head(conn)
+        count = self._load(conn.cursor())
+        self._feed.reset(conn, offset)
+        return count
+
+    def refresh(self, conn):
+        """Brings the totals up to date with the database; returns the number of trays re-read."""
+        with self._lock:
+            if self._feed.offset is None:
+                count = self._rebuild(conn)
+            else:
+                count = 0
+                try:
+                    for batch in self._feed.batches(conn):
+                        wo_ids = {change.wo_id for change in batch}
+                        stale = {change.row_id for change in batch
+                                 if change.table == "trays" and change.row_id in self._per_tray}
+                        for wo_id in wo_ids:
+                            stale.update(self._trays_of.get(wo_id, ()))
+                        self._drop(stale)
+                        count += self._load(conn.cursor(), wo_ids)
+                except change_feed.ChangeFeedGap:
+                    count = self._rebuild(conn)
+
+            if self._totals is not None:
+                self._totals = self._totals[self._totals["positions"] > 0]
+            return count
+
+    @property
+    def tray_ids(self):
+        return sorted(self._per_tray)
+
+    def plan(self):
+        """Prep plan as a frame, one row per reagent and location class."""
+        with self._lock:
+            totals = self._totals.copy() if self._totals is not None else None
+        if totals is None or totals.empty:
+            return pd.DataFrame(columns=PLAN_COLUMNS)
+        totals = totals.astype("int64").sort_index().reset_index()
+        prepare, bottles = round_to_bottles(totals["volume"])
+        return pd.DataFrame({
+            "Reagent": totals["reagent_code"],
+            "Location Class": totals["location_class"],
+            "Positions": totals["positions"],
+            "Trays": totals["trays"],
+            "Fill Volume (mL)": totals["volume"],
+            "Prepare (mL)": prepare.to_numpy(),
+            "Bottles": bottles,
+        })
+
+
+def prep_sheet(plan, tray_ids, date=None):
+    """The plan as an .xlsx prep sheet, with a sign-off column and the trays it covers."""
+    from reports import to_xlsx
+
+    date = date or datetime.now().strftime("%Y-%m-%d")
+    sheet = plan.assign(**{"Prepared By": "", "Lot": ""})
+    trays = pd.DataFrame({"Tray ID": tray_ids})
+    return to_xlsx({f"Prep {date}": sheet, "Trays": trays})
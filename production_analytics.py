@@ -0,0 +1,315 @@
+"""Vectorized production analytics over work orders, trays, production and shipping.
+
+The four tables (live rows plus the Parquet archive) are loaded once into
+columnar frames (categorical dtypes for repeated strings, datetime64 for
+dates) and every metric is computed with groupby/vectorized operations:
+
+    cycle_times         created -> configured -> produced -> shipped, per work order
+    weekly_throughput   orders created / configured / produced / shipped per week
+    wip_aging           open work orders by lifecycle state and age bucket
+    experiment_demand   trays and work orders per experiment
+
+AnalyticsTracker keeps the per-order cycle frame, the tray sets and the
+weekly counts in memory and follows the change feed (change_feed): only
+the work orders that changed are re-read, their old rows are subtracted
+from the weekly counts and replaced. The full history is loaded only on
+the first refresh, after the feed was pruned past the tracker's position,
+or when work orders were deleted (archived). compute_analytics() returns
+the same result until the feed head or the day changes, so bottle scans
+and checklist ticks, which only touch the event log, cost nothing.
+"""
+import threading
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+import change_feed
+import lims_db
+from order_archive import load_table
+from reagent_optimizer import EXPERIMENT_DATA
+
+AGE_BUCKETS = [0, 2, 7, 14, 30, np.inf]
+AGE_LABELS = ["0-2 days", "3-7 days", "8-14 days", "15-30 days", "30+ days"]
+STAGES = {"Created": "created", "Configured": "configured", "Produced": "produced", "Shipped": "shipped"}
+
+Analytics = namedtuple("Analytics", ["cycle_times", "cycle_summary", "weekly_throughput",
+                                     "wip_aging", "experiment_demand"])
+
+
+def data_version(conn):
+    """Changes whenever a lifecycle table changes (the change feed head)."""
+    return change_feed.head(conn)
+
+
+def _read(conn, table, columns, wo_ids):
+    """Rows of `table`: live and archived, or only the live rows of `wo_ids`."""
+    if wo_ids is None:
+        return load_table(conn, table, columns)
+    key = "id" if table == "work_orders" else "wo_id"
+    wo_ids = list(wo_ids)
+    frames = []
+    for start in range(0, len(wo_ids), 500):
+        batch = wo_ids[start:start + 500]
+        marks = ','.join('?' * len(batch))
+        frames.append(pd.read_sql_query(
+            f"SELECT {', '.join(columns)} FROM {table} WHERE {key} IN ({marks})", conn, params=batch))
+        if table == "production":
+            # Older production rows were written without wo_id; find them through their tray
+            frames.append(pd.read_sql_query(
+                f"""SELECT {', '.join(columns)} FROM production WHERE wo_id IS NULL
+                    AND tray_id IN (SELECT id FROM trays WHERE wo_id IN ({marks}))""", conn, params=batch))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+
+def load_frames(conn, wo_ids=None):
+    """Reads the lifecycle tables, live and archived, into compact frames.
+
+    With `wo_ids`, reads only the live rows of those work orders.
+    """
+    orders = _read(conn, "work_orders", ["id", "customer", "date", "lifecycle_state"], wo_ids)
+    orders = orders.astype({"customer": "category", "lifecycle_state": "category"})
+    orders["date"] = pd.to_datetime(orders["date"], errors="coerce")
+
+    trays = _read(conn, "trays", ["id", "wo_id", "date", "experiments"], wo_ids)
+    trays = trays.astype({"experiments": "category"})
+    trays["date"] = pd.to_datetime(trays["date"], errors="coerce")
+
+    production = _read(conn, "production", ["id", "tray_id", "wo_id", "end_date", "status"], wo_ids)
+    production = production[production["status"] == "Complete"].drop(columns="id")
+    production = production.astype({"status": "category"}).reset_index(drop=True)
+    production["end_date"] = pd.to_datetime(production["end_date"], errors="coerce")
+    # Older production rows were written without wo_id; recover it from the tray
+    tray_wo = trays.drop_duplicates("id").set_index("id")["wo_id"]
+    production["wo_id"] = production["wo_id"].fillna(production["tray_id"].map(tray_wo))
+
+    shipping = _read(conn, "shipping", ["id", "wo_id", "ship_date"], wo_ids).drop(columns="id")
+    shipping["ship_date"] = pd.to_datetime(shipping["ship_date"], errors="coerce")
+    return orders, trays, production, shipping
+
+
+def cycle_times(orders, trays, production, shipping):
+    """One row per work order with stage timestamps and stage durations in days."""
+    frame = orders.set_index("id")[["customer", "lifecycle_state", "date"]].rename(columns={"date": "created"})
+    frame["configured"] = trays.groupby("wo_id")["date"].min()
+    frame["produced"] = production.groupby("wo_id")["end_date"].min()
+    frame["shipped"] = shipping.groupby("wo_id")["ship_date"].min()
+
+    frame["days_to_configure"] = (frame["configured"] - frame["created"]).dt.days
+    frame["days_to_produce"] = (frame["produced"] - frame["configured"]).dt.days
+    frame["days_to_ship"] = (frame["shipped"] - frame["produced"]).dt.days
+    frame["days_total"] = (frame["shipped"] - frame["created"]).dt.days
+    return frame
+
+
+def cycle_summary(cycles):
+    stages = ["days_to_configure", "days_to_produce", "days_to_ship", "days_total"]
+    rows = {}
+    for stage in stages:
+        values = cycles[stage].to_numpy(dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values):
+            median, p90 = np.percentile(values, [50, 90])
+            rows[stage] = [float(len(values)), values.mean(), median, p90, values.max()]
+        else:
+            rows[stage] = [0.0, np.nan, np.nan, np.nan, np.nan]
+    return pd.DataFrame.from_dict(rows, orient="index", columns=["Orders", "Mean", "Median", "P90", "Max"])
+
+
+def _week_start(dates):
+    return (dates - pd.to_timedelta(dates.dt.dayofweek, unit="D")).dt.normalize()
+
+
+def weekly_counts(cycles):
+    """Work orders per week (rows) and stage (columns), as floats so counts can be added and subtracted."""
+    return pd.DataFrame({
+        label: _week_start(cycles[column].dropna()).value_counts()
+        for label, column in STAGES.items()
+    }, columns=list(STAGES)).fillna(0.0)
+
+
+def _weekly_frame(counts):
+    frame = counts[counts.ne(0).any(axis=1)].astype(int).sort_index()
+    frame.index.name = "Week"
+    return frame
+
+
+def weekly_throughput(cycles):
+    return _weekly_frame(weekly_counts(cycles))
+
+
+def wip_aging(cycles, today=None):
+    """Open (unshipped) work orders by state and age since creation."""
+    today = pd.Timestamp(today) if today is not None else pd.Timestamp.now().normalize()
+    open_orders = cycles[cycles["shipped"].isna().to_numpy()]
+    age = (today - open_orders["created"]).dt.days
+    bucket = pd.cut(age, bins=AGE_BUCKETS, labels=AGE_LABELS, right=True, include_lowest=True)
+    return pd.crosstab(open_orders["lifecycle_state"], bucket).reindex(columns=AGE_LABELS, fill_value=0)
+
+
+def set_demand(trays):
+    """Trays and distinct work orders per experiment set.
+
+    Adding the result for disjoint groups of work orders gives the result
+    for their union, so it can be kept up to date incrementally.
+    """
+    return trays.groupby("experiments", observed=True).agg(trays=("id", "size"), orders=("wo_id", "nunique"))
+
+
+def experiment_demand(trays, experiment_data=None):
+    """Trays and work orders per experiment.
+
+    Counts each distinct experiment set once and spreads it over its
+    experiments, so the work is proportional to the number of distinct
+    sets rather than the number of trays.
+    """
+    return _experiment_demand(set_demand(trays), experiment_data)
+
+
+def _experiment_demand(per_set, experiment_data=None):
+    if experiment_data is None:
+        experiment_data = EXPERIMENT_DATA
+    per_set = per_set[per_set["trays"] > 0]
+    if per_set.empty:
+        return pd.DataFrame(columns=["Experiment", "Name", "Trays", "Work Orders"])
+    exploded = per_set.assign(experiment=list(per_set.index.astype(str).str.split(","))).explode("experiment")
+    exploded["experiment"] = exploded["experiment"].astype(int)
+    demand = exploded.groupby("experiment")[["trays", "orders"]].sum().sort_values("trays", ascending=False)
+    names = pd.Series({exp: data["name"] for exp, data in experiment_data.items()})
+    return pd.DataFrame({
+        "Experiment": demand.index,
+        "Name": demand.index.map(names),
+        "Trays": demand["trays"].to_numpy(),
+        "Work Orders": demand["orders"].to_numpy(),
+    })
+
+
+def _compute(conn):
+    orders, trays, production, shipping = load_frames(conn)
+    cycles = cycle_times(orders, trays, production, shipping)
+    return Analytics(
+        cycle_times=cycles,
+        cycle_summary=cycle_summary(cycles),
+        weekly_throughput=weekly_throughput(cycles),
+        wip_aging=wip_aging(cycles),
+        experiment_demand=experiment_demand(trays),
+    )
+
+
+class AnalyticsTracker:
+    """Analytics state kept up to date incrementally from the change feed."""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or lims_db.DB_PATH
+        self._cycles = None
+        self._trays = None
+        self._weekly = None
+        self._sets = None
+        self._result = None
+        self._result_key = None
+        self._feed = change_feed.Consumer("production_analytics", durable=False,
+                                          tables=("work_orders", "trays", "production", "shipping"))
+        self._lock = threading.Lock()
+
+    def _rebuild(self, conn):
+        # Take the feed position first; changes racing the load are replayed next time
+        offset = change_feed.head(conn)
+        orders, trays, production, shipping = load_frames(conn)
+        self._cycles = cycle_times(orders, trays, production, shipping)
+        self._trays = trays[["id", "wo_id", "experiments"]]
+        self._weekly = weekly_counts(self._cycles)
+        self._sets = set_demand(self._trays)
+        self._feed.reset(conn, offset)
+        return len(self._cycles)
+
+    def _update(self, conn, wo_ids):
+        """Replaces the rows of `wo_ids` with their current state; returns how many were read."""
+        wo_ids = list(wo_ids)
+        orders, trays, production, shipping = load_frames(conn, wo_ids)
+        fresh = cycle_times(orders, trays, production, shipping)
+        positions = self._cycles.index.get_indexer(fresh.index)
+        existing = positions >= 0
+
+        # Subtract the old rows' share of the running counts, then add the new rows'
+        self._weekly = (self._weekly.sub(weekly_counts(self._cycles.iloc[positions[existing]]), fill_value=0)
+                        .add(weekly_counts(fresh), fill_value=0))
+
+        # Rows are overwritten in place and new orders appended, so an update
+        # does not copy the whole frame
+        for column in ("customer", "lifecycle_state"):
+            known = self._cycles[column].cat.categories
+            added = pd.Index(fresh[column].dropna().unique()).difference(known)
+            if len(added):
+                self._cycles[column] = self._cycles[column].cat.add_categories(added)
+            fresh[column] = fresh[column].astype(self._cycles[column].dtype)
+        if existing.any():
+            rows = positions[existing]
+            for i, column in enumerate(self._cycles.columns):
+                self._cycles.iloc[rows, i] = fresh[column].to_numpy()[existing]
+        if not existing.all():
+            self._cycles = pd.concat([self._cycles, fresh[~existing]])
+
+        trays = trays[["id", "wo_id", "experiments"]]
+        stale = self._trays["wo_id"].isin(wo_ids).to_numpy()
+        old = self._trays[stale]
+        if sorted(zip(old["id"], old["experiments"].astype(str))) != \
+                sorted(zip(trays["id"], trays["experiments"].astype(str))):
+            self._sets = (self._sets.sub(set_demand(old), fill_value=0)
+                          .add(set_demand(trays), fill_value=0).astype("int64"))
+            self._trays = pd.concat([self._trays[~stale], trays], ignore_index=True)
+        return len(fresh)
+
+    def refresh(self, conn):
+        """Brings the state up to date with the database; returns the number of orders re-read."""
+        with self._lock:
+            if self._feed.offset is None:
+                return self._rebuild(conn)
+            count = 0
+            try:
+                for batch in self._feed.batches(conn):
+                    if any(change.table == "work_orders" and change.op == "DELETE" for change in batch):
+                        # Archived (or deleted) orders: their history now lives in the archive
+                        return self._rebuild(conn)
+                    wo_ids = {change.wo_id for change in batch if change.wo_id is not None}
+                    if wo_ids:
+                        count += self._update(conn, wo_ids)
+            except change_feed.ChangeFeedGap:
+                return self._rebuild(conn)
+            return count
+
+    def analytics(self, today=None):
+        """All analytics for the current state; recomputed only after changes or on a new day."""
+        today = pd.Timestamp(today) if today is not None else pd.Timestamp.now().normalize()
+        with self._lock:
+            key = (self._feed.offset, today)
+            if self._result_key != key:
+                cycles = self._cycles
+                self._result = Analytics(
+                    cycle_times=cycles,
+                    cycle_summary=cycle_summary(cycles),
+                    weekly_throughput=_weekly_frame(self._weekly),
+                    wip_aging=wip_aging(cycles, today),
+                    experiment_demand=_experiment_demand(self._sets),
+                )
+                self._result_key = key
+            return self._result
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_tracker():
+    """The process-wide AnalyticsTracker for the configured database."""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None or _tracker.db_path != lims_db.DB_PATH:
+            _tracker = AnalyticsTracker()
+        return _tracker
+
+
+def compute_analytics(conn):
+    """All analytics, brought up to date with the changes since the last call."""
+    tracker = get_tracker()
+    tracker.refresh(conn)
+    return tracker.analytics()
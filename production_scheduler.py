@@ -0,0 +1,160 @@
+"""Sequencing of the pending production queue to reduce reagent changeovers.
+
+Each pending tray is reduced to the set of reagent codes it carries, stored
+as an integer bitset. The distance between two trays is the Jaccard
+distance of those sets, and the queue is ordered like a travelling-salesman
+tour over it:
+
+    1. greedy nearest neighbour: the next tray is the closest of the next
+       `window` trays by due date
+    2. 2-opt: segment reversals that shorten the tour, within the same
+       window, until no improvement is left or the time budget runs out
+
+Due dates are the work-order date plus `lead_days`. No tray is ever placed
+more than `window` positions after its due-date rank, so a tray cannot be
+pushed back indefinitely by trays that happen to share reagents.
+"""
+import functools
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from lims_db import load_tray_configuration
+from reagent_optimizer import EXPERIMENT_DATA
+
+DEFAULT_LEAD_DAYS = 5
+DEFAULT_WINDOW = 25
+TIME_BUDGET = 0.5
+
+PendingTray = namedtuple("PendingTray", ["tray_id", "wo_id", "customer", "date", "due", "codes"])
+Schedule = namedtuple("Schedule", ["trays", "changeovers_before", "changeovers_after", "seconds"])
+
+
+@functools.lru_cache(maxsize=None)
+def _codes_for_key(key):
+    return frozenset(
+        reagent["code"]
+        for exp in key.split(",") if exp
+        for reagent in EXPERIMENT_DATA.get(int(exp), {}).get("reagents", [])
+    )
+
+
+def load_pending(conn, lead_days=DEFAULT_LEAD_DAYS):
+    """Pending trays in date order, the same queue the Production tab shows."""
+    c = conn.cursor()
+    c.execute("""
+        SELECT t.id, wo.id, wo.customer, t.date, wo.date, t.experiments, t.configuration
+        FROM trays t
+        JOIN work_orders wo ON t.wo_id = wo.id
+        LEFT JOIN production p ON t.id = p.tray_id
+        WHERE p.status IS NULL OR p.status != 'Complete'
+        ORDER BY t.date ASC
+    """)
+    trays = []
+    for tray_id, wo_id, customer, date, wo_date, experiments, configuration in c.fetchall():
+        if experiments:
+            codes = _codes_for_key(experiments)
+        else:
+            config = load_tray_configuration(configuration)
+            codes = frozenset(loc["reagent_code"] for loc in config["tray_locations"] if loc) if config else frozenset()
+        try:
+            due = (datetime.strptime(wo_date or date, "%Y-%m-%d") + timedelta(days=lead_days)).date()
+        except (TypeError, ValueError):
+            due = datetime.max.date()
+        trays.append(PendingTray(tray_id, wo_id, customer, date, due, codes))
+    return trays
+
+
+def changeovers(a, b):
+    """Reagent codes that must be swapped going from bitset a to bitset b."""
+    return (a ^ b).bit_count()
+
+
+def tour_changeovers(bits, order):
+    return sum(changeovers(bits[order[k]], bits[order[k + 1]]) for k in range(len(order) - 1))
+
+
+class _Distances:
+    """Memoized Jaccard distances; identical reagent sets are common, so the memo stays small."""
+
+    def __init__(self, bits):
+        self.bits = bits
+        self._memo = {}
+
+    def __call__(self, i, j):
+        a, b = self.bits[i], self.bits[j]
+        key = (a, b) if a <= b else (b, a)
+        d = self._memo.get(key)
+        if d is None:
+            union = (a | b).bit_count()
+            d = self._memo[key] = 1.0 - (a & b).bit_count() / union if union else 0.0
+        return d
+
+
+def sequence(bits, due_rank, window=DEFAULT_WINDOW, time_budget=TIME_BUDGET):
+    """Orders trays (indices into `bits`) so consecutive trays share reagents.
+
+    `due_rank` gives each tray's position in due-date order; tray i is never
+    placed later than due_rank[i] + window.
+    """
+    n = len(bits)
+    if n < 3:
+        return sorted(range(n), key=due_rank.__getitem__)
+    deadline = time.perf_counter() + time_budget
+    dist = _Distances(bits)
+    latest = [rank + window for rank in due_rank]
+
+    # Nearest neighbour over the next `window` trays by due date
+    remaining = sorted(range(n), key=due_rank.__getitem__)
+    order = [remaining.pop(0)]
+    while remaining:
+        position = len(order)
+        if latest[remaining[0]] <= position:
+            best = 0
+        else:
+            last = order[-1]
+            best = min(range(min(window + 1, len(remaining))), key=lambda k: (dist(last, remaining[k]), k))
+        order.append(remaining.pop(best))
+
+    # 2-opt within the window, keeping every tray within its deadline
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in range(1, n - 1):
+            if time.perf_counter() >= deadline:
+                break
+            for j in range(i + 1, min(i + window, n - 1)):
+                a, b, c, d = order[i - 1], order[i], order[j], order[j + 1]
+                gain = dist(a, b) + dist(c, d) - dist(a, c) - dist(b, d)
+                if gain <= 1e-12:
+                    continue
+                if any(latest[order[p]] < i + j - p for p in range(i, j + 1)):
+                    continue
+                order[i:j + 1] = reversed(order[i:j + 1])
+                improved = True
+    return order
+
+
+def schedule(trays, window=DEFAULT_WINDOW, time_budget=TIME_BUDGET):
+    """Sequences PendingTray rows; returns them reordered with changeover counts before and after."""
+    started = time.perf_counter()
+    bit_of = {}
+    bits = []
+    for tray in trays:
+        value = 0
+        for code in tray.codes:
+            value |= 1 << bit_of.setdefault(code, len(bit_of))
+        bits.append(value)
+
+    by_due = sorted(range(len(trays)), key=lambda i: (trays[i].due, trays[i].date or "", trays[i].tray_id))
+    due_rank = [0] * len(trays)
+    for rank, i in enumerate(by_due):
+        due_rank[i] = rank
+
+    order = sequence(bits, due_rank, window, time_budget)
+    return Schedule(
+        trays=[trays[i] for i in order],
+        changeovers_before=tour_changeovers(bits, list(range(len(trays)))),
+        changeovers_after=tour_changeovers(bits, order),
+        seconds=round(time.perf_counter() - started, 3),
+    )
@@ -0,0 +1,180 @@
+"""Opt-in profiling of optimizer calls and page renders.
+
+Off unless enabled, either for the whole process
+
+    KLIMS_PROFILE=sample streamlit run app.py
+
+or for one browser session with a query parameter (?profile=sample). Jobs
+submitted to the job queue run with the mode of the thread that submitted
+them, so a session's optimizer runs on the queue's workers are covered too.
+
+Modes
+    sample    a background thread samples the profiled thread's stack every
+              few milliseconds and writes collapsed stacks (<name>.collapsed,
+              one "frame;frame;frame count" line per stack), the input format
+              of flamegraph.pl, speedscope and similar viewers
+    cprofile  deterministic cProfile run, written as <name>.prof (pstats)
+              and a <name>.txt summary of the top functions
+    full      both
+
+Output goes to KLIMS_PROFILE_DIR (default "profiles"); only the newest
+KLIMS_PROFILE_KEEP files (default 500) are kept. Nested profiled blocks in
+one thread are recorded by the outermost block only.
+"""
+import cProfile
+import functools
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+MODES = ("sample", "cprofile", "full")
+SAMPLE_INTERVAL = 0.005
+
+PROFILE_DIR = os.environ.get("KLIMS_PROFILE_DIR", "profiles")
+KEEP_FILES = int(os.environ.get("KLIMS_PROFILE_KEEP", "500"))
+DEFAULT_MODE = os.environ.get("KLIMS_PROFILE", "").lower() or None
+
+_local = threading.local()
+_write_lock = threading.Lock()
+
+
+def normalize_mode(mode):
+    """Maps "1"/"true"/"on" to "sample"; returns None for anything that is not a mode."""
+    mode = (mode or "").strip().lower()
+    if mode in ("1", "true", "on", "yes"):
+        return "sample"
+    return mode if mode in MODES else None
+
+
+def current_mode():
+    override = getattr(_local, "mode", None)
+    return override if override is not None else normalize_mode(DEFAULT_MODE)
+
+
+@contextmanager
+def request_mode(mode):
+    """Sets the profiling mode for the current thread (e.g. from a query parameter)."""
+    previous = getattr(_local, "mode", None)
+    _local.mode = normalize_mode(mode) or previous
+    try:
+        yield
+    finally:
+        _local.mode = previous
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval."""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        super().__init__(daemon=True, name="profile-sampler")
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _output_path(name, suffix):
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    safe = "".join(ch if ch.isalnum() or ch in "._-" else "_" for ch in name)
+    return os.path.join(PROFILE_DIR, f"{stamp}-{time.perf_counter_ns() % 10**6:06d}-{safe}{suffix}")
+
+
+def _rotate():
+    files = [os.path.join(PROFILE_DIR, f) for f in os.listdir(PROFILE_DIR)]
+    files.sort(key=os.path.getmtime)
+    for path in files[:-KEEP_FILES] if KEEP_FILES > 0 else []:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _write(name, elapsed, stacks=None, profile=None):
+    with _write_lock:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = _output_path(name, "")
+        if stacks:
+            with open(base + ".collapsed", "w", encoding="utf-8") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        if profile is not None:
+            profile.dump_stats(base + ".prof")
+            summary = io.StringIO()
+            summary.write(f"{name}: {elapsed * 1000:.1f} ms\n\n")
+            pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(30)
+            with open(base + ".txt", "w", encoding="utf-8") as f:
+                f.write(summary.getvalue())
+        _rotate()
+
+
+@contextmanager
+def profiled(name, mode=None):
+    """Profiles the block under `name` if profiling is enabled for this thread."""
+    mode = normalize_mode(mode) or current_mode()
+    if mode is None or getattr(_local, "active", False):
+        yield
+        return
+
+    _local.active = True
+    sampler = profile = None
+    if mode in ("sample", "full"):
+        sampler = StackSampler(threading.get_ident())
+        sampler.start()
+    if mode in ("cprofile", "full"):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another thread already holds the (interpreter-wide) profiler
+            profile = None
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        if profile is not None:
+            profile.disable()
+        if sampler is not None:
+            sampler.stop()
+        _local.active = False
+        try:
+            _write(name, elapsed, sampler.stacks if sampler else None, profile)
+        except OSError:
+            # Profiling must never break the request it observes
+            pass
+
+
+def profile_function(name=None):
+    """Decorator form of profiled(); costs one mode check per call when profiling is off."""
+    def decorate(func):
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if current_mode() is None:
+                return func(*args, **kwargs)
+            with profiled(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
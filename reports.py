@@ -0,0 +1,107 @@
+"""Report builders for the Search & Reports tab.
+
+Each builder takes an open connection and returns a Report holding a
+preview frame and the same data rendered as an .xlsx workbook, so it can
+run inside a background job and be handed back to the UI for download.
+Tables are read through order_archive.load_table(), so archived orders
+appear in every report.
+"""
+from collections import namedtuple
+from datetime import datetime
+from io import BytesIO
+
+import pandas as pd
+
+from order_archive import load_table
+from prep_planner import PrepPlanner, prep_sheet
+from production_analytics import compute_analytics
+
+Report = namedtuple("Report", ["title", "filename", "frame", "xlsx"])
+
+
+def to_xlsx(sheets):
+    """Renders {sheet name: frame} as one workbook."""
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+        for sheet_name, frame in sheets.items():
+            frame.to_excel(writer, sheet_name=sheet_name[:31], index=False)
+            worksheet = writer.sheets[sheet_name[:31]]
+            for idx, column in enumerate(frame.columns):
+                width = max([len(str(column))] + [len(str(v)) for v in frame[column].head(200)])
+                worksheet.set_column(idx, idx, min(width + 2, 50))
+    return output.getvalue()
+
+
+def _report(title, frame, extra_sheets=None):
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"{title.lower().replace(' ', '_')}_{stamp}.xlsx"
+    return Report(title, filename, frame, to_xlsx({title: frame, **(extra_sheets or {})}))
+
+
+def generate_wo_summary(conn):
+    orders = load_table(conn, "work_orders", ["id", "customer", "requester", "date", "status"])
+    trays = load_table(conn, "trays", ["id", "wo_id"])
+    production = load_table(conn, "production", ["tray_id", "end_date"])
+    shipping = load_table(conn, "shipping", ["wo_id", "ship_date", "tracking_number"])
+    frame = (
+        orders
+        .merge(trays.rename(columns={"id": "tray_id"}), how="left", left_on="id", right_on="wo_id")
+        .merge(production, how="left", on="tray_id")
+        .merge(shipping.rename(columns={"wo_id": "ship_wo_id"}), how="left", left_on="id", right_on="ship_wo_id")
+        .sort_values("date", ascending=False, kind="stable")
+    )
+    frame = frame[["id", "customer", "requester", "date", "status", "tray_id",
+                   "end_date", "ship_date", "tracking_number"]]
+    frame.columns = ["Work Order", "Customer", "Requester", "Date", "Status", "Tray ID",
+                     "Production Date", "Ship Date", "Tracking Number"]
+    return _report("Work Order Summary", frame.reset_index(drop=True))
+
+
+def generate_production_stats(conn):
+    analytics = compute_analytics(conn)
+    summary = analytics.cycle_summary.round(1).reset_index().rename(columns={"index": "Stage"})
+    summary["Stage"] = summary["Stage"].map({
+        "days_to_configure": "Created -> Configured",
+        "days_to_produce": "Configured -> Produced",
+        "days_to_ship": "Produced -> Shipped",
+        "days_total": "Created -> Shipped",
+    })
+    weekly = analytics.weekly_throughput.reset_index()
+    weekly["Week"] = weekly["Week"].dt.strftime("%Y-%m-%d")
+    return _report("Production Statistics", summary, {
+        "Weekly Throughput": weekly,
+        "WIP Aging": analytics.wip_aging.reset_index().rename(columns={"lifecycle_state": "State"}),
+        "Experiment Demand": analytics.experiment_demand,
+    })
+
+
+def generate_shipping_log(conn):
+    frame = load_table(conn, "shipping", ["wo_id", "tray_id", "customer", "requester",
+                                          "tracking_number", "ship_date"])
+    frame = frame.sort_values("ship_date", ascending=False, kind="stable").reset_index(drop=True)
+    frame.columns = ["Work Order", "Tray ID", "Customer", "Requester", "Tracking Number", "Ship Date"]
+    return _report("Shipping Log", frame)
+
+
+def generate_inventory_report(conn):
+    frame = load_table(conn, "inventory", ["wo_id", "reagent", "batch", "quantity", "date", "status"])
+    frame = frame.sort_values("date", ascending=False, kind="stable").reset_index(drop=True)
+    frame.columns = ["Work Order", "Reagent", "Batch", "Quantity", "Date", "Status"]
+    return _report("Inventory Status", frame)
+
+
+def generate_prep_sheet(conn):
+    planner = PrepPlanner()
+    planner.refresh(conn)
+    plan = planner.plan()
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return Report("Reagent Prep", f"reagent_prep_{stamp}.xlsx", plan, prep_sheet(plan, planner.tray_ids))
+
+
+REPORT_TYPES = {
+    "Work Order Summary": generate_wo_summary,
+    "Production Statistics": generate_production_stats,
+    "Shipping Log": generate_shipping_log,
+    "Inventory Status": generate_inventory_report,
+    "Reagent Prep": generate_prep_sheet,
+}
@@ -0,0 +1,233 @@
+"""Barcode scan ingestion for tray loading.
+
+Scanners and filling equipment report each reagent bottle placed on a tray:
+
+    {"tray_id": 42, "location": "LOC-3", "barcode": "KR1E|L2311", "source": "scanner-2"}
+
+Locations are the printed labels (LOC-1 .. LOC-16) or the 0-based index
+used in `tray_locations`. Bottle barcodes carry the reagent code,
+optionally followed by "|" and the lot number.
+
+Each scan is checked at once against an in-memory index of the tray's
+stored placement, so the line gets mismatch feedback without a database
+round trip. The scan itself goes into an audit_log.EventBuffer and reaches
+the event log in batches.
+
+The index loads a tray on its first scan and follows the change feed
+(change_feed, checked at most once a second), so several server processes
+stay consistent. Only trays that were re-saved are looked at again, and
+one is dropped only if its layout actually changed; the progress of every
+other tray, including scans still waiting in the buffer, is kept.
+Verification progress is rebuilt from the event log; scans made against an
+earlier configuration of the tray do not count.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import audit_log
+import change_feed
+import lims_db
+
+REFRESH_INTERVAL = 1.0
+
+
+def parse_barcode(barcode):
+    """Splits a bottle barcode into (reagent code, lot or None)."""
+    code, _, lot = str(barcode or "").strip().partition("|")
+    if not code:
+        raise ValueError("Empty barcode")
+    return code.strip().upper(), lot.strip() or None
+
+
+def parse_location(location, max_locations):
+    """Accepts "LOC-n" labels (1-based) or a 0-based index; returns the index."""
+    if isinstance(location, str):
+        label = location.strip().upper()
+        if label.startswith("LOC-") and label[4:].isdigit():
+            index = int(label[4:]) - 1
+        elif label.isdigit():
+            index = int(label)
+        else:
+            raise ValueError(f"Invalid location: {location}")
+    elif isinstance(location, int) and not isinstance(location, bool):
+        index = location
+    else:
+        raise ValueError(f"Invalid location: {location}")
+    if not 0 <= index < max_locations:
+        raise ValueError(f"Location out of range: {location}")
+    return index
+
+
+def _label(index):
+    return f"LOC-{index + 1}"
+
+
+class TrayPlacement:
+    """Expected reagent code per location of one tray, and the locations verified so far."""
+
+    def __init__(self, wo_id, expected):
+        self.wo_id = wo_id
+        self.expected = expected
+        self.signature = hashlib.sha1("|".join(code or "" for code in expected).encode("utf-8")).hexdigest()[:12]
+        self.verified = set()
+
+    def remaining(self):
+        return [loc for loc, code in enumerate(self.expected) if code and loc not in self.verified]
+
+
+class PlacementIndex:
+    """Process-wide cache of tray placements, loaded on demand."""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or lims_db.DB_PATH
+        self._trays = {}
+        self._lock = threading.Lock()
+        self._feed = change_feed.Consumer("placement_index", durable=False, tables=("trays",))
+        self._checked = 0.0
+
+    def _refresh(self):
+        """Drops cached trays whose layout changed since the last check."""
+        now = time.monotonic()
+        if now - self._checked < REFRESH_INTERVAL:
+            return
+        self._checked = now
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            if self._feed.offset is None:
+                self._feed.reset(conn)
+                return
+            try:
+                stale = set()
+                for batch in self._feed.batches(conn):
+                    stale.update(change.row_id for change in batch if change.row_id in self._trays)
+            except change_feed.ChangeFeedGap:
+                # Missed changes: re-check every cached tray rather than dropping them all
+                stale = set(self._trays)
+                self._feed.reset(conn)
+            for tray_id in stale:
+                placement = self._placement(conn, tray_id)
+                if placement is None or placement.signature != self._trays[tray_id].signature:
+                    del self._trays[tray_id]
+        finally:
+            conn.close()
+
+    def _placement(self, conn, tray_id):
+        """The tray's stored placement, without progress; None if the tray does not exist."""
+        row = conn.execute("SELECT wo_id, configuration FROM trays WHERE id = ?", (tray_id,)).fetchone()
+        if row is None:
+            return None
+        config = lims_db.load_tray_configuration(row[1])
+        locations = config["tray_locations"] if config else []
+        return TrayPlacement(row[0], tuple(loc["reagent_code"] if loc else None for loc in locations))
+
+    def _load(self, tray_id):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            placement = self._placement(conn, tray_id)
+            if placement is None:
+                return None
+            for (payload,) in conn.execute("""SELECT payload FROM events WHERE tray_id = ? AND kind = ?
+                                              ORDER BY seq""", (tray_id, audit_log.SCAN)):
+                scan = json.loads(payload)
+                if scan.get("signature") != placement.signature:
+                    continue
+                if scan.get("ok"):
+                    placement.verified.add(scan["location"])
+                else:
+                    placement.verified.discard(scan["location"])
+            return placement
+        finally:
+            conn.close()
+
+    def get(self, tray_id):
+        """The tray's placement, or None if the tray does not exist."""
+        with self._lock:
+            self._refresh()
+            placement = self._trays.get(tray_id)
+        if placement is None:
+            placement = self._load(tray_id)
+            if placement is not None:
+                with self._lock:
+                    placement = self._trays.setdefault(tray_id, placement)
+        return placement
+
+
+class ScanIngestor:
+    """Validates scans against the placement index and buffers them for the event log."""
+
+    def __init__(self, db_path=None, index=None, buffer=None):
+        self.db_path = db_path or lims_db.DB_PATH
+        self.index = index or PlacementIndex(self.db_path)
+        self.buffer = buffer or audit_log.EventBuffer(max_events=200, max_age=2.0)
+        self._lock = threading.Lock()
+
+    def scan(self, tray_id, location, barcode, source=None):
+        """Checks one scan and returns the verdict shown to the operator."""
+        result = {"tray_id": tray_id, "location": location, "ok": False}
+        placement = self.index.get(tray_id)
+        if placement is None:
+            result["message"] = f"Unknown tray: {tray_id}"
+            return result
+        try:
+            index = parse_location(location, len(placement.expected))
+            code, lot = parse_barcode(barcode)
+        except ValueError as e:
+            result["message"] = str(e)
+            return result
+
+        expected = placement.expected[index]
+        ok = code == expected
+        with self._lock:
+            if ok:
+                placement.verified.add(index)
+            else:
+                placement.verified.discard(index)
+            remaining = len(placement.remaining())
+        self.buffer.add(audit_log.SCAN, placement.wo_id, tray_id, {
+            "location": index, "reagent_code": code, "lot": lot, "expected": expected,
+            "ok": ok, "signature": placement.signature, "source": source,
+        })
+
+        if ok:
+            message = f"{code} verified at {_label(index)}"
+        elif expected is None:
+            message = f"{_label(index)} should be empty, scanned {code}"
+        else:
+            message = f"Wrong bottle at {_label(index)}: expected {expected}, scanned {code}"
+        result.update({"location": _label(index), "reagent_code": code, "expected": expected,
+                       "ok": ok, "message": message, "remaining": remaining})
+        return result
+
+    def scan_many(self, scans):
+        results = []
+        for item in scans:
+            try:
+                tray_id = int(item["tray_id"])
+            except (KeyError, TypeError, ValueError):
+                results.append({"ok": False, "message": "Missing or invalid tray_id"})
+                continue
+            results.append(self.scan(tray_id, item.get("location"), item.get("barcode"), item.get("source")))
+        return results
+
+    def progress(self, tray_id):
+        placement = self.index.get(tray_id)
+        if placement is None:
+            return None
+        with self._lock:
+            verified = sorted(placement.verified)
+            remaining = placement.remaining()
+        return {
+            "tray_id": tray_id,
+            "verified": [_label(loc) for loc in verified],
+            "remaining": [{"location": _label(loc), "reagent_code": placement.expected[loc]} for loc in remaining],
+            "complete": not remaining,
+        }
+
+    def flush(self, conn):
+        return self.buffer.flush(conn)
+
+    def flush_if_due(self, conn):
+        return self.buffer.flush_if_due(conn)
@@ -0,0 +1,86 @@
+"""Server-side store for operator drafts that must survive refreshes and restarts.
+
+Values live in the `operator_sessions` table keyed by (operator, key), as
+zlib-compressed JSON. They are read one key at a time when a page needs
+them, so Streamlit's per-tab session state only holds the operator name
+and small widget values, not whole tray configurations.
+"""
+import json
+import sqlite3
+import zlib
+
+import lims_db
+from reagent_optimizer import deserialize_configuration, serialize_configuration
+
+
+def setup_session_table(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS operator_sessions
+                 (operator TEXT,
+                  key TEXT,
+                  value BLOB,
+                  updated TEXT,
+                  PRIMARY KEY (operator, key)) WITHOUT ROWID''')
+
+
+class SessionStore:
+    def __init__(self, operator, db_path=None):
+        self.operator = operator
+        self.db_path = db_path or lims_db.DB_PATH
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _put_text(self, key, text):
+        conn = self._connect()
+        conn.execute("""INSERT INTO operator_sessions (operator, key, value, updated)
+                        VALUES (?, ?, ?, datetime('now', 'localtime'))
+                        ON CONFLICT (operator, key) DO UPDATE
+                        SET value = excluded.value, updated = excluded.updated""",
+                     (self.operator, key, zlib.compress(text.encode("utf-8"))))
+        conn.commit()
+        conn.close()
+
+    def _get_text(self, key):
+        conn = self._connect()
+        row = conn.execute("SELECT value FROM operator_sessions WHERE operator = ? AND key = ?",
+                           (self.operator, key)).fetchone()
+        conn.close()
+        return zlib.decompress(row[0]).decode("utf-8") if row else None
+
+    def set(self, key, value):
+        """Stores a JSON-serializable value (None deletes the key)."""
+        if value is None:
+            self.delete(key)
+        else:
+            self._put_text(key, json.dumps(value, separators=(",", ":")))
+
+    def get(self, key, default=None):
+        text = self._get_text(key)
+        return json.loads(text) if text is not None else default
+
+    def set_config(self, key, config):
+        """Stores an optimizer result, keeping its int experiment keys and location set."""
+        if config is None:
+            self.delete(key)
+        else:
+            self._put_text(key, serialize_configuration(config))
+
+    def get_config(self, key):
+        text = self._get_text(key)
+        return deserialize_configuration(text) if text is not None else None
+
+    def delete(self, key):
+        conn = self._connect()
+        conn.execute("DELETE FROM operator_sessions WHERE operator = ? AND key = ?", (self.operator, key))
+        conn.commit()
+        conn.close()
+
+
+def purge_sessions(db_path=None, older_than_days=30):
+    """Drops drafts nobody has touched for a while."""
+    conn = sqlite3.connect(db_path or lims_db.DB_PATH, timeout=30)
+    c = conn.execute("DELETE FROM operator_sessions WHERE updated < datetime('now', 'localtime', ?)",
+                     (f"-{older_than_days} days",))
+    conn.commit()
+    conn.close()
+    return c.rowcount
@@ -0,0 +1,190 @@
+"""Cache shared by every worker process of a multi-process deployment.
+
+Entries are grouped into namespaces ("optimizer", "tray_figures",
+"dashboard", ...). Each namespace has a generation number; invalidating a
+namespace bumps it, and entries from older generations are ignored, so a
+write in one process invalidates the cached work of every other process
+without touching the entries themselves.
+
+The backend is chosen with KLIMS_CACHE:
+    sqlite:<path>   shared SQLite file (default sqlite:klims_cache.db)
+    memory          in-process dictionary, for a single process or tests
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_URL = "sqlite:klims_cache.db"
+PRUNE_INTERVAL = 300
+
+# Namespaces
+OPTIMIZER = "optimizer"
+TRAY_FIGURES = "tray_figures"
+DASHBOARD = "dashboard"
+
+
+class MemoryCache:
+    """In-process stand-in with the same interface as SQLiteCache."""
+
+    def __init__(self):
+        self._entries = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def generation(self, namespace):
+        return self._generations.get(namespace, 0)
+
+    def get(self, namespace, key):
+        with self._lock:
+            entry = self._entries.get((namespace, self.generation(namespace), key))
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires < time.time():
+            return None
+        return value
+
+    def set(self, namespace, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._entries[(namespace, self.generation(namespace), key)] = (value, expires)
+
+    def invalidate(self, namespace):
+        with self._lock:
+            self._generations[namespace] = self.generation(namespace) + 1
+            self._entries = {k: v for k, v in self._entries.items() if k[0] != namespace}
+
+    def prune(self):
+        now = time.time()
+        with self._lock:
+            self._entries = {k: v for k, v in self._entries.items() if v[1] is None or v[1] >= now}
+
+
+class SQLiteCache:
+    """Cache in a shared SQLite file (WAL mode), safe across processes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute('''CREATE TABLE IF NOT EXISTS cache_entries
+                        (namespace TEXT,
+                         generation INTEGER,
+                         key TEXT,
+                         value BLOB,
+                         expires REAL,
+                         PRIMARY KEY (namespace, generation, key)) WITHOUT ROWID''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS cache_generations
+                        (namespace TEXT PRIMARY KEY,
+                         generation INTEGER)''')
+        conn.commit()
+
+    def _conn(self):
+        # One connection per thread; Streamlit serves sessions from a thread pool
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def generation(self, namespace):
+        row = self._conn().execute("SELECT generation FROM cache_generations WHERE namespace = ?",
+                                   (namespace,)).fetchone()
+        return row[0] if row else 0
+
+    def get(self, namespace, key):
+        row = self._conn().execute("""
+            SELECT e.value, e.expires FROM cache_entries e
+            WHERE e.namespace = ? AND e.key = ?
+              AND e.generation = COALESCE((SELECT generation FROM cache_generations
+                                           WHERE namespace = ?), 0)
+        """, (namespace, key, namespace)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return pickle.loads(row[0])
+
+    def set(self, namespace, key, value, ttl=None):
+        conn = self._conn()
+        conn.execute("""INSERT OR REPLACE INTO cache_entries (namespace, generation, key, value, expires)
+                        VALUES (?, ?, ?, ?, ?)""",
+                     (namespace, self.generation(namespace), key,
+                      pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL),
+                      time.time() + ttl if ttl else None))
+        conn.commit()
+
+    def invalidate(self, namespace):
+        conn = self._conn()
+        conn.execute("""INSERT INTO cache_generations (namespace, generation) VALUES (?, 1)
+                        ON CONFLICT (namespace) DO UPDATE SET generation = generation + 1""",
+                     (namespace,))
+        conn.commit()
+
+    def prune(self):
+        """Deletes expired entries and entries from superseded generations."""
+        conn = self._conn()
+        conn.execute("""
+            DELETE FROM cache_entries
+            WHERE (expires IS NOT NULL AND expires < ?)
+               OR generation < COALESCE((SELECT generation FROM cache_generations g
+                                         WHERE g.namespace = cache_entries.namespace), 0)
+        """, (time.time(),))
+        conn.commit()
+
+
+def create_cache(url):
+    if url == "memory":
+        return MemoryCache()
+    if url.startswith("sqlite:"):
+        return SQLiteCache(url[len("sqlite:"):])
+    raise ValueError(f"Unsupported cache backend: {url}")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+_pruned = None
+
+
+def get_cache():
+    """Process-wide cache built from KLIMS_CACHE."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = create_cache(os.environ.get("KLIMS_CACHE", DEFAULT_CACHE_URL))
+    return _cache
+
+
+def get_or_compute(namespace, key, compute, ttl=None):
+    cache = get_cache()
+    value = cache.get(namespace, key)
+    if value is None:
+        value = compute()
+        cache.set(namespace, key, value, ttl)
+    return value
+
+
+def invalidate(*namespaces):
+    cache = get_cache()
+    for namespace in namespaces:
+        cache.invalidate(namespace)
+    maybe_prune()
+
+
+def maybe_prune(interval=PRUNE_INTERVAL):
+    """Prunes the cache if this process has not done so for `interval` seconds.
+
+    Called after every invalidation, which is what leaves superseded
+    entries behind; versioned keys that are never invalidated expire by TTL.
+    """
+    global _pruned
+    now = time.monotonic()
+    with _cache_lock:
+        if _pruned is not None and now - _pruned < interval:
+            return False
+        _pruned = now
+    get_cache().prune()
+    return True
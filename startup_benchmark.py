@@ -0,0 +1,176 @@
+"""Measures cold-start and per-rerun cost of the Streamlit app.
+
+    python startup_benchmark.py --repeat 5 --cold-budget 2500 --rerun-budget 400
+
+Reports median milliseconds for:
+    imports     app.py's module-level imports, in a fresh interpreter
+    schema      setup_database on first use, then ensure_database on reruns
+    optimizer   constructing ReagentOptimizer vs. fetching the shared one
+    app         full script run (cold) and rerun, via streamlit.testing, against
+                a fresh database and cache in a temporary directory
+
+Exits with status 1 when the app raises or the cold start or the rerun
+exceeds its budget, so it can gate CI.
+"""
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _median_ms(samples):
+    return round(statistics.median(samples) * 1000, 1)
+
+
+def app_imports(path=os.path.join(HERE, "app.py")):
+    """Module names imported at the top level of app.py."""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def measure_imports(modules, repeat):
+    code = ("import time; t = time.perf_counter()\n"
+            + "".join(f"import {module}\n" for module in modules)
+            + "print(time.perf_counter() - t)")
+    samples = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", code], cwd=HERE, capture_output=True, text=True, check=True)
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return _median_ms(samples)
+
+
+def measure_schema(repeat):
+    import lims_db
+
+    original = lims_db.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        lims_db.DB_PATH = os.path.join(tmp, "benchmark.db")
+        try:
+            started = time.perf_counter()
+            lims_db.ensure_database()
+            first = time.perf_counter() - started
+
+            samples = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                lims_db.ensure_database()
+                samples.append(time.perf_counter() - started)
+
+            full = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                lims_db.setup_database()
+                full.append(time.perf_counter() - started)
+        finally:
+            lims_db.DB_PATH = original
+    return {"first": round(first * 1000, 1), "rerun": _median_ms(samples), "setup_database": _median_ms(full)}
+
+
+def measure_optimizer(repeat):
+    from reagent_optimizer import ReagentOptimizer, get_optimizer
+
+    def time_call(func):
+        samples = []
+        for _ in range(repeat * 100):
+            started = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - started)
+        return round(statistics.median(samples) * 1e6, 1)
+
+    get_optimizer()
+    return {"construct_us": time_call(ReagentOptimizer), "shared_us": time_call(get_optimizer)}
+
+
+APP_RUNS = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+
+cold, rerun = [], []
+for _ in range({repeat}):
+    app = AppTest.from_file({path!r}, default_timeout=120)
+    started = time.perf_counter()
+    app.run()
+    cold.append(time.perf_counter() - started)
+    started = time.perf_counter()
+    app.run()
+    rerun.append(time.perf_counter() - started)
+    if app.exception:
+        sys.exit("app raised: " + app.exception[0].value)
+print(json.dumps({{"cold": cold, "rerun": rerun}}))
+"""
+
+
+def measure_app(repeat):
+    """Cold and rerun time of the whole script; None if streamlit is not installed.
+
+    Runs in a fresh interpreter inside a temporary directory, so the app
+    creates its own database and cache there instead of using the live ones.
+    Raises RuntimeError if the script raised an exception.
+    """
+    try:
+        import streamlit.testing.v1  # noqa: F401
+    except ImportError:
+        return None
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, PYTHONPATH=HERE, KLIMS_CACHE=f"sqlite:{os.path.join(tmp, 'klims_cache.db')}")
+        env.pop("KLIMS_PROFILE", None)
+        code = APP_RUNS.format(repeat=repeat, path=os.path.join(HERE, "app.py"))
+        out = subprocess.run([sys.executable, "-c", code], cwd=tmp, env=env, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "app run failed")
+    samples = json.loads(out.stdout.strip().splitlines()[-1])
+    return {"cold": _median_ms(samples["cold"]), "rerun": _median_ms(samples["rerun"])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark app cold start and reruns.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--cold-budget", type=float, default=None, help="Max cold start in ms")
+    parser.add_argument("--rerun-budget", type=float, default=None, help="Max rerun in ms")
+    args = parser.parse_args()
+
+    sys.path.insert(0, HERE)
+    modules = app_imports()
+    print(f"imports      {measure_imports(modules, args.repeat)} ms  ({', '.join(modules)})")
+    schema = measure_schema(args.repeat)
+    print(f"schema       first {schema['first']} ms, rerun {schema['rerun']} ms "
+          f"(setup_database every time: {schema['setup_database']} ms)")
+    optimizer = measure_optimizer(args.repeat)
+    print(f"optimizer    construct {optimizer['construct_us']} us, shared {optimizer['shared_us']} us")
+
+    try:
+        app = measure_app(args.repeat)
+    except RuntimeError as e:
+        print(f"app          failed: {e}")
+        return 1
+    if app is None:
+        print("app          skipped (streamlit not installed)")
+        return 0
+    print(f"app          cold {app['cold']} ms, rerun {app['rerun']} ms")
+
+    failed = False
+    if args.cold_budget is not None and app["cold"] > args.cold_budget:
+        print(f"Cold start {app['cold']} ms exceeds budget of {args.cold_budget} ms")
+        failed = True
+    if args.rerun_budget is not None and app["rerun"] > args.rerun_budget:
+        print(f"Rerun {app['rerun']} ms exceeds budget of {args.rerun_budget} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("pyarrow")
+
+import lims_db  # noqa: E402
+import order_archive  # noqa: E402
+from reagent_optimizer import ReagentOptimizer  # noqa: E402
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.setenv("KLIMS_CACHE", "memory")
+    monkeypatch.setattr(lims_db, "DB_PATH", str(tmp_path / "reagent_lims.db"))
+    lims_db.setup_database()
+    conn = lims_db.create_connection()
+    yield conn
+    conn.close()
+
+
+def ship_order(conn, config, ship_date):
+    wo_id = lims_db.create_work_order(conn, "Customer", "Requester", ship_date)
+    tray_id = lims_db.save_tray_configuration(conn, wo_id, config)
+    lims_db.complete_production(conn, tray_id)
+    lims_db.process_shipment(conn, tray_id, f"TRK-{tray_id}", ship_date)
+    return wo_id, tray_id
+
+
+def test_archive_round_trip_keeps_ids_unique(conn, tmp_path):
+    archive_dir = str(tmp_path / "archive")
+    config = ReagentOptimizer().optimize_tray_configuration([1, 2])
+    shipped = [ship_order(conn, config, "2025-01-1%d" % day) for day in range(3)]
+
+    moved = order_archive.archive_shipped(conn, 90, archive_dir)
+
+    assert moved["work_orders"] == 3
+    assert moved["trays"] == 3
+    assert conn.execute("SELECT COUNT(*) FROM trays").fetchone()[0] == 0
+    trays = order_archive.load_table(conn, "trays", archive_dir=archive_dir)
+    assert sorted(trays["id"]) == sorted(tray_id for _, tray_id in shipped)
+
+    # A new tray must not take the id of an archived one
+    wo_id = lims_db.create_work_order(conn, "Customer", "Requester", "2026-01-01")
+    new_tray = lims_db.save_tray_configuration(conn, wo_id, config)
+    assert new_tray > max(tray_id for _, tray_id in shipped)
+
+    trays = order_archive.load_table(conn, "trays", archive_dir=archive_dir)
+    production = order_archive.load_table(conn, "production", archive_dir=archive_dir)
+    assert len(trays) == 4
+    assert set(production["tray_id"]) == {tray_id for _, tray_id in shipped}
+    assert dict(zip(trays["id"], trays["wo_id"]))[shipped[0][1]] == shipped[0][0]
+
+
+def test_migration_seeds_ids_past_archived_rows(conn, tmp_path, monkeypatch):
+    # The migration reads the default archive directory, relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    config = ReagentOptimizer().optimize_tray_configuration([1])
+    _, tray_id = ship_order(conn, config, "2025-01-10")
+    order_archive.archive_shipped(conn, 90)
+
+    # An older database: trays without AUTOINCREMENT and no sequence row
+    conn.executescript("""
+        DROP TABLE trays;
+        CREATE TABLE trays (id INTEGER PRIMARY KEY, wo_id TEXT, customer TEXT, requester TEXT,
+                            date TEXT, configuration TEXT, experiments TEXT);
+        DELETE FROM sqlite_sequence WHERE name = 'trays';
+    """)
+    lims_db.setup_database()
+
+    assert "AUTOINCREMENT" in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE name = 'trays'").fetchone()[0].upper()
+    wo_id = lims_db.create_work_order(conn, "Customer", "Requester", "2026-01-01")
+    assert lims_db.save_tray_configuration(conn, wo_id, config) > tray_id
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("PIL")
+
+import tray_labels  # noqa: E402
+from reagent_optimizer import EXPERIMENT_DATA  # noqa: E402
+
+
+def test_bottle_barcodes_fit_the_label():
+    codes = {reagent["code"] for exp in EXPERIMENT_DATA.values() for reagent in exp["reagents"]}
+    for code in codes:
+        image = tray_labels.fitted_barcode(code, 60, tray_labels.LABEL[0] - 2)
+        assert image.width <= tray_labels.LABEL[0] - 2
+        # Quiet zones of at least 10 narrow modules on both sides
+        assert image.getpixel((19, 30)) == 1
+        assert image.getpixel((image.width - 20, 30)) == 1
+
+
+def test_overlong_code_is_rejected():
+    with pytest.raises(ValueError):
+        tray_labels.fitted_barcode("ABCDEFGHIJ", 60, tray_labels.LABEL[0] - 2)
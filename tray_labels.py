@@ -0,0 +1,319 @@
+"""Printable tray sheets: location map and bottle labels, rendered in batches.
+
+One A4 sheet per tray (150 dpi) with
+
+    header   tray id, work order, customer, production date and a Code 39
+             barcode of the work order id
+    map      the 4 x 4 location grid in reagent colours (get_reagent_color)
+             with reagent code, tests and experiment per location
+    labels   one cut-out bottle label per location, with a Code 39 barcode
+             of the reagent code (what scan_ingest expects from the scanner)
+
+A day's production is rendered across a process pool (one worker per CPU,
+serially on a single-CPU host) and streamed into a zip, one PNG and/or PDF
+per tray, as sheets finish:
+
+    python tray_labels.py --date 2026-03-02 --out labels.zip
+
+Each worker caches its fonts, rendered text, barcodes and the blank sheet
+template, so after the first tray a sheet is mostly pastes of cached images.
+"""
+import argparse
+import functools
+import io
+import multiprocessing
+import os
+import tempfile
+import zipfile
+from collections import namedtuple
+from datetime import datetime
+
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+from lims_db import load_tray_configuration
+from reagent_optimizer import get_reagent_color
+
+DPI = 150
+PAGE_SIZE = (1240, 1754)  # A4 at 150 dpi
+MARGIN = 60
+COLUMNS = 4
+MAX_LOCATIONS = 16
+CELL = (280, 200)
+LABEL = (280, 140)
+GRID_TOP = 270
+LABELS_TOP = GRID_TOP + CELL[1] * 4 + 70
+FORMATS = ("png", "pdf")
+PARALLEL_THRESHOLD = 8
+LABEL_DIR = "labels"
+
+TraySheet = namedtuple("TraySheet", ["tray_id", "wo_id", "customer", "date", "configuration"])
+
+# Code 39: per character, bar/space widths from left to right (1 = wide), bars first
+CODE39 = {
+    "0": "000110100", "1": "100100001", "2": "001100001", "3": "101100000", "4": "000110001",
+    "5": "100110000", "6": "001110000", "7": "000100101", "8": "100100100", "9": "001100100",
+    "A": "100001001", "B": "001001001", "C": "101001000", "D": "000011001", "E": "100011000",
+    "F": "001011000", "G": "000001101", "H": "100001100", "I": "001001100", "J": "000011100",
+    "K": "100000011", "L": "001000011", "M": "101000010", "N": "000010011", "O": "100010010",
+    "P": "001010010", "Q": "000000111", "R": "100000110", "S": "001000110", "T": "000010110",
+    "U": "110000001", "V": "011000001", "W": "111000000", "X": "010010001", "Y": "110010000",
+    "Z": "011010000", "-": "010000101", ".": "110000100", " ": "011000100", "$": "010101000",
+    "/": "010100010", "+": "010001010", "%": "000101010", "*": "010010100",
+}
+
+
+def code39_widths(text, narrow=2, ratio=3):
+    """Module widths (bar, space, bar, ...) of `text` framed by the * start/stop character."""
+    wide = round(narrow * ratio)
+    text = str(text).upper()
+    invalid = sorted({ch for ch in text if ch not in CODE39 or ch == "*"})
+    if invalid:
+        raise ValueError(f"Characters not encodable in Code 39: {''.join(invalid)}")
+    widths = []
+    for ch in f"*{text}*":
+        widths.extend(wide if element == "1" else narrow for element in CODE39[ch])
+        widths.append(narrow)  # inter-character gap
+    return widths[:-1]
+
+
+@functools.lru_cache(maxsize=256)
+def barcode_image(text, height=80, narrow=2, ratio=3):
+    """Code 39 barcode as a 1-bit image, with quiet zones."""
+    widths = code39_widths(text, narrow, ratio)
+    quiet = narrow * 10
+    image = Image.new("1", (sum(widths) + 2 * quiet, height), 1)
+    draw = ImageDraw.Draw(image)
+    x = quiet
+    for i, width in enumerate(widths):
+        if i % 2 == 0:
+            draw.rectangle([x, 0, x + width - 1, height - 1], fill=0)
+        x += width
+    return image
+
+
+def fitted_barcode(text, height, max_width, narrow=2):
+    """The barcode at the widest wide:narrow ratio that fits `max_width`.
+
+    2.5 is about as low as Code 39 goes at a 2 px module, so codes that do not
+    fit even then are an error rather than a barcode scanners cannot read.
+    """
+    for ratio in (3, 2.5):
+        image = barcode_image(text, height, narrow, ratio)
+        if image.width <= max_width:
+            return image
+    raise ValueError(f"Barcode for {text} does not fit in {max_width} px")
+
+
+@functools.lru_cache(maxsize=None)
+def font(size, bold=False):
+    name = "DejaVuSans-Bold.ttf" if bold else "DejaVuSans.ttf"
+    try:
+        return ImageFont.truetype(name, size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+@functools.lru_cache(maxsize=4096)
+def text_mask(text, size, bold=False):
+    """Rendered text as an alpha mask; reagent codes and labels repeat across sheets."""
+    face = font(size, bold)
+    left, top, right, bottom = face.getbbox(text)
+    mask = Image.new("L", (max(right - left, 1), max(bottom - top, 1)), 0)
+    ImageDraw.Draw(mask).text((-left, -top), text, font=face, fill=255)
+    return mask
+
+
+def paste_text(page, text, xy, size, bold=False, fill=(0, 0, 0), anchor="la"):
+    """Draws cached text; anchor "la" = left/top, "ma" = centred horizontally."""
+    mask = text_mask(str(text), size, bold)
+    x, y = xy
+    if anchor == "ma":
+        x -= mask.width // 2
+    page.paste(fill, (int(x), int(y)), mask)
+    return mask.height
+
+
+@functools.lru_cache(maxsize=None)
+def tint(color, alpha):
+    """Colour blended over white, as the tray figure shows it at reduced opacity."""
+    r, g, b = ImageColor.getrgb(color)[:3]
+    return tuple(round(255 - (255 - channel) * alpha) for channel in (r, g, b))
+
+
+def _cell_box(loc, top, size):
+    row, col = divmod(loc, COLUMNS)
+    x = MARGIN + col * size[0]
+    y = top + row * size[1]
+    return x, y, x + size[0], y + size[1]
+
+
+@functools.lru_cache(maxsize=1)
+def template():
+    """Blank sheet with everything that does not depend on the tray."""
+    page = Image.new("RGB", PAGE_SIZE, "white")
+    draw = ImageDraw.Draw(page)
+    paste_text(page, "Tray Location Map", (MARGIN, GRID_TOP - 40), 22, bold=True)
+    paste_text(page, "Bottle Labels (cut along the lines)", (MARGIN, LABELS_TOP - 40), 22, bold=True)
+    for loc in range(MAX_LOCATIONS):
+        draw.rectangle(_cell_box(loc, GRID_TOP, CELL), outline="black", width=2)
+        x0, y0, x1, y1 = _cell_box(loc, LABELS_TOP, LABEL)
+        for x in range(x0, x1, 12):
+            draw.line([(x, y0), (min(x + 6, x1), y0)], fill="gray")
+            draw.line([(x, y1), (min(x + 6, x1), y1)], fill="gray")
+        for y in range(y0, y1, 12):
+            draw.line([(x0, y), (x0, min(y + 6, y1))], fill="gray")
+            draw.line([(x1, y), (x1, min(y + 6, y1))], fill="gray")
+    paste_text(page, "Large locations LOC-1 to LOC-4 hold 270 mL; all others 140 mL.",
+               (MARGIN, PAGE_SIZE[1] - 40), 16, fill=(90, 90, 90))
+    return page
+
+
+def render_sheet(sheet):
+    """The tray's sheet as an RGB image."""
+    config = load_tray_configuration(sheet.configuration) if isinstance(sheet.configuration, str) \
+        else sheet.configuration
+    locations = list(config["tray_locations"]) if config else []
+    locations += [None] * (MAX_LOCATIONS - len(locations))
+
+    page = template().copy()
+    draw = ImageDraw.Draw(page)
+
+    # Header
+    paste_text(page, f"Tray {sheet.tray_id}", (MARGIN, MARGIN), 44, bold=True)
+    paste_text(page, f"Work Order {sheet.wo_id}", (MARGIN, MARGIN + 62), 26)
+    paste_text(page, f"Customer: {sheet.customer or '-'}", (MARGIN, MARGIN + 100), 22)
+    paste_text(page, f"Produced: {sheet.date or '-'}", (MARGIN, MARGIN + 134), 22)
+    wo_barcode = barcode_image(sheet.wo_id, 100)
+    barcode_x = PAGE_SIZE[0] - MARGIN - wo_barcode.width
+    page.paste(wo_barcode.convert("RGB"), (barcode_x, MARGIN))
+    paste_text(page, sheet.wo_id, (barcode_x + wo_barcode.width // 2, MARGIN + 108), 20, anchor="ma")
+
+    for loc, placement in enumerate(locations[:MAX_LOCATIONS]):
+        label = f"LOC-{loc + 1}"
+        x0, y0, x1, y1 = _cell_box(loc, GRID_TOP, CELL)
+        center = (x0 + x1) // 2
+        if placement:
+            code = placement["reagent_code"]
+            draw.rectangle([x0 + 2, y0 + 2, x1 - 2, y1 - 2], fill=tint(get_reagent_color(code), 0.6))
+            paste_text(page, label, (center, y0 + 22), 24, bold=True, anchor="ma")
+            paste_text(page, code, (center, y0 + 62), 30, bold=True, anchor="ma")
+            paste_text(page, f"Tests: {placement.get('tests_possible', '-')}", (center, y0 + 108), 22, anchor="ma")
+            paste_text(page, f"Exp: #{placement.get('experiment', '-')}", (center, y0 + 142), 22, anchor="ma")
+        else:
+            draw.rectangle([x0 + 2, y0 + 2, x1 - 2, y1 - 2], fill=tint("lightgray", 0.2))
+            paste_text(page, label, (center, y0 + 22), 24, bold=True, anchor="ma")
+            paste_text(page, "Empty", (center, y0 + 80), 26, anchor="ma", fill=(120, 120, 120))
+
+        # Bottle label
+        x0, y0, x1, y1 = _cell_box(loc, LABELS_TOP, LABEL)
+        center = (x0 + x1) // 2
+        if placement:
+            paste_text(page, f"{placement['reagent_code']}  ·  {label}", (center, y0 + 12), 20, bold=True,
+                       anchor="ma")
+            # Inside the cut lines, quiet zones included
+            bottle_barcode = fitted_barcode(placement["reagent_code"], 60, LABEL[0] - 2)
+            page.paste(bottle_barcode.convert("RGB"), (center - bottle_barcode.width // 2, y0 + 44))
+            paste_text(page, f"Tray {sheet.tray_id} · {sheet.wo_id}", (center, y0 + 110), 16, anchor="ma")
+    return page
+
+
+def encode(image, fmt):
+    buffer = io.BytesIO()
+    if fmt == "pdf":
+        # Pillow embeds RGB pages as JPEG; full chroma and high quality keep the bar edges sharp
+        image.save(buffer, "PDF", resolution=DPI, quality=95, subsampling=0)
+    elif fmt == "png":
+        # Fast compression: the sheets are mostly flat colour, so level 1 is within ~25% of level 6
+        image.save(buffer, "PNG", dpi=(DPI, DPI), compress_level=1)
+    else:
+        raise ValueError(f"Unknown format: {fmt}")
+    return buffer.getvalue()
+
+
+def _render(task):
+    sheet, formats = task
+    image = render_sheet(sheet)
+    return sheet, [(fmt, encode(image, fmt)) for fmt in formats]
+
+
+def load_day(conn, date):
+    """Trays whose production was completed on `date` ('YYYY-MM-DD')."""
+    c = conn.cursor()
+    c.execute("""SELECT t.id, t.wo_id, wo.customer, p.end_date, t.configuration
+                 FROM production p
+                 JOIN trays t ON t.id = p.tray_id
+                 JOIN work_orders wo ON wo.id = t.wo_id
+                 WHERE p.status = 'Complete' AND p.end_date = ?
+                 ORDER BY t.id""", (date,))
+    return [TraySheet(*row) for row in c.fetchall()]
+
+
+def render_batch(sheets, out, formats=FORMATS, workers=None):
+    """Renders every sheet and streams them into a zip at `out` (path or file); returns the count."""
+    formats = tuple(formats)
+    tasks = [(sheet, formats) for sheet in sheets]
+    count = 0
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_STORED) as archive:
+        # PNG and PDF pages are already compressed; deflating them again costs time for nothing
+        # A pool only pays off with several CPUs and enough sheets to spread over them
+        workers = min(workers or os.cpu_count() or 1, len(tasks))
+        if len(tasks) < PARALLEL_THRESHOLD or workers <= 1:
+            pool, results = None, map(_render, tasks)
+        else:
+            # Batches run on a job queue thread; a forked child could inherit locks
+            # other threads hold, so the workers start from a fresh interpreter
+            pool = multiprocessing.get_context("spawn").Pool(workers)
+            results = pool.imap(_render, tasks, chunksize=max(1, len(tasks) // (workers * 4)))
+        try:
+            for sheet, files in results:
+                for fmt, data in files:
+                    archive.writestr(f"tray_{sheet.tray_id}_{sheet.wo_id}.{fmt}", data)
+                count += 1
+        finally:
+            # Every task has been collected (or the batch failed), so the workers can go
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+    return count
+
+
+def render_day(conn, date, out_dir=LABEL_DIR, formats=FORMATS, workers=None):
+    """Renders a day's production into <out_dir>/labels_<date>.zip; returns (path, tray count)."""
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"labels_{date}.zip")
+    # A partial file of its own, so concurrent renders of the same day cannot
+    # write into each other's zip; the last one to finish is published
+    fd, partial = tempfile.mkstemp(prefix=f"labels_{date}.", suffix=".part", dir=out_dir)
+    os.close(fd)
+    try:
+        count = render_batch(load_day(conn, date), partial, formats, workers)
+        os.replace(partial, path)
+    except BaseException:
+        os.remove(partial)
+        raise
+    return path, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render tray maps and bottle labels for a day's production.")
+    parser.add_argument("--date", default=datetime.now().strftime("%Y-%m-%d"))
+    parser.add_argument("--out", help="Zip file to write (default labels/labels_<date>.zip)")
+    parser.add_argument("--format", choices=FORMATS, action="append", dest="formats")
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+
+    from lims_db import create_connection
+    conn = create_connection()
+    try:
+        if args.out:
+            count = render_batch(load_day(conn, args.date), args.out, args.formats or FORMATS, args.workers)
+            path = args.out
+        else:
+            path, count = render_day(conn, args.date, formats=args.formats or FORMATS, workers=args.workers)
+    finally:
+        conn.close()
+    print(f"{count} tray sheets written to {path}")
+
+
+if __name__ == "__main__":
+    main()
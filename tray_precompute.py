@@ -0,0 +1,215 @@
+"""Offline precomputation of optimal trays for common experiment combinations.
+
+Run as a batch job to build the lookup file:
+
+    python tray_precompute.py --max-size 4 --workers 8 --output tray_lookup.db
+
+At runtime, TrayLookup answers optimize requests by canonical key from that
+file and only falls back to a live solve for combinations it has not seen.
+"""
+import argparse
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zlib
+from multiprocessing import Pool
+
+import shared_cache
+from reagent_optimizer import (
+    EXPERIMENT_DATA,
+    ReagentOptimizer,
+    canonical_key,
+    deserialize_configuration,
+    serialize_configuration,
+)
+
+DEFAULT_LOOKUP_PATH = "tray_lookup.db"
+
+
+def catalog_fingerprint(experiment_data):
+    """Hash of the catalog, so a lookup built from an older catalog is never used."""
+    payload = json.dumps(experiment_data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def enumerate_combinations(experiment_data, max_size, max_locations):
+    """Yields every sorted tuple of experiments (up to max_size) whose reagents fit on a tray."""
+    exps = sorted(experiment_data)
+    sizes = [len(experiment_data[exp]["reagents"]) for exp in exps]
+
+    def extend(start, combo, used):
+        for i in range(start, len(exps)):
+            if used + sizes[i] > max_locations:
+                continue
+            new_combo = combo + (exps[i],)
+            yield new_combo
+            if len(new_combo) < max_size:
+                yield from extend(i + 1, new_combo, used + sizes[i])
+
+    yield from extend(0, (), 0)
+
+
+_worker_optimizer = None
+
+
+def _init_worker():
+    global _worker_optimizer
+    _worker_optimizer = ReagentOptimizer()
+
+
+def _solve(combo):
+    try:
+        config = _worker_optimizer.optimize_tray_configuration(list(combo))
+    except ValueError as e:
+        return canonical_key(combo), None, str(e)
+    blob = zlib.compress(serialize_configuration(config).encode("utf-8"))
+    return canonical_key(combo), blob, None
+
+
+def build_lookup(output_path, max_size=4, workers=None, batch_size=2000):
+    """Solves every feasible combination in parallel and writes the indexed lookup file."""
+    optimizer = ReagentOptimizer()
+    fingerprint = catalog_fingerprint(optimizer.experiment_data)
+    combos = list(enumerate_combinations(optimizer.experiment_data, max_size, optimizer.MAX_LOCATIONS))
+
+    tmp_path = output_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    c = conn.cursor()
+    c.execute("PRAGMA journal_mode=OFF")
+    c.execute("PRAGMA synchronous=OFF")
+    c.execute("""CREATE TABLE configurations
+                 (key TEXT PRIMARY KEY,
+                  config BLOB,
+                  error TEXT) WITHOUT ROWID""")
+    c.execute("CREATE TABLE metadata (name TEXT PRIMARY KEY, value TEXT)")
+
+    started = time.time()
+    solved = failed = 0
+    batch = []
+    with Pool(processes=workers, initializer=_init_worker) as pool:
+        for key, blob, error in pool.imap_unordered(_solve, combos, chunksize=256):
+            batch.append((key, blob, error))
+            if error:
+                failed += 1
+            else:
+                solved += 1
+            if len(batch) >= batch_size:
+                c.executemany("INSERT INTO configurations VALUES (?, ?, ?)", batch)
+                batch = []
+    if batch:
+        c.executemany("INSERT INTO configurations VALUES (?, ?, ?)", batch)
+
+    c.executemany("INSERT INTO metadata VALUES (?, ?)", [
+        ("catalog_fingerprint", fingerprint),
+        ("max_size", str(max_size)),
+        ("built_at", time.strftime("%Y-%m-%d %H:%M:%S")),
+    ])
+    conn.commit()
+    c.execute("VACUUM")
+    conn.close()
+    os.replace(tmp_path, output_path)
+
+    return {
+        "combinations": len(combos),
+        "solved": solved,
+        "infeasible": failed,
+        "seconds": round(time.time() - started, 2),
+    }
+
+
+class TrayLookup:
+    """Read-only view of a precomputed lookup file."""
+
+    def __init__(self, path=DEFAULT_LOOKUP_PATH, experiment_data=None):
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        row = self.conn.execute(
+            "SELECT value FROM metadata WHERE name = 'catalog_fingerprint'"
+        ).fetchone()
+        if experiment_data is None:
+            experiment_data = EXPERIMENT_DATA
+        # A lookup built from a different catalog would hand out stale trays
+        self.valid = bool(row) and row[0] == catalog_fingerprint(experiment_data)
+
+    def get(self, selected_experiments):
+        """Returns (config, error) for a stored combination, or None if it was never solved."""
+        if not self.valid:
+            return None
+        row = self.conn.execute(
+            "SELECT config, error FROM configurations WHERE key = ?",
+            (canonical_key(selected_experiments),)
+        ).fetchone()
+        if row is None:
+            return None
+        config, error = row
+        if error:
+            return None, error
+        return deserialize_configuration(zlib.decompress(config).decode("utf-8")), None
+
+    def optimize(self, optimizer, selected_experiments):
+        """Answers from the lookup file, falling back to a live solve for unseen combinations."""
+        hit = self.get(selected_experiments)
+        if hit is None:
+            return optimizer.optimize_tray_configuration(sorted(set(selected_experiments)))
+        config, error = hit
+        if error:
+            raise ValueError(error)
+        return config
+
+    def close(self):
+        self.conn.close()
+
+
+@functools.lru_cache(maxsize=None)
+def get_lookup(path=DEFAULT_LOOKUP_PATH):
+    """Opens a lookup file once per process; None if it has not been built."""
+    if not os.path.exists(path):
+        return None
+    return TrayLookup(path)
+
+
+def _fingerprint_of(optimizer):
+    fingerprint = getattr(optimizer, "_catalog_fingerprint", None)
+    if fingerprint is None:
+        fingerprint = optimizer._catalog_fingerprint = catalog_fingerprint(optimizer.experiment_data)
+    return fingerprint
+
+
+def optimize_experiments(optimizer, selected_experiments):
+    """Solves a tray through the shared cache, then the lookup file, then live.
+
+    Cache keys carry the catalog fingerprint, so results from a previous
+    catalog are never served.
+    """
+    key = f"{_fingerprint_of(optimizer)}:{canonical_key(selected_experiments)}"
+
+    def solve():
+        lookup = get_lookup()
+        if lookup:
+            config = lookup.optimize(optimizer, selected_experiments)
+        else:
+            config = optimizer.optimize_tray_configuration(sorted(set(selected_experiments)))
+        return serialize_configuration(config)
+
+    return deserialize_configuration(shared_cache.get_or_compute(shared_cache.OPTIMIZER, key, solve))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute optimal trays for experiment combinations.")
+    parser.add_argument("--output", default=DEFAULT_LOOKUP_PATH, help="Lookup file to write")
+    parser.add_argument("--max-size", type=int, default=4, help="Largest number of experiments per tray")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    args = parser.parse_args()
+
+    stats = build_lookup(args.output, max_size=args.max_size, workers=args.workers)
+    print(f"Wrote {args.output}: {stats['solved']} trays solved, "
+          f"{stats['infeasible']} infeasible, {stats['combinations']} combinations "
+          f"in {stats['seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Vectorized scoring of candidate tray assignments.
+
+A TrayScorer is built for one selection of experiments. Each reagent of
+those experiments gets a slot number, and a candidate tray is a row of 16
+slot numbers (-1 for an empty location):
+
+    scorer = TrayScorer([1, 5, 12])
+    scores = scorer.score(assignments)      # assignments: (candidates, 16) ints
+
+For every candidate this computes, in a handful of array operations:
+
+    set_yields   (candidates, experiments, max_sets) tests per reagent set
+    sets         (candidates, experiments) complete reagent sets
+    total_tests  (candidates, experiments) tests per experiment
+    tray_life    (candidates,) tests before the first experiment runs out
+
+Bottles of the same reagent are paired into sets by rank (the k-th best
+location of every reagent forms set k), which is the pairing that
+maximizes the experiment's total tests. Large batches are scored in chunks
+so memory stays bounded.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from reagent_optimizer import EXPERIMENT_DATA
+
+MAX_LOCATIONS = 16
+EMPTY = -1
+
+Scores = namedtuple("Scores", ["set_yields", "sets", "total_tests", "tray_life"])
+
+
+def location_capacities(max_locations=MAX_LOCATIONS):
+    """Capacity in mL per location; the first four locations hold the large bottles."""
+    capacities = np.full(max_locations, 140, dtype=np.int64)
+    capacities[:4] = 270
+    return capacities
+
+
+class TrayScorer:
+    def __init__(self, experiments, experiment_data=None, max_locations=MAX_LOCATIONS):
+        experiment_data = EXPERIMENT_DATA if experiment_data is None else experiment_data
+        if not experiments:
+            raise ValueError("At least one experiment is required")
+        for exp in experiments:
+            if exp not in experiment_data:
+                raise ValueError(f"Invalid experiment number: {exp}")
+        self.experiments = sorted(set(experiments))
+        self.max_locations = max_locations
+        self.max_sets = max_locations
+
+        # Slots are contiguous per experiment, so each experiment is one slice
+        self.slots = []
+        self.starts = []
+        volumes = []
+        for exp in self.experiments:
+            self.starts.append(len(self.slots))
+            for reagent in experiment_data[exp]["reagents"]:
+                self.slots.append((exp, reagent["code"]))
+                volumes.append(reagent["vol"])
+        self._slot_of = {slot: i for i, slot in enumerate(self.slots)}
+        self._ranges = list(zip(self.starts, self.starts[1:] + [len(self.slots)]))
+
+        # tests[slot, location]; the extra last row scores empty locations
+        capacities = location_capacities(max_locations)
+        tests = (capacities[None, :] * 1000) // np.asarray(volumes, dtype=np.int64)[:, None]
+        tests = np.vstack([tests, np.zeros((1, max_locations), dtype=np.int64)])
+        # Narrow integers keep the per-chunk arrays small and the sort fast
+        self._dtype = np.int16 if tests.max() < np.iinfo(np.int16).max else np.int32
+        self._tests = tests.astype(self._dtype)
+        self._slot_ids = np.arange(len(self.slots), dtype=np.int16)
+
+    @property
+    def reagents_needed(self):
+        return len(self.slots)
+
+    def encode(self, config):
+        """Row of slot numbers for an optimizer result (for cross-checks and warm starts)."""
+        row = np.full(self.max_locations, EMPTY, dtype=np.int16)
+        for loc, placement in enumerate(config["tray_locations"]):
+            if placement:
+                row[loc] = self._slot_of[(placement["experiment"], placement["reagent_code"])]
+        return row
+
+    def _score_chunk(self, assignments):
+        locations = np.arange(self.max_locations)
+        # Empty locations index the all-zero row
+        tests = self._tests[np.where(assignments < 0, len(self.slots), assignments), locations]
+
+        # Per slot, the tests of each location holding it, best first; -1 where absent
+        holds = assignments[:, None, :] == self._slot_ids[None, :, None]
+        per_slot = np.where(holds, tests[:, None, :], self._dtype(-1))
+        per_slot.sort(axis=2)
+        per_slot = per_slot[:, :, ::-1]
+
+        # Set k of an experiment is complete only if every reagent has a k-th bottle
+        set_yields = np.stack([per_slot[:, start:end].min(axis=1) for start, end in self._ranges], axis=1)
+        np.maximum(set_yields, 0, out=set_yields)
+
+        total_tests = set_yields.sum(axis=2, dtype=np.int64)
+        sets = np.count_nonzero(set_yields, axis=2)
+        return set_yields, sets, total_tests, total_tests.min(axis=1)
+
+    def score(self, assignments, chunk_size=4096):
+        assignments = np.asarray(assignments, dtype=np.int16)
+        if assignments.ndim == 1:
+            assignments = assignments[None, :]
+        if assignments.shape[1] != self.max_locations:
+            raise ValueError(f"Expected {self.max_locations} locations per candidate, got {assignments.shape[1]}")
+        if assignments.size and (assignments.max() >= len(self.slots) or assignments.min() < EMPTY):
+            raise ValueError("Assignments contain unknown slot numbers")
+
+        parts = [self._score_chunk(assignments[i:i + chunk_size])
+                 for i in range(0, max(len(assignments), 1), chunk_size)]
+        return Scores(*(np.concatenate(arrays) for arrays in zip(*parts)))
+
+    def best(self, assignments, chunk_size=4096):
+        """Index and scores of the candidate with the longest tray life (ties: most total tests)."""
+        scores = self.score(assignments, chunk_size)
+        order = np.lexsort((-scores.total_tests.sum(axis=1), -scores.tray_life))
+        return int(order[0]), scores
@@ -0,0 +1,132 @@
+"""Bulk work-order import from CSV/XLSX files.
+
+Expected columns (case-insensitive): customer, requester, and optionally
+date (defaults to today) and experiments (experiment numbers separated by
+";", "," or spaces, e.g. "1;5;12"). Rows are validated together in
+pandas, valid rows are inserted in one transaction with a single block of
+reserved WO numbers, and invalid rows are reported without aborting the
+batch.
+"""
+from collections import namedtuple
+from datetime import datetime
+
+import pandas as pd
+
+import audit_log
+import shared_cache
+from lims_db import reserve_wo_numbers
+from reagent_optimizer import get_optimizer
+
+REQUIRED_COLUMNS = ["customer", "requester"]
+
+ImportResult = namedtuple("ImportResult", ["created", "errors", "job_ids"])
+
+
+def read_orders(file, filename):
+    """Loads an uploaded CSV or Excel file into a frame with normalized column names."""
+    if filename.lower().endswith((".xlsx", ".xls")):
+        frame = pd.read_excel(file, dtype=str)
+    else:
+        frame = pd.read_csv(file, dtype=str)
+    frame.columns = [str(col).strip().lower() for col in frame.columns]
+    return frame
+
+
+def validate_orders(frame, experiment_data=None):
+    """Returns a cleaned copy of `frame` with an `error` column ("" for valid rows).
+
+    Row numbers in `row` match the spreadsheet (header is row 1).
+    """
+    missing = [col for col in REQUIRED_COLUMNS if col not in frame.columns]
+    if missing:
+        raise ValueError(f"Missing required column(s): {', '.join(missing)}")
+    optimizer = get_optimizer()
+    if experiment_data is None:
+        experiment_data = optimizer.experiment_data
+    frame = frame.reset_index(drop=True)
+
+    orders = pd.DataFrame({"row": frame.index + 2}, index=frame.index)
+    errors = pd.Series("", index=frame.index)
+
+    def flag(mask, message):
+        nonlocal errors
+        errors = errors.mask(mask, errors + message + "; ")
+
+    for col in REQUIRED_COLUMNS:
+        orders[col] = frame[col].fillna("").astype(str).str.strip()
+        flag(orders[col] == "", f"{col} is required")
+
+    # Dates: blank means today, anything unparseable is an error
+    raw_dates = frame["date"].fillna("").astype(str).str.strip() if "date" in frame.columns \
+        else pd.Series("", index=frame.index)
+    parsed = pd.to_datetime(raw_dates.mask(raw_dates == ""), errors="coerce", format="mixed")
+    flag((raw_dates != "") & parsed.isna(), "invalid date")
+    orders["date"] = parsed.dt.strftime("%Y-%m-%d").fillna(datetime.now().strftime("%Y-%m-%d"))
+
+    # Experiments: explode to one row per (order, experiment) and check them all at once
+    orders["experiments"] = [[] for _ in range(len(orders))]
+    if "experiments" in frame.columns:
+        tokens = (frame["experiments"].fillna("").astype(str)
+                  .str.replace(r"[;,\s]+", " ", regex=True).str.strip()
+                  .str.split(" ").explode())
+        tokens = tokens[tokens != ""]
+        numbers = pd.to_numeric(tokens, errors="coerce")
+        known = numbers.isin(list(experiment_data))
+        bad_rows = (~known).groupby(level=0).any().reindex(frame.index, fill_value=False)
+        flag(bad_rows, "unknown experiment number")
+
+        reagent_counts = pd.Series({exp: len(data["reagents"]) for exp, data in experiment_data.items()})
+        valid_numbers = numbers[known].astype(int)
+        needed = valid_numbers.map(reagent_counts).groupby(level=0).sum() \
+            .reindex(frame.index, fill_value=0)
+        flag(needed > optimizer.MAX_LOCATIONS, "experiments exceed tray locations")
+
+        grouped = valid_numbers.groupby(level=0).unique()
+        orders["experiments"] = [sorted(int(exp) for exp in grouped.get(idx, [])) for idx in orders.index]
+
+    orders["error"] = errors.str.rstrip("; ")
+    return orders
+
+
+def import_work_orders(conn, frame, optimize=False, job_queue=None):
+    """Validates and inserts the orders in `frame`.
+
+    Returns an ImportResult with the created rows (row, wo_id), the
+    rejected rows (row, error) and, when `optimize` is set, the ids of the
+    tray configuration jobs queued for orders that listed experiments.
+    """
+    orders = validate_orders(frame)
+    valid = orders[orders["error"] == ""]
+    errors = orders.loc[orders["error"] != "", ["row", "error"]].reset_index(drop=True)
+
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        wo_ids = reserve_wo_numbers(c, len(valid))
+        valid = valid.assign(wo_id=wo_ids)
+        c.executemany("""INSERT INTO work_orders
+                         (id, customer, requester, date, status, lifecycle_state, state_changed)
+                         VALUES (?, ?, ?, ?, 'Open', 'Created', datetime('now', 'localtime'))""",
+                      valid[["wo_id", "customer", "requester", "date"]].itertuples(index=False, name=None))
+        c.executemany("""INSERT INTO inventory
+                         (wo_id, date, status)
+                         VALUES (?, ?, 'Created')""",
+                      valid[["wo_id", "date"]].itertuples(index=False, name=None))
+        audit_log.record_events(c, [(audit_log.TRANSITION, wo_id, None, {"from": None, "to": "Created"})
+                                    for wo_id in valid["wo_id"]])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    audit_log.maybe_snapshot(conn)
+    shared_cache.invalidate(shared_cache.DASHBOARD)
+
+    job_ids = []
+    if optimize and job_queue is not None:
+        for wo_id, experiments in valid.loc[valid["experiments"].str.len() > 0,
+                                            ["wo_id", "experiments"]].itertuples(index=False):
+            job_ids.append(job_queue.submit("configure_work_order",
+                                            {"wo_id": wo_id, "experiments": experiments}))
+
+    created = valid[["row", "wo_id"]].reset_index(drop=True)
+    return ImportResult(created, errors, job_ids)
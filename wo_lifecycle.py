@@ -0,0 +1,90 @@
+"""Work-order lifecycle state machine.
+
+Each work order carries its lifecycle state in `work_orders.lifecycle_state`
+(with the time of the last change in `state_changed`). Every write path
+moves the state with `transition()` inside its own transaction, which also
+appends the change to the audit log, so status lookups are a single
+indexed point read instead of a join over trays, production and shipping.
+
+    Created -> Configured -> Production Complete -> Shipped
+"""
+import audit_log
+
+CREATED = "Created"
+CONFIGURED = "Configured"
+PRODUCTION_COMPLETE = "Production Complete"
+SHIPPED = "Shipped"
+
+STATES = [CREATED, CONFIGURED, PRODUCTION_COMPLETE, SHIPPED]
+
+# Allowed target states for each state; re-saving a configuration is allowed
+TRANSITIONS = {
+    CREATED: {CONFIGURED},
+    CONFIGURED: {CONFIGURED, PRODUCTION_COMPLETE},
+    PRODUCTION_COMPLETE: {SHIPPED},
+    SHIPPED: set(),
+}
+
+# Next step shown to the operator and the tab index that handles it
+NEXT_STEPS = {
+    CREATED: ("Configure Tray", 2),
+    CONFIGURED: ("Complete Production", 4),
+    PRODUCTION_COMPLETE: ("Ship Tray", 5),
+    SHIPPED: ("Work Order Complete", None),
+}
+
+
+class InvalidTransition(ValueError):
+    pass
+
+
+def get_state(c, wo_id):
+    c.execute("SELECT lifecycle_state FROM work_orders WHERE id = ?", (wo_id,))
+    row = c.fetchone()
+    if row is None:
+        raise ValueError(f"Unknown work order: {wo_id}")
+    return row[0]
+
+
+def transition(c, wo_id, new_state):
+    """Moves a work order to `new_state`; call inside the write path's transaction."""
+    current = get_state(c, wo_id)
+    if new_state not in TRANSITIONS.get(current, set()):
+        raise InvalidTransition(f"Work order {wo_id} cannot go from {current} to {new_state}")
+    c.execute("""UPDATE work_orders
+                 SET lifecycle_state = ?, state_changed = datetime('now', 'localtime')
+                 WHERE id = ? AND lifecycle_state = ?""", (new_state, wo_id, current))
+    if c.rowcount != 1:
+        raise InvalidTransition(f"Work order {wo_id} changed state concurrently")
+    audit_log.record_event(c, audit_log.TRANSITION, wo_id, payload={"from": current, "to": new_state})
+    return current
+
+
+def next_step(state):
+    return NEXT_STEPS.get(state, ("Work Order Complete", None))
+
+
+def migrate(c):
+    """Adds the lifecycle columns to an existing database and backfills them once."""
+    c.execute("PRAGMA table_info(work_orders)")
+    columns = {row[1] for row in c.fetchall()}
+    if "lifecycle_state" not in columns:
+        c.execute("ALTER TABLE work_orders ADD COLUMN lifecycle_state TEXT")
+        c.execute("ALTER TABLE work_orders ADD COLUMN state_changed TEXT")
+        c.execute("""
+            UPDATE work_orders SET
+                lifecycle_state = CASE
+                    WHEN EXISTS (SELECT 1 FROM shipping s WHERE s.wo_id = work_orders.id) THEN 'Shipped'
+                    WHEN EXISTS (SELECT 1 FROM production p WHERE p.wo_id = work_orders.id
+                                 AND p.status = 'Complete') THEN 'Production Complete'
+                    WHEN EXISTS (SELECT 1 FROM trays t WHERE t.wo_id = work_orders.id) THEN 'Configured'
+                    ELSE 'Created'
+                END,
+                state_changed = COALESCE(
+                    (SELECT MAX(ship_date) FROM shipping s WHERE s.wo_id = work_orders.id),
+                    (SELECT MAX(end_date) FROM production p WHERE p.wo_id = work_orders.id),
+                    (SELECT MAX(date) FROM trays t WHERE t.wo_id = work_orders.id),
+                    date)
+        """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_work_orders_state ON work_orders(lifecycle_state)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_work_orders_state_changed ON work_orders(state_changed)")